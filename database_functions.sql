@@ -0,0 +1,182 @@
+-- Study Buddy: functions / indexes bổ sung cho Supabase (PostgreSQL)
+-- Chạy trong Supabase SQL Editor sau database_schema.sql.
+-- Code có fallback khi các function này chưa được tạo.
+
+-- Write-behind queue: cập nhật message_count và updated_at một lần cho mỗi session mỗi lần flush
+CREATE OR REPLACE FUNCTION touch_chat_session(session_uuid UUID, message_delta INTEGER, touched_at TIMESTAMPTZ)
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    UPDATE chat_sessions
+    SET message_count = COALESCE(message_count, 0) + message_delta,
+        updated_at = GREATEST(COALESCE(updated_at, touched_at), touched_at)
+    WHERE id = session_uuid;
+$$;
+
+-- Preview của session lưu sẵn (tin nhắn user đầu tiên) để liệt kê sessions bằng một query
+ALTER TABLE chat_sessions ADD COLUMN IF NOT EXISTS preview TEXT;
+
+CREATE OR REPLACE FUNCTION set_chat_session_preview()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF NEW.role = 'user' THEN
+        UPDATE chat_sessions
+        SET preview = LEFT(NEW.content, 100)
+        WHERE id = NEW.session_id AND preview IS NULL;
+    END IF;
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_set_chat_session_preview ON messages;
+CREATE TRIGGER trg_set_chat_session_preview
+    AFTER INSERT ON messages
+    FOR EACH ROW EXECUTE FUNCTION set_chat_session_preview();
+
+-- Backfill preview cho các session cũ
+UPDATE chat_sessions s
+SET preview = LEFT(m.content, 100)
+FROM (
+    SELECT DISTINCT ON (session_id) session_id, content
+    FROM messages
+    WHERE role = 'user'
+    ORDER BY session_id, created_at
+) m
+WHERE s.id = m.session_id AND s.preview IS NULL;
+
+-- Preview cho một trang sessions khi chưa có cột preview: một dòng mỗi session (DISTINCT ON),
+-- dùng index (session_id, created_at) thay vì tải mọi tin nhắn user của cả trang
+CREATE OR REPLACE FUNCTION session_previews(session_ids UUID[])
+RETURNS TABLE (session_id UUID, preview TEXT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT DISTINCT ON (m.session_id) m.session_id, LEFT(m.content, 100)
+    FROM messages m
+    WHERE m.session_id = ANY(session_ids) AND m.role = 'user'
+    ORDER BY m.session_id, m.created_at;
+$$;
+
+-- Keyset pagination danh sách sessions: (updated_at, id) giảm dần theo user
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated
+    ON chat_sessions (user_id, updated_at DESC, id DESC);
+
+-- Keyset pagination tin nhắn: trang mới nhất và "tải tin nhắn cũ hơn" theo (created_at, id)
+CREATE INDEX IF NOT EXISTS idx_messages_session_created
+    ON messages (session_id, created_at DESC, id DESC);
+
+-- Thống kê tính ở server: số tin nhắn theo role của một session (dùng index session_id)
+CREATE OR REPLACE FUNCTION session_message_stats(session_uuid UUID)
+RETURNS TABLE (role TEXT, message_count BIGINT)
+LANGUAGE sql STABLE
+AS $$
+    SELECT m.role::TEXT, COUNT(*)
+    FROM messages m
+    WHERE m.session_id = session_uuid
+    GROUP BY m.role;
+$$;
+
+-- Thống kê toàn database: số dòng ước lượng từ pg_class (O(1)) hoặc đếm chính xác
+CREATE OR REPLACE FUNCTION database_statistics(use_estimates BOOLEAN DEFAULT TRUE)
+RETURNS JSON
+LANGUAGE plpgsql STABLE
+AS $$
+DECLARE
+    result JSON;
+BEGIN
+    IF use_estimates THEN
+        SELECT json_build_object(
+            'total_sessions', (SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = 'chat_sessions'::regclass),
+            'total_messages', (SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = 'messages'::regclass),
+            'total_users', (SELECT GREATEST(reltuples, 0)::BIGINT FROM pg_class WHERE oid = '"user"'::regclass),
+            'user_messages', (SELECT COALESCE(SUM(user_messages), 0)::BIGINT FROM user_chat_stats),
+            'ai_messages', (SELECT COALESCE(SUM(ai_messages), 0)::BIGINT FROM user_chat_stats),
+            'estimated', TRUE
+        ) INTO result;
+    ELSE
+        SELECT json_build_object(
+            'total_sessions', (SELECT COUNT(*) FROM chat_sessions),
+            'total_messages', (SELECT COUNT(*) FROM messages),
+            'total_users', (SELECT COUNT(*) FROM "user"),
+            'user_messages', (SELECT COUNT(*) FROM messages WHERE role = 'user'),
+            'ai_messages', (SELECT COUNT(*) FROM messages WHERE role = 'assistant'),
+            'estimated', FALSE
+        ) INTO result;
+    END IF;
+    RETURN result;
+END;
+$$;
+
+-- Thống kê theo user được materialize, làm mới định kỳ (vd. pg_cron mỗi 10 phút):
+--   SELECT cron.schedule('refresh-user-chat-stats', '*/10 * * * *', 'SELECT refresh_user_chat_stats()');
+CREATE MATERIALIZED VIEW IF NOT EXISTS user_chat_stats AS
+SELECT
+    s.user_id,
+    COUNT(DISTINCT s.id) AS session_count,
+    COUNT(m.id) AS message_count,
+    COUNT(m.id) FILTER (WHERE m.role = 'user') AS user_messages,
+    COUNT(m.id) FILTER (WHERE m.role = 'assistant') AS ai_messages,
+    MAX(s.updated_at) AS last_activity,
+    NOW() AS refreshed_at
+FROM chat_sessions s
+LEFT JOIN messages m ON m.session_id = s.id
+GROUP BY s.user_id;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_user_chat_stats_user ON user_chat_stats (user_id);
+
+CREATE OR REPLACE FUNCTION refresh_user_chat_stats()
+RETURNS VOID
+LANGUAGE sql
+AS $$
+    REFRESH MATERIALIZED VIEW CONCURRENTLY user_chat_stats;
+$$;
+
+-- Retention job: xóa một batch sessions cũ (và dữ liệu con) trong một transaction.
+-- Gọi lặp lại tới khi "sessions" < batch_size; bị gián đoạn thì chạy lại để tiếp tục.
+CREATE OR REPLACE FUNCTION cleanup_old_sessions_batch(cutoff TIMESTAMPTZ, batch_size INTEGER DEFAULT 500)
+RETURNS JSON
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    batch_ids UUID[];
+    deleted_pages BIGINT;
+    deleted_documents BIGINT;
+    deleted_messages BIGINT;
+    deleted_sessions BIGINT;
+BEGIN
+    SELECT ARRAY(
+        SELECT id FROM chat_sessions
+        WHERE updated_at < cutoff
+        ORDER BY updated_at
+        LIMIT batch_size
+        FOR UPDATE SKIP LOCKED
+    ) INTO batch_ids;
+
+    DELETE FROM document_pages
+    WHERE document_id IN (SELECT id FROM session_documents WHERE session_id = ANY(batch_ids));
+    GET DIAGNOSTICS deleted_pages = ROW_COUNT;
+
+    DELETE FROM session_documents WHERE session_id = ANY(batch_ids);
+    GET DIAGNOSTICS deleted_documents = ROW_COUNT;
+
+    DELETE FROM messages WHERE session_id = ANY(batch_ids);
+    GET DIAGNOSTICS deleted_messages = ROW_COUNT;
+
+    DELETE FROM chat_sessions WHERE id = ANY(batch_ids);
+    GET DIAGNOSTICS deleted_sessions = ROW_COUNT;
+
+    RETURN json_build_object(
+        'sessions', deleted_sessions,
+        'messages', deleted_messages,
+        'documents', deleted_documents,
+        'pages', deleted_pages
+    );
+END;
+$$;
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at);
+
+-- Tra cứu nội dung trang của tài liệu đã lưu (document_pages)
+CREATE INDEX IF NOT EXISTS idx_document_pages_document_page
+    ON document_pages (document_id, page_number);
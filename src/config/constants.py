@@ -19,6 +19,7 @@ MIN_FILE_SIZE = 1  # 1 byte
 MAX_MESSAGE_LENGTH = 10000
 MAX_MESSAGES_PER_SESSION = 1000
 MAX_CHAT_HISTORY = 50
+MESSAGES_PAGE_SIZE = 50  # Số tin nhắn gần nhất load mỗi lần ("tải tin nhắn cũ hơn" lấy thêm từng trang)
 
 # Cấu hình document processing
 MAX_DOCUMENT_CHARS = 1000000  # 1M chars
@@ -31,17 +32,109 @@ MIN_QUESTIONS_COUNT = 3
 DEFAULT_PDF_DPI = 150
 MAX_PDF_DPI = 300
 MIN_PDF_DPI = 72
+OCR_MODEL = "mistral-ocr-latest"
+PAGE_STORE_MAX_DOCUMENTS = 32  # Số tài liệu PDF giữ nội dung trang trong bộ nhớ
+PDF_HANDLE_CACHE_SIZE = 16  # Số fitz.Document giữ mở để render trang / đọc metadata
+
+# Cache ảnh trang PDF đã render, key (doc_hash, trang, DPI bucket)
+PAGE_IMAGE_DPI_BUCKETS = [72, 100, 150, 200, 250, 300]  # DPI yêu cầu được làm tròn lên bucket gần nhất
+PAGE_IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024  # 256MB ảnh đã giải nén trong bộ nhớ
+PAGE_IMAGE_CACHE_DIR = ".cache/page_images"  # Tầng cache trên đĩa (bật bằng FEATURES['enable_page_image_disk_cache'])
+PAGE_IMAGE_FORMATS = ['JPEG', 'WEBP', 'PNG']
+PAGE_IMAGE_FORMAT = 'JPEG'  # Định dạng ảnh trang gửi xuống trình duyệt
+PAGE_IMAGE_QUALITY = 80  # Chất lượng nén JPEG/WebP (1-100, PNG bỏ qua)
+PAGE_IMAGE_ENCODED_CACHE_MAX_BYTES = 64 * 1024 * 1024  # 64MB ảnh đã nén sẵn để gửi xuống trình duyệt
+PAGE_THUMBNAIL_MAX_SIDE = 160  # pixels, cạnh dài nhất của thumbnail
+PAGE_THUMBNAIL_STRIP_MAX = 8  # Số thumbnail tối đa hiển thị trong page picker
+PAGE_PREFETCH_WORKERS = 2  # Thread render trước trang kế bên (dùng chung cả process)
+PAGE_PREFETCH_MAX_IN_FLIGHT = 2  # Số trang prefetch đang chờ/đang chạy tối đa mỗi session
+PAGE_PREFETCH_RADIUS = 1  # Số trang đã chọn trước/sau trang hiện tại được prefetch
+PAGE_PREFETCH_MAX_SESSIONS = 256  # Số session giữ trạng thái prefetch (LRU)
+PAGE_PREFETCH_SESSION_TTL = 30 * 60  # 30 phút không xem trang thì bỏ trạng thái prefetch của session
+MIN_TEXT_LAYER_CHARS = 20  # Trang có ít hơn số ký tự này sẽ được gửi đi OCR
+OCR_SHARD_PAGES = 8  # Số trang mỗi shard gửi Mistral OCR
+OCR_MAX_WORKERS = 4  # Số shard OCR chạy song song tối đa
+OCR_SHARD_MAX_RETRIES = 2
+
+# Ingestion cache (dùng chung giữa các session, key theo SHA-256 của file)
+INGESTION_CACHE_MAX_DOCUMENTS = 500
+INGESTION_CACHE_MAX_MB = 256
+
+# Chunking
+CHUNK_BOUNDARY_CHARS = '.!?\n'  # Ký tự kết thúc câu/đoạn dùng làm điểm ngắt chunk
+CHUNK_BOUNDARY_LOOKBACK = 100  # Tìm điểm ngắt trong bao nhiêu ký tự cuối chunk
+CHUNK_CACHE_MAX_DOCUMENTS = 64
+
+# Retrieval (RAG)
+RETRIEVAL_CHUNK_SIZE = 500
+RETRIEVAL_CHUNK_OVERLAP = 100
+RETRIEVAL_INDEX_MAX_DOCUMENTS = 64  # Số index BM25 giữ trong bộ nhớ
+BM25_K1 = 1.5
+BM25_B = 0.75
+DEFAULT_EMBEDDING_MODEL = "text-embedding-nomic-embed-text-v1.5"  # Model embedding load trong LM Studio
+EMBEDDING_BATCH_SIZE = 32  # Số chunk mỗi request /v1/embeddings
+EMBEDDING_QUERY_CACHE_SIZE = 256  # Số embedding câu hỏi giữ lại mỗi session
+EMBEDDINGS_CACHE_DIR = ".cache/embeddings"  # Thư mục lưu vector (.npy) theo nội dung tài liệu
+RETRIEVAL_MODES = ('bm25', 'dense', 'hybrid')
+DEFAULT_RETRIEVAL_MODE = 'hybrid'
+RETRIEVAL_TOP_K = 10  # Số chunk mỗi retriever trả về trước khi fusion
+RRF_K = 60  # Hằng số reciprocal-rank fusion
+RETRIEVAL_LATENCY_BUDGET_MS = 300  # Quá ngân sách thì bỏ nhánh dense, dùng kết quả BM25
 
 # Database settings
 MAX_SESSION_TITLE_LENGTH = 100
+SESSIONS_PAGE_SIZE = 20  # Số sessions mỗi trang trong sidebar (keyset pagination)
+SESSION_PREVIEW_FALLBACK_MESSAGES = 5  # Số tin nhắn user tối đa mỗi session khi lấy preview không qua RPC
 MAX_CONTENT_LENGTH = 50000
 DB_TIMEOUT = 30  # seconds
 
+# Storage backend của ChatPersistence (chọn bằng biến môi trường STORAGE_BACKEND)
+STORAGE_BACKENDS = ['supabase', 'sqlite']
+DEFAULT_STORAGE_BACKEND = 'supabase'
+SQLITE_DB_PATH = ".data/study_buddy.db"  # Ghi đè bằng biến môi trường SQLITE_DB_PATH
+SQLITE_BUSY_TIMEOUT = 30  # seconds, chờ lock ghi của SQLite
+
+# Write-behind queue cho tin nhắn
+MESSAGE_FLUSH_INTERVAL = 0.5  # seconds
+MESSAGE_BATCH_SIZE = 50  # Số tin nhắn tối đa mỗi multi-row insert
+MESSAGE_RETRY_DELAY = 1.0  # seconds, chờ trước khi thử lại batch lỗi
+MESSAGE_MAX_ATTEMPTS = 5  # Số lần ghi tối đa mỗi tin nhắn khi lỗi tạm thời, quá thì chuyển dead-letter
+MESSAGE_DEAD_LETTER_MAX = 1000  # Số tin nhắn ghi lỗi vĩnh viễn giữ lại để kiểm tra
+MESSAGE_FLUSH_TIMEOUT = 30  # seconds, thời gian flush() mặc định
+MESSAGE_SHUTDOWN_TIMEOUT = 10  # seconds, thời gian flush tối đa khi process thoát
+MESSAGE_READ_FLUSH_TIMEOUT = 5  # seconds, flush tin nhắn đang chờ trước khi đọc lại session
+
+# Retention job: xóa sessions cũ theo từng batch (mỗi batch là một transaction độc lập)
+CLEANUP_BATCH_SIZE = 500  # Số sessions mỗi batch
+
+# Ghi nội dung từng trang (document_pages) bằng multi-row insert
+DOCUMENT_PAGES_BATCH_SIZE = 100  # Số trang tối đa mỗi insert
+DOCUMENT_PAGES_BATCH_MAX_CHARS = 1000000  # Tổng số ký tự tối đa mỗi insert
+
 # LLM settings
 LOCAL_LLM_DEFAULT_URL = "http://localhost:1234/v1"
 MAX_LLM_TOKENS = 2000
 DEFAULT_TEMPERATURE = 0.7
-MAX_CONTEXT_LENGTH = 4000
+LLM_REQUEST_TIMEOUT = 120  # seconds (model local có thể sinh chậm)
+
+# HTTP connection pool dùng chung cho LLM/OCR clients (process-level)
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+HTTP_KEEPALIVE_EXPIRY = 60  # seconds
+HTTP_CONNECT_TIMEOUT = 10  # seconds
+OCR_REQUEST_TIMEOUT = 300  # seconds
+MAX_CONTEXT_LENGTH = 4000  # Context window của model (token)
+
+# Token budget (ước lượng token cục bộ, không cần tokenizer của model)
+CHARS_PER_TOKEN = 4  # Text ASCII
+TOKENS_PER_EXTRA_BYTE = 0.5  # Ký tự nhiều byte UTF-8 (tiếng Việt có dấu) tách dày hơn
+CONTEXT_SAFETY_MARGIN_TOKENS = 200  # Bù sai số ước lượng
+PROMPT_OVERHEAD_TOKENS = 150  # Template prompt cố định (hướng dẫn, tiêu đề)
+TOKEN_COUNT_CACHE_SIZE = 8192
+TOKEN_COUNT_CACHE_MAX_CHARS = 20000
+SUMMARY_MAX_TOKENS = 300
+DOCUMENT_QA_MAX_TOKENS = 400
+DOCUMENT_ANSWER_PREFIX = "📄 **Dựa trên tài liệu:**"
 
 # Error messages
 ERROR_MESSAGES = {
@@ -96,7 +189,8 @@ WARNING_MESSAGES = {
     'beta_feature': 'Đây là tính năng beta, có thể không ổn định.',
     'data_loss': 'Dữ liệu có thể bị mất nếu không lưu.',
     'session_limit': 'Gần đạt giới hạn số session.',
-    'storage_limit': 'Dung lượng lưu trữ gần hết.'
+    'storage_limit': 'Dung lượng lưu trữ gần hết.',
+    'embeddings_unavailable': 'Không tạo được embeddings từ Local LLM, chỉ dùng tìm kiếm theo từ khóa.'
 }
 
 # Regex patterns
@@ -118,14 +212,23 @@ DEFAULTS = {
     'retry_delay': 1.0  # seconds
 }
 
+# Khởi động (cold start)
+STYLE_CSS_PATH = "assets/styles/style.css"  # Đọc một lần cho cả process
+LOGIN_IMPORT_BUDGET_SECONDS = 0.5  # Ngân sách import src.pages.login_page (không tính streamlit)
+STARTUP_DEFERRED_MODULES = ('supabase', 'postgrest', 'fitz', 'mistralai', 'openai', 'httpx', 'docx', 'PIL')  # Chỉ import khi tính năng cần
+
 # Feature flags
 FEATURES = {
     'enable_ocr': True,
     'enable_rag': True,
+    'enable_embeddings': True,
     'enable_chat_export': True,
     'enable_document_cache': True,
     'enable_session_persistence': True,
     'enable_auto_save': True,
+    'enable_write_behind': True,
+    'enable_page_image_disk_cache': False,
+    'enable_page_prefetch': True,
     'enable_offline_mode': True,
     'enable_debug_mode': False,
     'enable_telemetry': False
@@ -144,3 +247,11 @@ CACHE_SETTINGS = {
     'max_size': 100,  # số items
     'cleanup_interval': 300  # 5 minutes
 }
+
+# Read-through cache của ChatPersistence (session list, messages, documents)
+PERSISTENCE_CACHE_TTL = 300  # 5 minutes
+PERSISTENCE_CACHE_MAX_ITEMS = 2000
+# Nội dung tài liệu/trang load theo yêu cầu (giới hạn theo tổng số ký tự)
+DOCUMENT_CONTENT_CACHE_TTL = 1800  # 30 minutes
+DOCUMENT_CONTENT_CACHE_MAX_ITEMS = 512
+DOCUMENT_CONTENT_CACHE_MAX_CHARS = 20000000  # 20M chars
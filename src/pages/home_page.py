@@ -9,9 +9,11 @@ from ..utils.ui_components import (
     render_message, render_sidebar, render_question_carousel, add_custom_css,
     render_tabbed_interface, render_page_selector, render_page_preview, 
     render_page_chat_interface, render_document_info_card,
-    render_pdf_page_image_viewer, render_page_summary_from_ocr
+    render_pdf_page_image_viewer, render_page_summary_from_ocr, render_streaming_message
 )
-from supabase import create_client
+from ..utils.storage import get_storage_backend
+from ..utils.resources import get_resource
+from ..config.constants import SESSIONS_PAGE_SIZE, DEFAULT_STORAGE_BACKEND, STYLE_CSS_PATH
 
 # Enhanced Home Page Design
 # Author: Nguyễn Ngọc Công Anh - Frontend & UI/UX Enhancement
@@ -32,26 +34,42 @@ st.set_page_config(
     }
 )
 
-# Load CSS tùy chỉnh
-def load_css():
+# CSS mặc định khi không có file style.css
+DEFAULT_CSS = """
+        .main .block-container { padding-top: 1rem; }
+        .stButton > button { border-radius: 8px; }
+"""
+
+def read_css(path: str = STYLE_CSS_PATH) -> str:
+    """Đọc file CSS tùy chỉnh (fallback CSS mặc định nếu không có file)"""
     try:
-        with open("assets/styles/style.css", encoding='utf-8') as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        with open(path, encoding='utf-8') as f:
+            return f.read()
     except UnicodeDecodeError:
         # Fallback với encoding khác nếu UTF-8 không hoạt động
-        with open("assets/styles/style.css", encoding='latin-1') as f:
-            st.markdown(f"<style>{f.read()}</style>", unsafe_allow_html=True)
+        with open(path, encoding='latin-1') as f:
+            return f.read()
     except FileNotFoundError:
         # File CSS không tồn tại - sử dụng CSS mặc định
-        st.markdown("""
-        <style>
-        .main .block-container { padding-top: 1rem; }
-        .stButton > button { border-radius: 8px; }
-        </style>
-        """, unsafe_allow_html=True)
+        return DEFAULT_CSS
+
+# Load CSS tùy chỉnh
+def load_css():
+    # File chỉ được đọc một lần cho cả process, mỗi lần rerun chỉ gửi lại nội dung đã cache
+    css = get_resource(("static_css", STYLE_CSS_PATH), read_css)
+    st.markdown(f"<style>{css}</style>", unsafe_allow_html=True)
 
 # Khởi tạo session state
 def init_session_state():
+    # Storage backend local (SQLite) thay cho Supabase nếu STORAGE_BACKEND=sqlite
+    storage_backend = os.getenv("STORAGE_BACKEND", DEFAULT_STORAGE_BACKEND)
+    if "supabase" not in st.session_state and storage_backend != "supabase":
+        try:
+            st.session_state.supabase = get_storage_backend(storage_backend)
+        except Exception as e:
+            st.error(f"❌ Lỗi khởi tạo storage backend '{storage_backend}': {str(e)}")
+            st.stop()
+    
     # Khởi tạo Supabase connection
     if "supabase" not in st.session_state:
         # Đọc credentials từ environment variables
@@ -69,6 +87,9 @@ def init_session_state():
         
         if SUPABASE_URL and SUPABASE_KEY:
             try:
+                # Supabase SDK chỉ được import khi thực sự kết nối
+                from supabase import create_client
+                
                 st.session_state.supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
                 st.success("✅ Đã kết nối Database (Supabase)")
             except Exception as e:
@@ -91,6 +112,8 @@ def init_session_state():
         st.session_state.user_sessions = []
     if "session_loaded" not in st.session_state:
         st.session_state.session_loaded = False
+    if "messages_has_older" not in st.session_state:
+        st.session_state.messages_has_older = False
     
     # Original states
     if "messages" not in st.session_state:
@@ -242,6 +265,7 @@ def render_enhanced_sidebar():
                     st.session_state.user_sessions = []
                     st.session_state.session_loaded = False
                     st.session_state.messages = []
+                    st.session_state.messages_has_older = False
                     st.session_state.uploaded_documents = []
                     st.session_state.document_summary = ""
                     st.session_state.suggested_questions = []
@@ -349,6 +373,7 @@ def main():
             if st.button("➕ Chat mới", use_container_width=True):
                 st.session_state.current_session_id = None
                 st.session_state.messages = []
+                st.session_state.messages_has_older = False
                 st.session_state.document_summary = ""
                 st.session_state.suggested_questions = []
                 st.session_state.document_text = ""
@@ -398,7 +423,9 @@ def main():
                             ):
                                 # Load session
                                 st.session_state.current_session_id = session['id']
-                                st.session_state.messages = st.session_state.chat_persistence.load_session_messages(session['id'])
+                                # Chỉ load trang tin nhắn gần nhất, tin nhắn cũ hơn load theo yêu cầu
+                                (st.session_state.messages,
+                                 st.session_state.messages_has_older) = st.session_state.chat_persistence.load_message_page(session['id'])
                                 
                                 # Reset document states when switching sessions
                                 st.session_state.document_summary = ""
@@ -420,10 +447,25 @@ def main():
                                     if st.session_state.current_session_id == session['id']:
                                         st.session_state.current_session_id = None
                                         st.session_state.messages = []
+                                        st.session_state.messages_has_older = False
                                     
                                     st.rerun()
                     
                     st.divider()
+                
+                # Keyset pagination: tải thêm sessions cũ hơn session cuối cùng đang hiển thị
+                last_cursor = st.session_state.user_sessions[-1].get('cursor')
+                if (last_cursor and len(st.session_state.user_sessions) >= SESSIONS_PAGE_SIZE
+                        and st.session_state.get('sessions_exhausted_at') != last_cursor):
+                    if st.button("⬇️ Tải thêm cuộc trò chuyện", use_container_width=True):
+                        older_sessions = st.session_state.chat_persistence.get_user_sessions(
+                            st.session_state.user_id,
+                            cursor=last_cursor
+                        )
+                        if len(older_sessions) < SESSIONS_PAGE_SIZE:
+                            st.session_state.sessions_exhausted_at = older_sessions[-1]['cursor'] if older_sessions else last_cursor
+                        st.session_state.user_sessions.extend(older_sessions)
+                        st.rerun()
             else:
                 st.info("Chưa có cuộc trò chuyện nào. Hãy bắt đầu chat!")
         
@@ -435,40 +477,69 @@ def main():
         )
         
         if uploaded_file is not None:
-            # Kiểm tra xem file đã được xử lý chưa bằng tên và kích thước
-            file_already_processed = False
-            for doc in st.session_state.uploaded_documents:
-                if (doc["file"].name == uploaded_file.name and 
-                    doc["file"].size == uploaded_file.size):
-                    file_already_processed = True
-                    break
+            # Kiểm tra xem file đã được xử lý chưa bằng content hash
+            doc_processor = st.session_state.doc_processor
+            doc_hash = doc_processor.get_document_hash(uploaded_file)
+            file_already_processed = any(
+                doc.get("hash") == doc_hash for doc in st.session_state.uploaded_documents
+            )
             
             if not file_already_processed:
-                with st.spinner("Đang xử lý tài liệu..."):
-                    doc_content = st.session_state.doc_processor.process_document(uploaded_file)
-                    if doc_content:
-                        # Tóm tắt tài liệu
+                # File đã được xử lý ở session khác -> bỏ qua OCR, tóm tắt và tạo câu hỏi
+                cached_doc = doc_processor.get_cached_document(doc_hash)
+                summary, questions = "", []
+                if cached_doc:
+                    doc_content = cached_doc["content"]
+                    summary = cached_doc["summary"]
+                    questions = cached_doc["questions"]
+                else:
+                    with st.spinner("Đang xử lý tài liệu..."):
+                        doc_content = doc_processor.process_document(uploaded_file)
+                
+                if doc_content:
+                    # Tóm tắt/câu hỏi chưa có (tài liệu mới hoặc lần trước LLM lỗi) thì tạo lại
+                    summary_from_llm = questions_from_llm = True
+                    regenerated = not cached_doc
+                    if not summary:
                         with st.spinner("Đang tóm tắt tài liệu..."):
-                            summary = st.session_state.doc_processor.summarize_text(doc_content)
-                            st.session_state.document_summary = summary
-                        
-                        # Tạo câu hỏi gợi ý
+                            summary = doc_processor.summarize_text(doc_content)
+                        summary_from_llm = doc_processor.last_summary_from_llm
+                        regenerated = True
+                    
+                    # Tạo câu hỏi gợi ý
+                    if not questions:
                         with st.spinner("Đang tạo câu hỏi gợi ý..."):
-                            questions = st.session_state.doc_processor.generate_questions(doc_content)
-                            st.session_state.suggested_questions = questions
-                        
-                        # Cache document text để tái sử dụng
-                        st.session_state.document_text = doc_content
-                        st.session_state.document_embeddings = []
-                        
-                        st.session_state.uploaded_documents.append({
-                            "file": uploaded_file,
-                            "content": doc_content,
-                            "timestamp": datetime.now(),
-                            "summary": summary,
-                            "questions": questions
-                        })
-                        st.success(f"✅ Đã xử lý xong: {uploaded_file.name}")
+                            questions = doc_processor.generate_questions(doc_content)
+                        questions_from_llm = doc_processor.last_questions_from_llm
+                        regenerated = True
+                    
+                    # Build index BM25 + embeddings một lần cho tài liệu (dùng chung cho chat, carousel, page chat)
+                    doc_processor.get_retrieval_index(doc_content)
+                    with st.spinner("Đang tạo embeddings cho tài liệu..."):
+                        vector_index = doc_processor.get_vector_index(doc_content)
+                    
+                    if regenerated:
+                        doc_processor.cache_processed_document(
+                            doc_hash, doc_content, summary, questions,
+                            summary_from_llm=summary_from_llm, questions_from_llm=questions_from_llm
+                        )
+                    
+                    st.session_state.document_summary = summary
+                    st.session_state.suggested_questions = questions
+                    
+                    # Cache document text để tái sử dụng
+                    st.session_state.document_text = doc_content
+                    st.session_state.document_embeddings = vector_index.vectors if vector_index is not None else []
+                    
+                    st.session_state.uploaded_documents.append({
+                        "file": uploaded_file,
+                        "hash": doc_hash,
+                        "content": doc_content,
+                        "timestamp": datetime.now(),
+                        "summary": summary,
+                        "questions": questions
+                    })
+                    st.success(f"✅ Đã xử lý xong: {uploaded_file.name}")
         
         # Hiển thị tài liệu đã upload
         if st.session_state.uploaded_documents:
@@ -497,6 +568,7 @@ def main():
         # Nút xóa lịch sử chat
         if st.button("🗑️ Xóa lịch sử chat"):
             st.session_state.messages = []
+            st.session_state.messages_has_older = False
             st.rerun()
     
     # Enhanced main area với welcome hero
@@ -535,6 +607,17 @@ def main():
         
         # Hiển thị messages
         with messages_container:
+            # Keyset pagination: tải trang tin nhắn cũ hơn tin nhắn đầu tiên đang hiển thị
+            first_cursor = st.session_state.messages[0].get('cursor') if st.session_state.messages else None
+            if st.session_state.messages_has_older and first_cursor:
+                if st.button("⬆️ Tải tin nhắn cũ hơn", key="load_older_messages", use_container_width=True):
+                    older_messages, st.session_state.messages_has_older = st.session_state.chat_persistence.load_message_page(
+                        st.session_state.current_session_id,
+                        before=first_cursor
+                    )
+                    st.session_state.messages = older_messages + st.session_state.messages
+                    st.rerun()
+            
             for message in st.session_state.messages:
                 render_message(message)
         
@@ -553,13 +636,15 @@ def main():
             if st.session_state.uploaded_documents and st.session_state.current_session_id:
                 for doc in st.session_state.uploaded_documents:
                     # Kiểm tra xem đã lưu chưa
-                    if not hasattr(doc, 'saved_to_db'):
+                    if not doc.get('saved_to_db'):
                         file_type = doc['file'].name.split('.')[-1].lower()
                         page_count = None
+                        pages = None
                         
-                        # Lấy page count cho PDF
+                        # Lấy page count và nội dung từng trang (đã OCR) cho PDF
                         if file_type == 'pdf':
                             page_count = st.session_state.doc_processor.get_pdf_page_count(doc['file'])
+                            pages = st.session_state.doc_processor.page_store.get_pages(doc['hash'])
                         
                         # Lưu vào database
                         document_id = st.session_state.chat_persistence.save_document_to_session(
@@ -571,7 +656,8 @@ def main():
                             doc['content'],
                             doc.get('summary', ''),
                             doc.get('questions', []),
-                            page_count
+                            page_count,
+                            pages
                         )
                         
                         if document_id:
@@ -615,38 +701,40 @@ def main():
             with messages_container:
                 render_message(user_message)
             
-            # Xử lý phản hồi AI
-            with st.spinner("Đang suy nghĩ..."):
-                # Nếu có document thì dùng OpenAI, không thì dùng ChatHandler
-                if st.session_state.document_text:
-                    response = st.session_state.doc_processor.answer_question_with_openai(
-                        prompt,
-                        st.session_state.document_text
-                    )
-                else:
-                    # Fallback cho chat thông thường
-                    response = st.session_state.chat_handler.generate_response(
-                        prompt, 
-                        st.session_state.messages[:-1],
-                        ""
-                    )
-                
-                # Thêm phản hồi AI vào UI
-                ai_message = {
-                    "role": "assistant",
-                    "content": response,
-                    "timestamp": datetime.now()
-                }
-                st.session_state.messages.append(ai_message)
-                
-                # Lưu AI response vào database
-                st.session_state.chat_persistence.save_message(
-                    st.session_state.user_id,
-                    st.session_state.current_session_id,
-                    "assistant",
-                    response
+            # Xử lý phản hồi AI (streaming: hiển thị từng đoạn ngay khi model sinh ra)
+            # Nếu có document thì dùng OpenAI, không thì dùng ChatHandler
+            if st.session_state.document_text:
+                response_stream = st.session_state.doc_processor.answer_question_stream(
+                    prompt,
+                    st.session_state.document_text
+                )
+            else:
+                # Fallback cho chat thông thường
+                response_stream = st.session_state.chat_handler.generate_response_stream(
+                    prompt, 
+                    st.session_state.messages[:-1],
+                    ""
                 )
             
+            with messages_container:
+                response = render_streaming_message(response_stream)
+            
+            # Thêm phản hồi AI vào UI
+            ai_message = {
+                "role": "assistant",
+                "content": response,
+                "timestamp": datetime.now()
+            }
+            st.session_state.messages.append(ai_message)
+            
+            # Lưu AI response (đã ghép đầy đủ) vào database một lần
+            st.session_state.chat_persistence.save_message(
+                st.session_state.user_id,
+                st.session_state.current_session_id,
+                "assistant",
+                response
+            )
+            
             # Rerun để hiển thị tin nhắn AI
             st.rerun()
     
@@ -731,8 +819,14 @@ def main():
                                 if page_content:
                                     all_pages_content += f"\n\n=== TRANG {page_num} ===\n{page_content}"
                         elif hasattr(selected_doc, 'get'):
-                            # Document từ database - implement sau
-                            all_pages_content = selected_doc.get('content', '')
+                            # Document từ database: nội dung load theo yêu cầu (đã cache)
+                            persistence = st.session_state.chat_persistence
+                            for page_num in selected_pages:
+                                page_content = persistence.load_document_page(selected_doc['id'], page_num)
+                                if page_content:
+                                    all_pages_content += f"\n\n=== TRANG {page_num} ===\n{page_content}"
+                            if not all_pages_content:
+                                all_pages_content = persistence.load_document_content(selected_doc['id']) or ''
                         else:
                             # Fallback - có thể là UploadedFile trực tiếp
                             st.warning("⚠️ Không thể xử lý loại tài liệu này cho nhiều trang.")
@@ -763,8 +857,11 @@ def main():
                                 selected_page
                             )
                         elif hasattr(selected_doc, 'get'):
-                            # Document từ database - implement sau
-                            page_content = selected_doc.get('content', '')
+                            # Document từ database: nội dung load theo yêu cầu (đã cache)
+                            page_content = st.session_state.chat_persistence.load_document_page_content(
+                                selected_doc['id'],
+                                selected_page
+                            )
                         else:
                             # Fallback
                             st.warning("⚠️ Không thể xử lý loại tài liệu này.")
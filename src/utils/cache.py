@@ -0,0 +1,183 @@
+"""
+Cache dùng chung cho Study Buddy (process-level, thread-safe)
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """LRU cache giới hạn số phần tử (và tùy chọn dung lượng), an toàn khi dùng từ nhiều session/thread"""
+
+    def __init__(self, max_items: int = 100, on_evict: Optional[Callable[[Hashable, Any], None]] = None,
+                 max_size: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        """
+        Args:
+            max_items: Số phần tử tối đa trước khi bị loại bỏ (evict)
+            on_evict: Callback (key, value) được gọi khi một phần tử bị loại bỏ
+            max_size: Tổng dung lượng tối đa (đơn vị do sizeof quyết định), None = không giới hạn
+            sizeof: Hàm tính dung lượng của một value (bắt buộc khi có max_size)
+        """
+        self.max_items = max(1, max_items)
+        self.on_evict = on_evict
+        self.max_size = max_size
+        self.sizeof = sizeof or (lambda value: 1)
+        self.current_size = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+        self._sizes: Dict[Hashable, int] = {}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Lấy giá trị và đánh dấu là vừa được sử dụng"""
+        with self._lock:
+            if key not in self._data:
+                return default
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Thêm/cập nhật giá trị, loại bỏ phần tử cũ nhất nếu vượt giới hạn"""
+        size = self.sizeof(value) if self.max_size is not None else 0
+        evicted = []
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.current_size -= self._sizes.get(key, 0)
+            self._data[key] = value
+            self._sizes[key] = size
+            self.current_size += size
+            while len(self._data) > self.max_items or self._over_size_limit():
+                old_key, old_value = self._data.popitem(last=False)
+                self.current_size -= self._sizes.pop(old_key, 0)
+                evicted.append((old_key, old_value))
+        for old_key, old_value in evicted:
+            self._notify_evict(old_key, old_value)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Xóa một phần tử (không gọi on_evict)"""
+        with self._lock:
+            self.current_size -= self._sizes.pop(key, 0)
+            return self._data.pop(key, default)
+
+    def clear(self) -> None:
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            items = list(self._data.items())
+            self._data.clear()
+            self._sizes.clear()
+            self.current_size = 0
+        for key, value in items:
+            self._notify_evict(key, value)
+
+    def keys(self):
+        with self._lock:
+            return list(self._data.keys())
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            return key in self._data
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._data)
+
+    def _over_size_limit(self) -> bool:
+        # Luôn giữ lại ít nhất phần tử vừa thêm, kể cả khi nó lớn hơn max_size
+        return self.max_size is not None and self.current_size > self.max_size and len(self._data) > 1
+
+    def _notify_evict(self, key: Hashable, value: Any) -> None:
+        if self.on_evict is None:
+            return
+        try:
+            self.on_evict(key, value)
+        except Exception:
+            pass
+
+
+class TTLCache(LRUCache):
+    """LRU cache có thời hạn (TTL) cho từng phần tử, kèm bộ đếm hit/miss để theo dõi"""
+
+    def __init__(self, max_items: int = 100, ttl: float = 300,
+                 max_size: Optional[int] = None, sizeof: Optional[Callable[[Any], int]] = None):
+        """
+        Args:
+            max_items: Số phần tử tối đa trước khi bị loại bỏ (evict)
+            ttl: Thời gian sống mặc định của một phần tử (giây)
+            max_size: Tổng dung lượng tối đa (đơn vị do sizeof quyết định), None = không giới hạn
+            sizeof: Hàm tính dung lượng của một value (bắt buộc khi có max_size)
+        """
+        super().__init__(
+            max_items=max_items,
+            on_evict=self._count_eviction,
+            max_size=max_size,
+            sizeof=(lambda entry: sizeof(entry[1])) if sizeof else None
+        )
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Lấy giá trị còn hạn, phần tử hết hạn được xóa và tính là miss"""
+        with self._lock:
+            entry = super().get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                super().pop(key)
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any, ttl: Optional[float] = None) -> None:
+        """Thêm/cập nhật giá trị với TTL (mặc định self.ttl)"""
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        super().put(key, (expires_at, value))
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Lấy giá trị còn hạn mà không tính hit/miss và không đổi thứ tự LRU"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                return default
+            return entry[1]
+
+    def invalidate(self, key: Hashable) -> None:
+        """Xóa một phần tử (write-through invalidation)"""
+        with self._lock:
+            if key in self._data:
+                super().pop(key)
+                self.invalidations += 1
+
+    def invalidate_prefix(self, prefix: tuple) -> None:
+        """Xóa mọi phần tử có key là tuple bắt đầu bằng prefix"""
+        with self._lock:
+            for key in list(self._data.keys()):
+                if isinstance(key, tuple) and key[:len(prefix)] == prefix:
+                    super().pop(key)
+                    self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        """Bộ đếm hit/miss/eviction hiện tại"""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+                "size": len(self._data),
+                "max_items": self.max_items
+            }
+
+    def _count_eviction(self, key: Hashable, value: Any) -> None:
+        self.evictions += 1
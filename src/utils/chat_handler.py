@@ -1,9 +1,11 @@
 import streamlit as st
-import openai
 from datetime import datetime
 import os
 from dotenv import load_dotenv
 from .error_handler import handle_error, LLMConnectionError, safe_execute_with_retry
+from .resources import get_llm_client
+from .tokens import estimate_tokens, context_token_budget, truncate_to_tokens
+from ..config.constants import PROMPT_OVERHEAD_TOKENS
 
 # Load environment variables
 load_dotenv()
@@ -13,10 +15,8 @@ class ChatHandler:
         # Khởi tạo Local LLM client (LM Studio)
         self.local_llm_url = os.getenv("LOCAL_LLM_URL", "http://localhost:1234/v1")
         try:
-            self.client = openai.OpenAI(
-                base_url=self.local_llm_url,
-                api_key="not_needed"
-            )
+            # Client dùng chung của process (connection pool keep-alive)
+            self.client = get_llm_client(self.local_llm_url)
             self.api_key = "local_connected"  # Để tương thích với logic cũ
             st.success("✅ ChatHandler đã kết nối Local LLM (LM Studio)")
         except Exception as e:
@@ -32,38 +32,9 @@ class ChatHandler:
             return self._generate_demo_response(user_input, document_context)
         
         def _call_llm():
-            # Chuẩn bị messages cho OpenAI
-            if is_document_qa and document_context:
-                # Specialized system prompt cho document Q&A
-                system_content = self._create_document_qa_prompt(document_context)
-                max_tokens = 500  # Focused answers
-                temperature = 0.2  # More deterministic
-            else:
-                # Standard chat system prompt
-                system_content = self._create_system_prompt(document_context)
-                max_tokens = 1000
-                temperature = 0.7
-            
-            messages = [
-                {
-                    "role": "system",
-                    "content": system_content
-                }
-            ]
-            
-            # Thêm lịch sử chat (giới hạn 10 tin nhắn gần nhất)
-            recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
-            for msg in recent_history:
-                messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            # Thêm tin nhắn hiện tại
-            messages.append({
-                "role": "user",
-                "content": user_input
-            })
+            messages, max_tokens, temperature = self._build_messages(
+                user_input, chat_history, document_context, is_document_qa
+            )
             
             # Gọi Local LLM API
             response = self.client.chat.completions.create(
@@ -90,25 +61,130 @@ class ChatHandler:
             # Xử lý các loại lỗi cụ thể
             return self._handle_llm_error(error_message, user_input, document_context)
     
-    def _create_system_prompt(self, document_context):
-        """Tạo system prompt cho chat thông thường"""
+    def generate_response_stream(self, user_input, chat_history, document_context="", is_document_qa=False):
+        """
+        Tạo phản hồi từ AI dạng streaming
+        
+        Yields:
+            Từng đoạn text ngay khi Local LLM sinh ra (dùng với st.write_stream)
+        """
+        # Nếu không có API key, trả về phản hồi demo
+        if not self.api_key:
+            yield self._generate_demo_response(user_input, document_context)
+            return
+        
+        received_tokens = False
+        try:
+            messages, max_tokens, temperature = self._build_messages(
+                user_input, chat_history, document_context, is_document_qa
+            )
+            stream = self.client.chat.completions.create(
+                model="local-model",
+                messages=messages,
+                max_tokens=max_tokens,
+                temperature=temperature,
+                stream=True
+            )
+            
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if delta:
+                    received_tokens = True
+                    yield delta
+            
+            # Stream kết thúc mà không có token nào -> không để câu trả lời rỗng
+            if not received_tokens:
+                yield self._handle_llm_error("Local LLM trả về phản hồi rỗng", user_input, document_context)
+                    
+        except Exception as e:
+            handle_error(e, "Local LLM Chat streaming", show_user=False)
+            if received_tokens:
+                yield "\n\n⚠️ Phản hồi bị gián đoạn, vui lòng thử lại."
+            else:
+                # Xử lý các loại lỗi cụ thể
+                yield self._handle_llm_error(str(e), user_input, document_context)
+    
+    def _build_messages(self, user_input, chat_history, document_context="", is_document_qa=False):
+        """
+        Chuẩn bị messages cho Local LLM
+        
+        Returns:
+            (messages, max_tokens, temperature)
+        """
+        # Thêm lịch sử chat (giới hạn 10 tin nhắn gần nhất)
+        recent_history = chat_history[-10:] if len(chat_history) > 10 else chat_history
+        history_messages = [
+            {
+                "role": msg["role"],
+                "content": msg["content"]
+            }
+            for msg in recent_history
+        ]
+        
+        # Token còn lại cho context tài liệu sau lịch sử chat và câu hỏi
+        prompt_tokens = PROMPT_OVERHEAD_TOKENS + estimate_tokens(user_input) + sum(
+            estimate_tokens(msg["content"]) for msg in history_messages
+        )
+        
+        if is_document_qa and document_context:
+            # Specialized system prompt cho document Q&A
+            max_tokens = 500  # Focused answers
+            temperature = 0.2  # More deterministic
+            system_content = self._create_document_qa_prompt(
+                document_context, context_token_budget(max_tokens, prompt_tokens)
+            )
+        else:
+            # Standard chat system prompt
+            max_tokens = 1000
+            temperature = 0.7
+            system_content = self._create_system_prompt(
+                document_context, context_token_budget(max_tokens, prompt_tokens)
+            )
+        
+        messages = [
+            {
+                "role": "system",
+                "content": system_content
+            }
+        ]
+        messages.extend(history_messages)
+        
+        # Thêm tin nhắn hiện tại
+        messages.append({
+            "role": "user",
+            "content": user_input
+        })
+        
+        return messages, max_tokens, temperature
+    
+    def _create_system_prompt(self, document_context, context_tokens=None):
+        """Tạo system prompt cho chat thông thường (context tài liệu cắt theo ngân sách token)"""
         base_prompt = """Bạn là một AI assistant thông minh và hữu ích. Hãy trả lời các câu hỏi một cách chi tiết và chính xác. Sử dụng tiếng Việt để trả lời."""
         
         if document_context:
+            if context_tokens is None:
+                context_tokens = context_token_budget(1000, PROMPT_OVERHEAD_TOKENS)
+            context = truncate_to_tokens(document_context, context_tokens)
+            if len(context) < len(document_context):
+                context += "..."
             base_prompt += f"""
             
 THÔNG TIN TÀI LIỆU:
 Người dùng đã upload các tài liệu sau. Hãy sử dụng thông tin này để trả lời câu hỏi khi phù hợp:
 
-{document_context[:3000]}...
+{context}
 
 Khi trả lời dựa trên tài liệu, hãy ghi rõ bạn đang tham khảo từ tài liệu đã upload.
 """
         
         return base_prompt
     
-    def _create_document_qa_prompt(self, document_context):
-        """Tạo system prompt chuyên biệt cho document Q&A"""
+    def _create_document_qa_prompt(self, document_context, context_tokens=None):
+        """Tạo system prompt chuyên biệt cho document Q&A (context tài liệu cắt theo ngân sách token)"""
+        if context_tokens is None:
+            context_tokens = context_token_budget(500, PROMPT_OVERHEAD_TOKENS)
+        context = truncate_to_tokens(document_context, context_tokens)
+        
         return f"""Bạn là một AI assistant tên là Study Buddy chuyên trả lời câu hỏi dựa trên tài liệu được cung cấp.
 
 NHIỆM VỤ:
@@ -125,7 +201,7 @@ NGUYÊN TẮC:
 ❌ Không suy diễn quá xa
 
 TÀI LIỆU THAM KHẢO:
-{document_context[:4000]}
+{context}
 
 Hãy trả lời câu hỏi dựa trên tài liệu trên."""
     
@@ -1,9 +1,20 @@
 import streamlit as st
-from datetime import datetime, timezone
+import time
+from datetime import datetime, timezone, timedelta
 import uuid
 import json
 from typing import List, Dict, Optional, Tuple
 import logging
+from .cache import TTLCache
+from .message_queue import get_message_queue
+from .resources import get_resource
+from .db_errors import is_missing_object_error
+from ..config.constants import (
+    FEATURES, MESSAGE_READ_FLUSH_TIMEOUT, CLEANUP_BATCH_SIZE, DOCUMENT_PAGES_BATCH_SIZE,
+    DOCUMENT_PAGES_BATCH_MAX_CHARS, SESSIONS_PAGE_SIZE, MESSAGES_PAGE_SIZE,
+    PERSISTENCE_CACHE_TTL, PERSISTENCE_CACHE_MAX_ITEMS, DOCUMENT_CONTENT_CACHE_TTL,
+    DOCUMENT_CONTENT_CACHE_MAX_ITEMS, DOCUMENT_CONTENT_CACHE_MAX_CHARS, SESSION_PREVIEW_FALLBACK_MESSAGES
+)
 
 # Enhanced Chat Persistence with Advanced Database Integration
 # Author: Trần Đức Việt - Database & Integration Specialist
@@ -16,8 +27,36 @@ class ChatPersistence:
         self.supabase = supabase_client
         self.logger = logging.getLogger(__name__)
         self._connection_pool = None
-        self._cache = {}
-        self._cache_timeout = 300  # 5 minutes
+        # Read-through cache (TTL + LRU) dùng chung của process cho session list, messages, documents
+        self._cache_timeout = PERSISTENCE_CACHE_TTL
+        self._cache = get_resource(
+            "chat_persistence_cache",
+            lambda: TTLCache(max_items=PERSISTENCE_CACHE_MAX_ITEMS, ttl=PERSISTENCE_CACHE_TTL)
+        )
+        # Nội dung tài liệu/trang (lớn) cache riêng, giới hạn theo tổng số ký tự
+        self._content_cache = get_resource(
+            "document_content_cache",
+            lambda: TTLCache(
+                max_items=DOCUMENT_CONTENT_CACHE_MAX_ITEMS,
+                ttl=DOCUMENT_CONTENT_CACHE_TTL,
+                max_size=DOCUMENT_CONTENT_CACHE_MAX_CHARS,
+                sizeof=len
+            )
+        )
+        
+        # Write-behind queue dùng chung của process (ghi tin nhắn theo batch ở thread nền)
+        self._write_queue = get_message_queue() if FEATURES.get('enable_write_behind', True) else None
+        if self._write_queue is not None:
+            self._write_queue.add_dead_letter_listener("chat_persistence_cache", self._on_message_dead_lettered)
+        self._preview_column_available = True
+        self._session_previews_rpc_available = True
+        # Supabase chưa có RPC/view thống kê trong database_functions.sql -> dùng count queries.
+        # Mỗi RPC/view một cờ, chỉ tắt khi database báo object không tồn tại
+        self._session_stats_rpc_available = True
+        self._user_stats_view_available = True
+        self._database_stats_rpc_available = True
+        self._cleanup_rpc_available = True
+        self.last_cleanup_stats = {}
         
         # Initialize connection validation
         self._validate_database_schema()
@@ -64,6 +103,7 @@ class ChatPersistence:
                 
                 # Cache the new session
                 self._cache_session(session_id, result.data[0])
+                self._cache.invalidate_prefix(("sessions", processed_user_id))
                 
                 # Log successful creation
                 self.logger.info(f"Session created: {session_id} for user: {processed_user_id}")
@@ -100,6 +140,8 @@ class ChatPersistence:
             
             # Prepare enhanced message data
             message_data = {
+                # id tạo ở client để tin nhắn chưa flush vẫn có keyset cursor (created_at, id)
+                "id": str(uuid.uuid4()),
                 "session_id": session_id,
                 "user_id": processed_user_id,
                 "role": role,
@@ -114,12 +156,17 @@ class ChatPersistence:
                 "is_processed": False
             }
             
-            # Batch operation: Save message + Update session trong một transaction
-            success = self._execute_message_transaction(message_data, session_id)
+            # Write-behind: đưa vào hàng đợi, thread nền ghi theo batch và gộp cập nhật session
+            if self._write_queue is not None:
+                self._write_queue.enqueue(self.supabase, message_data)
+                success = True
+            else:
+                # Batch operation: Save message + Update session trong một transaction
+                success = self._execute_message_transaction(message_data, session_id)
             
             if success:
                 # Update cache và analytics
-                self._update_session_cache(session_id)
+                self._update_session_cache(session_id, processed_user_id, message_data)
                 self._track_message_analytics(role, len(sanitized_content))
                 
                 self.logger.info(f"Message saved: {role} in session {session_id}")
@@ -132,82 +179,184 @@ class ChatPersistence:
             st.error(f"❌ Lỗi lưu tin nhắn: {str(e)}")
             return False
     
-    def load_session_messages(self, session_id: str) -> List[Dict]:
+    def load_session_messages(self, session_id: str, limit: int = MESSAGES_PAGE_SIZE) -> List[Dict]:
         """
-        Load tất cả messages của một session
+        Load các messages gần nhất của một session
         
         Args:
             session_id: ID của session
+            limit: Số messages gần nhất tối đa
             
         Returns:
-            List các messages đã format cho Streamlit
+            List các messages đã format cho Streamlit (theo thứ tự thời gian)
+        """
+        return self.load_message_page(session_id, limit)[0]
+    
+    def load_message_page(self, session_id: str, limit: int = MESSAGES_PAGE_SIZE,
+                          before: Optional[Tuple[str, str]] = None) -> Tuple[List[Dict], bool]:
+        """
+        Load một trang messages theo keyset cursor (created_at, id), mới nhất trước
+        
+        Args:
+            session_id: ID của session
+            limit: Số messages tối đa của trang
+            before: Cursor của message cũ nhất đang hiển thị, None = trang mới nhất
+            
+        Returns:
+            (List messages theo thứ tự thời gian, True nếu còn messages cũ hơn)
+            Mỗi message có "cursor" để lấy trang cũ hơn
         """
         try:
-            result = self.supabase.table("messages").select("*").eq(
+            # Trang mới nhất được cache và cập nhật write-through khi có tin nhắn mới;
+            # các trang cũ hơn không đổi nên cache theo cursor
+            cache_key = ("messages", session_id) if before is None else ("messages", session_id, before, limit)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                messages, has_older = cached
+                if before is not None or len(messages) >= limit or not has_older:
+                    return list(messages[-limit:]), has_older or len(messages) > limit
+            
+            self._flush_pending_messages(session_id)
+            
+            # Chỉ lấy các cột cần hiển thị, lấy thêm 1 dòng để biết còn trang cũ hơn không
+            query = self.supabase.table("messages").select("id,role,content,created_at").eq(
                 "session_id", session_id
-            ).order("created_at").execute()
+            )
+            if before:
+                created_at, message_id = before
+                query = query.or_(
+                    f'created_at.lt."{created_at}",and(created_at.eq."{created_at}",id.lt.{message_id})'
+                )
+            result = query.order("created_at", desc=True).order("id", desc=True).limit(limit + 1).execute()
             
-            if result.data:
-                formatted_messages = []
-                for msg in result.data:
-                    formatted_messages.append({
-                        "role": msg["role"],
-                        "content": msg["content"],
-                        "timestamp": datetime.fromisoformat(msg["created_at"].replace('Z', '+00:00'))
-                    })
-                return formatted_messages
-            return []
+            rows = result.data or []
+            has_older = len(rows) > limit
+            formatted_messages = [self._format_message(msg) for msg in reversed(rows[:limit])]
+            
+            self._cache.put(cache_key, (formatted_messages, has_older))
+            return list(formatted_messages), has_older
             
         except Exception as e:
             st.error(f"❌ Lỗi load messages: {str(e)}")
-            return []
+            return [], False
     
-    def get_user_sessions(self, user_id: str, limit: int = 20) -> List[Dict]:
+    @staticmethod
+    def _format_message(message: Dict) -> Dict:
+        """Format một dòng messages cho Streamlit"""
+        return {
+            "role": message["role"],
+            "content": message["content"],
+            "timestamp": datetime.fromisoformat(message["created_at"].replace('Z', '+00:00')),
+            "cursor": (message["created_at"], message.get("id"))
+        }
+    
+    def get_user_sessions(self, user_id: str, limit: int = SESSIONS_PAGE_SIZE,
+                          cursor: Optional[Tuple[str, str]] = None) -> List[Dict]:
         """
         Lấy danh sách sessions của user
         
         Args:
             user_id: ID của user
             limit: Số lượng sessions tối đa
+            cursor: Keyset cursor (updated_at, id) của session cuối trang trước, None = trang đầu
             
         Returns:
-            List các sessions với thông tin cần thiết
+            List các sessions với thông tin cần thiết (mỗi session có "cursor" để lấy trang tiếp theo)
         """
         try:
             # Validate user_id
             processed_user_id = self._validate_user_id(user_id)
             
-            result = self.supabase.table("chat_sessions").select("*").eq(
-                "user_id", processed_user_id
-            ).order("updated_at", desc=True).limit(limit).execute()
+            cache_key = ("sessions", processed_user_id, limit, cursor)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
             
-            if result.data:
-                formatted_sessions = []
-                for session in result.data:
-                    # Lấy message đầu tiên để preview
-                    first_msg = self.supabase.table("messages").select("content").eq(
-                        "session_id", session["id"]
-                    ).eq("role", "user").order("created_at").limit(1).execute()
-                    
-                    preview = ""
-                    if first_msg.data:
-                        preview = first_msg.data[0]["content"][:50] + "..." if len(first_msg.data[0]["content"]) > 50 else first_msg.data[0]["content"]
-                    
-                    formatted_sessions.append({
-                        "id": session["id"],
-                        "title": session["title"],
-                        "preview": preview,
-                        "created_at": datetime.fromisoformat(session["created_at"].replace('Z', '+00:00')),
-                        "updated_at": datetime.fromisoformat(session["updated_at"].replace('Z', '+00:00'))
-                    })
+            # Thứ tự theo updated_at cần các tin nhắn đang chờ đã được ghi
+            self._flush_pending_messages()
+            
+            sessions = self._query_sessions(processed_user_id, limit, cursor)
+            
+            formatted_sessions = []
+            for session in sessions:
+                preview = session.get("preview") or ""
+                if len(preview) > 50:
+                    preview = preview[:50] + "..."
                 
-                return formatted_sessions
-            return []
+                formatted_sessions.append({
+                    "id": session["id"],
+                    "title": session["title"],
+                    "preview": preview,
+                    "created_at": datetime.fromisoformat(session["created_at"].replace('Z', '+00:00')),
+                    "updated_at": datetime.fromisoformat(session["updated_at"].replace('Z', '+00:00')),
+                    "cursor": (session["updated_at"], session["id"])
+                })
+            
+            self._cache.put(cache_key, formatted_sessions)
+            return list(formatted_sessions)
             
         except Exception as e:
             st.error(f"❌ Lỗi load sessions: {str(e)}")
             return []
     
+    def _query_sessions(self, user_id: str, limit: int, cursor: Optional[Tuple[str, str]]) -> List[Dict]:
+        """
+        Một query cho danh sách sessions kèm preview (cột chat_sessions.preview)
+        
+        Nếu database chưa có cột preview, preview của cả trang lấy bằng RPC session_previews
+        (DISTINCT ON, một dòng mỗi session); chưa có RPC thì một query messages có giới hạn.
+        """
+        def _build(columns):
+            query = self.supabase.table("chat_sessions").select(columns).eq("user_id", user_id)
+            if cursor:
+                updated_at, session_id = cursor
+                # Keyset: (updated_at, id) < cursor, dùng index (user_id, updated_at DESC, id DESC)
+                query = query.or_(
+                    f'updated_at.lt."{updated_at}",and(updated_at.eq."{updated_at}",id.lt.{session_id})'
+                )
+            return query.order("updated_at", desc=True).order("id", desc=True).limit(limit)
+        
+        if self._preview_column_available:
+            try:
+                return _build("id,title,preview,created_at,updated_at").execute().data or []
+            except Exception as e:
+                if "preview" not in str(e):
+                    raise
+                self._preview_column_available = False
+                self.logger.warning("chat_sessions.preview missing, using batched preview query")
+        
+        sessions = _build("id,title,created_at,updated_at").execute().data or []
+        if not sessions:
+            return []
+        
+        previews = self._query_previews([session["id"] for session in sessions])
+        for session in sessions:
+            session["preview"] = previews.get(session["id"], "")
+        return sessions
+    
+    def _query_previews(self, session_ids: List[str]) -> Dict[str, str]:
+        """Tin nhắn user đầu tiên của mỗi session (session_id -> preview)"""
+        if self._session_previews_rpc_available:
+            try:
+                result = self.supabase.rpc("session_previews", {"session_ids": session_ids}).execute()
+                return {row["session_id"]: row["preview"] or "" for row in result.data or []}
+            except Exception as e:
+                if is_missing_object_error(e):
+                    self._session_previews_rpc_available = False
+                self.logger.warning(f"RPC session_previews failed, using limited preview query: {e}")
+        
+        # Fallback: giới hạn số dòng tải về, session có quá nhiều tin nhắn sớm hơn có thể thiếu preview
+        first_messages = self.supabase.table("messages").select("session_id,content").in_(
+            "session_id", session_ids
+        ).eq("role", "user").order("created_at").limit(
+            len(session_ids) * SESSION_PREVIEW_FALLBACK_MESSAGES
+        ).execute()
+        
+        previews = {}
+        for message in first_messages.data or []:
+            previews.setdefault(message["session_id"], message["content"])
+        return previews
+    
     def update_session_title(self, session_id: str, title: str) -> bool:
         """
         Cập nhật title của session
@@ -225,6 +374,10 @@ class ChatPersistence:
                 "updated_at": datetime.now().isoformat()
             }).eq("id", session_id).execute()
             
+            # Không biết user của session -> bỏ cache danh sách sessions của mọi user
+            self._cache.invalidate(("session", session_id))
+            self._cache.invalidate_prefix(("sessions",))
+            
             return bool(result.data)
             
         except Exception as e:
@@ -246,12 +399,17 @@ class ChatPersistence:
             # Validate user_id
             processed_user_id = self._validate_user_id(user_id)
             
+            # Ghi nốt tin nhắn đang chờ để không bị insert vào session đã xóa
+            self._flush_pending_messages(session_id)
+            
             # Xóa messages trước (do foreign key constraint)
             self.supabase.table("messages").delete().eq("session_id", session_id).execute()
             
             # Xóa session
             result = self.supabase.table("chat_sessions").delete().eq("id", session_id).eq("user_id", processed_user_id).execute()
             
+            self._invalidate_session(session_id, processed_user_id)
+            
             if result.data:
                 st.success("✅ Đã xóa cuộc trò chuyện")
                 return True
@@ -298,7 +456,7 @@ class ChatPersistence:
     
     def get_session_stats(self, session_id: str) -> Dict:
         """
-        Lấy thống kê của một session
+        Lấy thống kê của một session (đếm ở server, không tải tin nhắn về)
         
         Args:
             session_id: ID của session
@@ -307,23 +465,72 @@ class ChatPersistence:
             Dict chứa thống kê
         """
         try:
-            # Đếm messages
-            messages = self.supabase.table("messages").select("role").eq("session_id", session_id).execute()
-            
-            if messages.data:
-                user_msgs = len([m for m in messages.data if m["role"] == "user"])
-                ai_msgs = len([m for m in messages.data if m["role"] == "assistant"])
-                
-                return {
-                    "total_messages": len(messages.data),
-                    "user_messages": user_msgs,
-                    "ai_messages": ai_msgs
-                }
+            if self._session_stats_rpc_available:
+                try:
+                    result = self.supabase.rpc("session_message_stats", {"session_uuid": session_id}).execute()
+                    role_counts = {row["role"]: row["message_count"] for row in result.data or []}
+                    return {
+                        "total_messages": sum(role_counts.values()),
+                        "user_messages": role_counts.get("user", 0),
+                        "ai_messages": role_counts.get("assistant", 0)
+                    }
+                except Exception as e:
+                    if is_missing_object_error(e):
+                        self._session_stats_rpc_available = False
+                    self.logger.warning(f"RPC session_message_stats failed, using count queries: {e}")
+            
+            # Fallback: count-only queries (HEAD, không trả về dòng nào)
+            return {
+                "total_messages": self._count_rows("messages", session_id=session_id),
+                "user_messages": self._count_rows("messages", session_id=session_id, role="user"),
+                "ai_messages": self._count_rows("messages", session_id=session_id, role="assistant")
+            }
             
+        except Exception as e:
             return {"total_messages": 0, "user_messages": 0, "ai_messages": 0}
+    
+    def get_user_stats(self, user_id: str) -> Dict:
+        """
+        Lấy thống kê của một user từ bảng materialized user_chat_stats
+        
+        Args:
+            user_id: ID của user
+            
+        Returns:
+            Dict chứa thống kê (đếm trực tiếp nếu chưa có user_chat_stats)
+        """
+        try:
+            processed_user_id = self._validate_user_id(user_id)
+            
+            if self._user_stats_view_available:
+                try:
+                    result = self.supabase.table("user_chat_stats").select(
+                        "session_count,message_count,user_messages,ai_messages,refreshed_at"
+                    ).eq("user_id", processed_user_id).limit(1).execute()
+                    if result.data:
+                        return result.data[0]
+                except Exception as e:
+                    if is_missing_object_error(e):
+                        self._user_stats_view_available = False
+                    self.logger.warning(f"user_chat_stats query failed, using count queries: {e}")
+            
+            return {
+                "session_count": self._count_rows("chat_sessions", user_id=processed_user_id),
+                "message_count": self._count_rows("messages", user_id=processed_user_id),
+                "user_messages": self._count_rows("messages", user_id=processed_user_id, role="user"),
+                "ai_messages": self._count_rows("messages", user_id=processed_user_id, role="assistant")
+            }
             
         except Exception as e:
-            return {"total_messages": 0, "user_messages": 0, "ai_messages": 0}
+            self.logger.error(f"User statistics failed: {e}")
+            return {"session_count": 0, "message_count": 0, "user_messages": 0, "ai_messages": 0}
+    
+    def _count_rows(self, table: str, count: str = "exact", **filters) -> int:
+        """Đếm số dòng ở server bằng count query (không tải dữ liệu)"""
+        query = self.supabase.table(table).select("id", count=count, head=True)
+        for column, value in filters.items():
+            query = query.eq(column, value)
+        return query.execute().count or 0
     
     def _validate_user_id(self, user_id: str) -> str:
         """
@@ -355,7 +562,7 @@ class ChatPersistence:
     def save_document_to_session(self, user_id: str, session_id: str, file_name: str, 
                                 file_type: str, file_size: int, content: str, 
                                 summary: str = "", questions: List[str] = None, 
-                                page_count: int = None) -> Optional[str]:
+                                page_count: int = None, pages: Dict[int, str] = None) -> Optional[str]:
         """
         Lưu tài liệu vào session
         
@@ -369,6 +576,7 @@ class ChatPersistence:
             summary: Tóm tắt tài liệu
             questions: Danh sách câu hỏi gợi ý
             page_count: Số trang (cho PDF)
+            pages: Nội dung từng trang đã OCR (số trang -> nội dung), lưu vào document_pages
             
         Returns:
             document_id nếu thành công, None nếu lỗi
@@ -393,9 +601,12 @@ class ChatPersistence:
             
             # Lưu vào database
             result = self.supabase.table("session_documents").insert(doc_data).execute()
+            self._cache.invalidate(("documents", session_id))
             
             if result.data:
                 document_id = result.data[0]["id"]
+                if pages:
+                    self.save_document_pages(document_id, pages)
                 st.success(f"✅ Đã lưu tài liệu: {file_name}")
                 return document_id
             return None
@@ -406,7 +617,9 @@ class ChatPersistence:
     
     def load_session_documents(self, session_id: str) -> List[Dict]:
         """
-        Load tất cả tài liệu của một session
+        Load metadata các tài liệu của một session (không gồm nội dung)
+        
+        Nội dung tài liệu được load theo yêu cầu bằng load_document_content / load_document_page.
         
         Args:
             session_id: ID của session
@@ -415,9 +628,14 @@ class ChatPersistence:
             List các tài liệu đã format
         """
         try:
-            result = self.supabase.table("session_documents").select("*").eq(
-                "session_id", session_id
-            ).order("created_at").execute()
+            cache_key = ("documents", session_id)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                return list(cached)
+            
+            result = self.supabase.table("session_documents").select(
+                "id,file_name,file_type,file_size,summary,questions,page_count,created_at"
+            ).eq("session_id", session_id).order("created_at").execute()
             
             if result.data:
                 formatted_docs = []
@@ -434,13 +652,14 @@ class ChatPersistence:
                         "file_name": doc["file_name"],
                         "file_type": doc["file_type"],
                         "file_size": doc["file_size"],
-                        "content": doc["content"],
                         "summary": doc["summary"],
                         "questions": questions,
                         "page_count": doc.get("page_count"),
                         "created_at": datetime.fromisoformat(doc["created_at"].replace('Z', '+00:00'))
                     })
-                return formatted_docs
+                self._cache.put(cache_key, formatted_docs)
+                return list(formatted_docs)
+            self._cache.put(cache_key, [])
             return []
             
         except Exception as e:
@@ -467,6 +686,11 @@ class ChatPersistence:
                 "id", document_id
             ).eq("user_id", processed_user_id).execute()
             
+            # Không biết session của tài liệu -> bỏ cache tài liệu của mọi session
+            self._cache.invalidate_prefix(("documents",))
+            self._content_cache.invalidate(("document_content", document_id))
+            self._content_cache.invalidate_prefix(("document_page", document_id))
+            
             if result.data:
                 st.success("✅ Đã xóa tài liệu")
                 return True
@@ -497,12 +721,64 @@ class ChatPersistence:
             }
             
             result = self.supabase.table("document_pages").insert(page_data).execute()
+            if result.data:
+                self._content_cache.put(("document_page", document_id, page_number), content or "")
             return bool(result.data)
             
         except Exception as e:
             st.error(f"❌ Lỗi lưu trang tài liệu: {str(e)}")
             return False
     
+    def save_document_pages(self, document_id: str, pages: Dict[int, str]) -> int:
+        """
+        Lưu nội dung tất cả các trang của tài liệu bằng multi-row insert theo batch
+        
+        Args:
+            document_id: ID của tài liệu
+            pages: Dict số trang -> nội dung
+            
+        Returns:
+            Số trang đã lưu
+        """
+        created_at = datetime.now().isoformat()
+        rows = [{
+            "document_id": document_id,
+            "page_number": page_number,
+            "content": content,
+            "created_at": created_at
+        } for page_number, content in sorted(pages.items()) if content]
+        
+        saved = 0
+        for batch in self._batch_page_rows(rows):
+            try:
+                self.supabase.table("document_pages").insert(batch).execute()
+            except Exception as e:
+                self.logger.error(f"Document pages insert failed for {document_id}: {e}")
+                break
+            # Trang vừa lưu được phục vụ từ cache, không cần query lại
+            for row in batch:
+                self._content_cache.put(("document_page", document_id, row["page_number"]), row["content"])
+            saved += len(batch)
+        
+        self.logger.info(f"Saved {saved}/{len(rows)} pages for document {document_id}")
+        return saved
+    
+    @staticmethod
+    def _batch_page_rows(rows: List[Dict]) -> List[List[Dict]]:
+        """Chia các dòng document_pages thành batch giới hạn theo số dòng và tổng số ký tự"""
+        batches, batch, batch_chars = [], [], 0
+        for row in rows:
+            row_chars = len(row["content"])
+            if batch and (len(batch) >= DOCUMENT_PAGES_BATCH_SIZE
+                          or batch_chars + row_chars > DOCUMENT_PAGES_BATCH_MAX_CHARS):
+                batches.append(batch)
+                batch, batch_chars = [], 0
+            batch.append(row)
+            batch_chars += row_chars
+        if batch:
+            batches.append(batch)
+        return batches
+    
     def load_document_page(self, document_id: str, page_number: int) -> Optional[str]:
         """
         Load nội dung một trang cụ thể
@@ -515,18 +791,62 @@ class ChatPersistence:
             Nội dung trang nếu có, None nếu không tìm thấy
         """
         try:
+            cache_key = ("document_page", document_id, page_number)
+            cached = self._content_cache.get(cache_key)
+            if cached is not None:
+                return cached or None
+            
             result = self.supabase.table("document_pages").select("content").eq(
                 "document_id", document_id
             ).eq("page_number", page_number).execute()
             
+            content = result.data[0]["content"] if result.data else None
+            # Cache cả kết quả "không có trang" để không query lại mỗi lần rerun
+            self._content_cache.put(cache_key, content or "")
+            return content
+            
+        except Exception as e:
+            st.error(f"❌ Lỗi load trang tài liệu: {str(e)}")
+            return None
+    
+    def load_document_content(self, document_id: str) -> Optional[str]:
+        """
+        Load nội dung đầy đủ của tài liệu (chỉ khi cần, cache sau lần đầu)
+        
+        Args:
+            document_id: ID của tài liệu
+            
+        Returns:
+            Nội dung tài liệu nếu có, None nếu không tìm thấy
+        """
+        try:
+            cache_key = ("document_content", document_id)
+            cached = self._content_cache.get(cache_key)
+            if cached is not None:
+                return cached
+            
+            result = self.supabase.table("session_documents").select("content").eq(
+                "id", document_id
+            ).limit(1).execute()
+            
             if result.data:
-                return result.data[0]["content"]
+                content = result.data[0]["content"] or ""
+                self._content_cache.put(cache_key, content)
+                return content
             return None
             
         except Exception as e:
-            st.error(f"❌ Lỗi load trang tài liệu: {str(e)}")
+            st.error(f"❌ Lỗi load nội dung tài liệu: {str(e)}")
             return None
     
+    def load_document_page_content(self, document_id: str, page_number: int) -> Optional[str]:
+        """
+        Nội dung một trang của tài liệu trong database
+        
+        Dùng bảng document_pages nếu có, ngược lại trả về nội dung đầy đủ của tài liệu.
+        """
+        return self.load_document_page(document_id, page_number) or self.load_document_content(document_id)
+    
     def get_document_pages(self, document_id: str) -> List[Dict]:
         """
         Lấy danh sách tất cả các trang của tài liệu
@@ -665,11 +985,7 @@ class ChatPersistence:
     def _cache_session(self, session_id: str, session_data: Dict):
         """Cache session data for performance"""
         try:
-            cache_key = f"session_{session_id}"
-            self._cache[cache_key] = {
-                "data": session_data,
-                "timestamp": datetime.now(timezone.utc).timestamp()
-            }
+            self._cache.put(("session", session_id), session_data)
         except Exception as e:
             self.logger.warning(f"Session caching failed: {e}")
     
@@ -697,15 +1013,55 @@ class ChatPersistence:
             self.logger.error(f"Message transaction failed: {e}")
             return False
     
-    def _update_session_cache(self, session_id: str):
-        """Update session cache after new message"""
+    def _flush_pending_messages(self, session_id: str = None) -> None:
+        """Ghi các tin nhắn đang chờ trong write-behind queue trước khi đọc lại từ database"""
+        if self._write_queue is None or not self._write_queue.pending_count(session_id):
+            return
+        if not self._write_queue.flush(timeout=MESSAGE_READ_FLUSH_TIMEOUT):
+            self.logger.warning("Pending messages not flushed before read")
+    
+    def _update_session_cache(self, session_id: str, user_id: str = None, message_data: Dict = None):
+        """Write-through sau khi lưu tin nhắn: thêm vào messages đã cache, bỏ cache danh sách sessions"""
         try:
-            cache_key = f"session_{session_id}"
-            if cache_key in self._cache:
-                self._cache[cache_key]["timestamp"] = datetime.now(timezone.utc).timestamp()
+            # Thêm vào trang mới nhất đã cache thay vì load lại cả trang
+            cached = self._cache.peek(("messages", session_id))
+            if cached is not None and message_data:
+                cached_messages, has_older = cached
+                self._cache.put(("messages", session_id), (
+                    cached_messages + [self._format_message(message_data)], has_older
+                ))
+            
+            # updated_at/preview của session thay đổi -> thứ tự danh sách sessions thay đổi
+            if user_id:
+                self._cache.invalidate_prefix(("sessions", user_id))
+            else:
+                self._cache.invalidate_prefix(("sessions",))
         except Exception as e:
             self.logger.warning(f"Cache update failed: {e}")
     
+    def _on_message_dead_lettered(self, message_data: Dict, error: str):
+        """Tin nhắn đã được thêm vào cache lúc save_message nhưng không ghi được -> bỏ cache của session"""
+        session_id = message_data.get("session_id")
+        self._cache.invalidate_prefix(("messages", session_id))
+        self._cache.invalidate(("session", session_id))
+        if message_data.get("user_id"):
+            self._cache.invalidate_prefix(("sessions", message_data["user_id"]))
+        else:
+            self._cache.invalidate_prefix(("sessions",))
+    
+    def _invalidate_session(self, session_id: str, user_id: str):
+        """Bỏ mọi cache liên quan tới một session"""
+        self._cache.invalidate(("session", session_id))
+        self._cache.invalidate_prefix(("messages", session_id))
+        self._cache.invalidate(("documents", session_id))
+        self._cache.invalidate_prefix(("sessions", user_id))
+    
+    def get_cache_stats(self) -> Dict:
+        """Bộ đếm hit/miss của cache (dùng chung cả process) để theo dõi"""
+        stats = self._cache.stats()
+        stats["document_content"] = self._content_cache.stats()
+        return stats
+    
     def _track_message_analytics(self, role: str, content_length: int):
         """Track message analytics for insights"""
         try:
@@ -723,62 +1079,131 @@ class ChatPersistence:
         except Exception as e:
             self.logger.warning(f"Analytics tracking failed: {e}")
     
-    def get_database_statistics(self) -> Dict:
-        """Get comprehensive database statistics"""
+    def get_database_statistics(self, exact: bool = False) -> Dict:
+        """
+        Get comprehensive database statistics (tính ở server, chi phí không phụ thuộc số dòng)
+        
+        Args:
+            exact: True = đếm chính xác, False = số dòng ước lượng của PostgreSQL
+        """
         try:
-            stats = {}
-            
-            # Session statistics
-            sessions_result = self.supabase.table("chat_sessions").select("id, created_at").execute()
-            stats["total_sessions"] = len(sessions_result.data) if sessions_result.data else 0
-            
-            # Message statistics
-            messages_result = self.supabase.table("messages").select("id, role").execute()
-            if messages_result.data:
-                stats["total_messages"] = len(messages_result.data)
-                stats["user_messages"] = len([m for m in messages_result.data if m["role"] == "user"])
-                stats["ai_messages"] = len([m for m in messages_result.data if m["role"] == "assistant"])
-            else:
-                stats.update({"total_messages": 0, "user_messages": 0, "ai_messages": 0})
-            
-            # User statistics
-            users_result = self.supabase.table("user").select("id").execute()
-            stats["total_users"] = len(users_result.data) if users_result.data else 0
-            
-            return stats
+            if self._database_stats_rpc_available:
+                try:
+                    result = self.supabase.rpc("database_statistics", {"use_estimates": not exact}).execute()
+                    if result.data:
+                        return dict(result.data)
+                except Exception as e:
+                    if is_missing_object_error(e):
+                        self._database_stats_rpc_available = False
+                    self.logger.warning(f"RPC database_statistics failed, using count queries: {e}")
+            
+            count = "exact" if exact else "estimated"
+            return {
+                "total_sessions": self._count_rows("chat_sessions", count=count),
+                "total_messages": self._count_rows("messages", count=count),
+                "user_messages": self._count_rows("messages", count=count, role="user"),
+                "ai_messages": self._count_rows("messages", count=count, role="assistant"),
+                "total_users": self._count_rows("user", count=count),
+                "estimated": not exact
+            }
             
         except Exception as e:
             self.logger.error(f"Statistics gathering failed: {e}")
             return {"error": str(e)}
     
-    def cleanup_old_sessions(self, days_old: int = 30) -> int:
-        """Cleanup sessions cũ để optimize database"""
-        try:
-            from datetime import timedelta
-            cutoff_date = datetime.now(timezone.utc) - timedelta(days=days_old)
-            
-            # Get old sessions
-            old_sessions = self.supabase.table("chat_sessions").select("id").lt(
-                "updated_at", cutoff_date.isoformat()
-            ).execute()
-            
-            if not old_sessions.data:
-                return 0
-            
-            session_ids = [s["id"] for s in old_sessions.data]
-            
-            # Delete messages first
-            for session_id in session_ids:
-                self.supabase.table("messages").delete().eq("session_id", session_id).execute()
-            
-            # Delete sessions
-            deleted = self.supabase.table("chat_sessions").delete().in_("id", session_ids).execute()
-            
-            count = len(deleted.data) if deleted.data else 0
-            self.logger.info(f"Cleaned up {count} old sessions")
-            
-            return count
+    def cleanup_old_sessions(self, days_old: int = 30, batch_size: int = CLEANUP_BATCH_SIZE,
+                             max_batches: Optional[int] = None) -> int:
+        """
+        Cleanup sessions cũ để optimize database (retention job theo batch)
+        
+        Mỗi batch xóa document_pages, session_documents, messages rồi chat_sessions của tối đa
+        batch_size sessions. Batch bị gián đoạn không để lại dữ liệu mồ côi: chạy lại sẽ tiếp tục
+        từ các sessions còn lại. Thống kê throughput lưu ở self.last_cleanup_stats.
+        
+        Args:
+            days_old: Xóa sessions không cập nhật trong số ngày này
+            batch_size: Số sessions mỗi batch
+            max_batches: Số batch tối đa của lần chạy này, None = tới khi hết
             
+        Returns:
+            Số sessions đã xóa
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days_old)).isoformat()
+        totals = {"sessions": 0, "messages": 0, "documents": 0, "pages": 0, "batches": 0}
+        started = time.monotonic()
+        
+        try:
+            while max_batches is None or totals["batches"] < max_batches:
+                deleted = self._cleanup_batch(cutoff, batch_size)
+                totals["batches"] += 1
+                for key in ("sessions", "messages", "documents", "pages"):
+                    totals[key] += deleted.get(key, 0)
+                if deleted.get("sessions", 0) < batch_size:
+                    break
         except Exception as e:
-            self.logger.error(f"Session cleanup failed: {e}")
-            return 0
+            self.logger.error(f"Session cleanup failed after {totals['sessions']} sessions: {e}")
+        finally:
+            elapsed = time.monotonic() - started
+            totals["elapsed_seconds"] = round(elapsed, 3)
+            totals["sessions_per_second"] = round(totals["sessions"] / elapsed, 1) if elapsed > 0 else 0.0
+            self.last_cleanup_stats = totals
+            if totals["sessions"]:
+                self._cache.invalidate_prefix(("sessions",))
+                self._cache.invalidate_prefix(("messages",))
+                self._cache.invalidate_prefix(("documents",))
+        
+        self.logger.info(
+            f"Cleaned up {totals['sessions']} old sessions ({totals['messages']} messages, "
+            f"{totals['documents']} documents, {totals['pages']} pages) in {totals['batches']} batches, "
+            f"{totals['sessions_per_second']} sessions/s"
+        )
+        return totals["sessions"]
+    
+    def _cleanup_batch(self, cutoff: str, batch_size: int) -> Dict[str, int]:
+        """Xóa một batch sessions cũ hơn cutoff: RPC server-side, fallback các delete theo tập id"""
+        if self._cleanup_rpc_available:
+            try:
+                result = self.supabase.rpc("cleanup_old_sessions_batch", {
+                    "cutoff": cutoff,
+                    "batch_size": batch_size
+                }).execute()
+                return dict(result.data or {})
+            except Exception as e:
+                # Chỉ tắt hẳn RPC khi function không tồn tại; lỗi tạm thời chỉ fallback cho batch này
+                if is_missing_object_error(e):
+                    self._cleanup_rpc_available = False
+                self.logger.warning(f"RPC cleanup_old_sessions_batch failed, falling back: {e}")
+        
+        old_sessions = self.supabase.table("chat_sessions").select("id").lt(
+            "updated_at", cutoff
+        ).order("updated_at").limit(batch_size).execute()
+        session_ids = [session["id"] for session in old_sessions.data or []]
+        if not session_ids:
+            return {"sessions": 0}
+        
+        # Xóa bảng con trước bảng cha để batch bị gián đoạn có thể chạy lại an toàn
+        documents = self.supabase.table("session_documents").select("id").in_(
+            "session_id", session_ids
+        ).execute()
+        document_ids = [document["id"] for document in documents.data or []]
+        
+        deleted_pages = self._delete_in("document_pages", "document_id", document_ids) if document_ids else 0
+        deleted_documents = self._delete_in("session_documents", "session_id", session_ids)
+        deleted_messages = self._delete_in("messages", "session_id", session_ids)
+        deleted_sessions = self._delete_in("chat_sessions", "id", session_ids)
+        
+        return {
+            "sessions": deleted_sessions,
+            "messages": deleted_messages,
+            "documents": deleted_documents,
+            "pages": deleted_pages
+        }
+    
+    def _delete_in(self, table: str, column: str, values: List[str]) -> int:
+        """Delete theo tập giá trị, chỉ trả về số dòng đã xóa (không gửi lại các dòng)"""
+        from postgrest import ReturnMethod
+
+        result = self.supabase.table(table).delete(
+            count="exact", returning=ReturnMethod.minimal
+        ).in_(column, values).execute()
+        return result.count or 0
@@ -0,0 +1,150 @@
+"""
+Chunking engine: tìm ranh giới câu/đoạn một lần cho mỗi tài liệu, chunk theo (start, end) offsets
+"""
+from bisect import bisect_right
+from typing import Iterator, List, Tuple, Union
+
+import numpy as np
+
+from .cache import LRUCache
+from ..config.constants import CHUNK_BOUNDARY_CHARS, CHUNK_BOUNDARY_LOOKBACK, CHUNK_CACHE_MAX_DOCUMENTS
+
+_BOUNDARY_CODES = np.array([ord(char) for char in CHUNK_BOUNDARY_CHARS], dtype=np.uint32)
+
+
+def find_boundaries(text: str) -> np.ndarray:
+    """
+    Tìm vị trí mọi ký tự kết thúc câu/đoạn ('.', '!', '?', xuống dòng) trong một lượt NumPy
+
+    Returns:
+        Mảng int64 các vị trí đã sắp xếp tăng dần
+    """
+    if not text:
+        return np.empty(0, dtype=np.int64)
+    codepoints = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32)
+    return np.flatnonzero(np.isin(codepoints, _BOUNDARY_CODES)).astype(np.int64)
+
+
+class TextBoundaries:
+    """Ranh giới câu của một tài liệu, dùng để sinh chunk với mọi chunk_size/overlap mà không quét lại text"""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.positions = find_boundaries(text)
+        # bisect trên list nhanh hơn gọi np.searchsorted từng phần tử trong vòng lặp
+        self._position_list = self.positions.tolist()
+        self._spans_cache = {}
+
+    def spans(self, chunk_size: int = 1000, overlap: int = 200,
+              lookback: int = CHUNK_BOUNDARY_LOOKBACK) -> List[Tuple[int, int]]:
+        """
+        Chia text thành các chunk dạng (start, end), đã bỏ khoảng trắng ở hai đầu
+
+        Mỗi chunk kết thúc ở ranh giới câu gần nhất trong `lookback` ký tự cuối
+        (nếu có), chunk tiếp theo bắt đầu lùi lại `overlap` ký tự.
+
+        Args:
+            chunk_size: Độ dài tối đa của chunk (ký tự)
+            overlap: Số ký tự chồng lấn giữa hai chunk liên tiếp
+            lookback: Khoảng tìm ranh giới câu tính từ cuối chunk
+
+        Returns:
+            List (start, end) theo thứ tự trong tài liệu
+        """
+        key = (chunk_size, overlap, lookback)
+        cached = self._spans_cache.get(key)
+        if cached is not None:
+            return cached
+
+        text = self.text
+        text_length = len(text)
+        positions = self._position_list
+        spans = []
+        start = 0
+
+        while start < text_length:
+            end = start + chunk_size
+
+            # Ranh giới câu gần nhất trong (end - lookback, end]
+            if end < text_length and positions:
+                idx = bisect_right(positions, end) - 1
+                if idx >= 0:
+                    boundary = positions[idx]
+                    if boundary > end - lookback and boundary >= start:
+                        end = boundary + 1
+
+            span = _strip_span(text, start, min(end, text_length))
+            if span[0] < span[1]:
+                spans.append(span)
+
+            next_start = end - overlap if end > overlap else end
+            start = next_start if next_start > start else end
+
+        self._spans_cache[key] = spans
+        return spans
+
+
+class ChunkView:
+    """Danh sách chunk chỉ giữ (start, end) offsets, text của chunk được cắt ra khi truy cập"""
+
+    def __init__(self, text: str, spans: List[Tuple[int, int]]):
+        self.text = text
+        self.spans = spans
+
+    def __getitem__(self, item: Union[int, slice]):
+        if isinstance(item, slice):
+            return [self.text[start:end] for start, end in self.spans[item]]
+        start, end = self.spans[item]
+        return self.text[start:end]
+
+    def __iter__(self) -> Iterator[str]:
+        for start, end in self.spans:
+            yield self.text[start:end]
+
+    def __len__(self) -> int:
+        return len(self.spans)
+
+
+def _strip_span(text: str, start: int, end: int) -> Tuple[int, int]:
+    """Tương đương text[start:end].strip() nhưng chỉ dịch offsets"""
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
+
+
+class _BoundaryRegistry:
+    """Cache TextBoundaries dùng chung của process, key theo nội dung tài liệu"""
+
+    def __init__(self, max_documents: int = CHUNK_CACHE_MAX_DOCUMENTS):
+        self._entries = LRUCache(max_items=max_documents)
+
+    def get(self, text: str) -> TextBoundaries:
+        # hash() của str được Python cache trên object nên lookup lặp lại là O(1)
+        key = hash(text)
+        boundaries = self._entries.get(key)
+        if boundaries is None or boundaries.text != text:
+            boundaries = TextBoundaries(text)
+            self._entries.put(key, boundaries)
+        return boundaries
+
+
+_boundary_registry = _BoundaryRegistry()
+
+
+def get_text_boundaries(text: str) -> TextBoundaries:
+    """Lấy ranh giới câu của tài liệu (tính một lần, dùng lại cho mọi kích thước chunk)"""
+    return _boundary_registry.get(text)
+
+
+def chunk_spans(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[Tuple[int, int]]:
+    """Chia text thành các chunk dạng (start, end) offsets"""
+    if not text:
+        return []
+    return get_text_boundaries(text).spans(chunk_size, overlap)
+
+
+def chunk_view(text: str, chunk_size: int = 1000, overlap: int = 200) -> ChunkView:
+    """Chia text thành ChunkView (không copy text của chunk cho tới khi truy cập)"""
+    return ChunkView(text, chunk_spans(text, chunk_size, overlap))
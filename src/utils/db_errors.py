@@ -0,0 +1,50 @@
+"""
+Phân loại lỗi database (PostgREST/PostgreSQL, SQLite backend) để quyết định retry hay fallback
+"""
+import sqlite3
+from typing import Optional
+
+# Object chưa được tạo trên database (function, bảng, view, cột)
+MISSING_OBJECT_CODES = {"42883", "42P01", "42703", "PGRST202", "PGRST204", "PGRST205"}
+MISSING_OBJECT_MESSAGES = (
+    "does not exist", "could not find the function", "could not find the table",
+    "no such table", "no such column", "no such function"
+)
+# SQLSTATE class của lỗi dữ liệu (22), vi phạm ràng buộc (23), cú pháp/quyền truy cập (42):
+# gửi lại y nguyên sẽ luôn lỗi
+PERMANENT_SQLSTATE_CLASSES = ("22", "23", "42")
+# PostgREST: PGRST1xx lỗi request, PGRST2xx lỗi schema cache, PGRST3xx lỗi JWT
+PERMANENT_POSTGREST_PREFIXES = ("PGRST1", "PGRST2", "PGRST3")
+
+
+def error_code(error: Exception) -> Optional[str]:
+    """Mã lỗi SQLSTATE/PostgREST của exception (postgrest.APIError.code), None nếu không có"""
+    code = getattr(error, "code", None)
+    return str(code) if code else None
+
+
+def is_missing_object_error(error: Exception) -> bool:
+    """True nếu lỗi do function/bảng/view/cột không tồn tại (nên chuyển sang fallback)"""
+    if error_code(error) in MISSING_OBJECT_CODES:
+        return True
+    message = str(error).lower()
+    return any(text in message for text in MISSING_OBJECT_MESSAGES)
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """
+    True nếu gửi lại cùng request sẽ luôn lỗi (vi phạm khóa ngoại, dữ liệu sai, thiếu object...)
+
+    Chỉ dựa vào mã lỗi database và lỗi ràng buộc/dữ liệu của SQLite. Lỗi kết nối, timeout,
+    database bị lock và mọi lỗi Python khác (ValueError, TypeError...) được coi là tạm thời để
+    tin nhắn không bị bỏ vào dead-letter chỉ vì một lỗi không rõ nguồn gốc.
+    """
+    code = error_code(error)
+    if code:
+        if code.startswith(PERMANENT_POSTGREST_PREFIXES):
+            return True
+        if len(code) == 5 and code[:2] in PERMANENT_SQLSTATE_CLASSES:
+            return True
+    if isinstance(error, (sqlite3.IntegrityError, sqlite3.DataError)):
+        return True
+    return is_missing_object_error(error)
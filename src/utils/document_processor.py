@@ -1,14 +1,24 @@
-import docx
 import streamlit as st
 from io import BytesIO
 import base64
-from mistralai import Mistral
-import openai
 import os
-from typing import Dict, Optional, List, Tuple
-import fitz  # PyMuPDF
-from PIL import Image
+import time
+import hashlib
+import numpy as np
+from typing import TYPE_CHECKING, Dict, Optional, List, Tuple
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from .validators import FileValidator, DocumentValidator
+from .page_store import get_page_store
+from .pdf_handles import get_pdf_handle_cache
+from .page_images import get_page_image_cache, dpi_bucket, pixmap_to_image, THUMBNAIL_BUCKET
+from .resources import get_llm_client, get_mistral_client
+from .ingestion_cache import get_ingestion_cache
+from .cache import LRUCache
+from .chunking import chunk_spans, chunk_view
+from .tokens import estimate_tokens, context_token_budget, chars_for_tokens, truncate_to_tokens
+from .retrieval import (
+    BM25Index, VectorIndex, get_index_registry, get_vector_registry, reciprocal_rank_fusion
+)
 from .error_handler import (
     handle_error, error_boundary, FileProcessingError, 
     LLMConnectionError, show_warning_message, ProgressTracker,
@@ -16,9 +26,18 @@ from .error_handler import (
 )
 from ..config.constants import (
     MAX_DOCUMENT_CHARS, DEFAULT_PDF_DPI, MAX_PDF_DPI, MIN_PDF_DPI,
-    WARNING_MESSAGES, ERROR_MESSAGES
+    WARNING_MESSAGES, ERROR_MESSAGES, OCR_MODEL, MIN_TEXT_LAYER_CHARS,
+    OCR_SHARD_PAGES, OCR_MAX_WORKERS, OCR_SHARD_MAX_RETRIES,
+    RETRIEVAL_CHUNK_SIZE, RETRIEVAL_CHUNK_OVERLAP, DEFAULT_EMBEDDING_MODEL,
+    EMBEDDING_BATCH_SIZE, EMBEDDING_QUERY_CACHE_SIZE, EMBEDDINGS_CACHE_DIR, FEATURES,
+    RETRIEVAL_MODES, DEFAULT_RETRIEVAL_MODE, RETRIEVAL_TOP_K, RETRIEVAL_LATENCY_BUDGET_MS,
+    PROMPT_OVERHEAD_TOKENS, SUMMARY_MAX_TOKENS, DOCUMENT_QA_MAX_TOKENS, DOCUMENT_ANSWER_PREFIX,
+    PAGE_THUMBNAIL_MAX_SIDE, PAGE_IMAGE_FORMAT, PAGE_IMAGE_QUALITY
 )
 
+if TYPE_CHECKING:
+    from PIL import Image
+
 class DocumentProcessor:
     def __init__(self):
         # Khởi tạo Mistral client
@@ -29,25 +48,44 @@ class DocumentProcessor:
             except Exception:
                 self.mistral_api_key = ""
         
-        if self.mistral_api_key:
-            self.mistral_client = Mistral(api_key=self.mistral_api_key)
-        else:
-            self.mistral_client = None
+        # Client dùng chung của process (connection pool keep-alive), session chỉ giữ state riêng
+        self.mistral_client = get_mistral_client(self.mistral_api_key)
+        if not self.mistral_client:
             st.warning("⚠️ Chưa cấu hình Mistral API Key. Chức năng OCR PDF sẽ bị hạn chế.")
         
         # Khởi tạo Local LLM client (LM Studio)
         self.local_llm_url = os.getenv("LOCAL_LLM_URL", "http://localhost:1234/v1")
         try:
-            self.openai_client = openai.OpenAI(
-                base_url=self.local_llm_url,
-                api_key="not_needed"
-            )
+            self.openai_client = get_llm_client(self.local_llm_url)
             st.success("✅ Đã kết nối Local LLM (LM Studio)")
         except Exception as e:
             self.openai_client = None
             st.warning(f"⚠️ Không thể kết nối Local LLM: {str(e)}. Đảm bảo LM Studio đang chạy trên {self.local_llm_url}")
         
-        self.embeddings_cache = {}
+        # Embeddings: model chạy trên LM Studio, cache embedding câu hỏi theo session
+        self.embedding_model = os.getenv("EMBEDDING_MODEL", DEFAULT_EMBEDDING_MODEL)
+        self.embeddings_dir = os.getenv("EMBEDDINGS_CACHE_DIR", EMBEDDINGS_CACHE_DIR)
+        self.embeddings_cache = LRUCache(max_items=EMBEDDING_QUERY_CACHE_SIZE)
+        self._embeddings_available = FEATURES.get('enable_embeddings', True)
+        # Tóm tắt / câu hỏi gần nhất do LLM tạo (False = nội dung fallback, không được cache)
+        self.last_summary_from_llm = False
+        self.last_questions_from_llm = False
+        
+        # Chế độ retrieval: bm25 | dense | hybrid (đổi qua env để so sánh trên benchmark)
+        self.retrieval_mode = os.getenv("RETRIEVAL_MODE", DEFAULT_RETRIEVAL_MODE)
+        if self.retrieval_mode not in RETRIEVAL_MODES:
+            self.retrieval_mode = DEFAULT_RETRIEVAL_MODE
+        self.last_retrieval_stats = {}
+        
+        # Page store dùng chung theo content hash + memo hash của các file đã upload
+        self.page_store = get_page_store()
+        self.pdf_handles = get_pdf_handle_cache()
+        self.page_images = get_page_image_cache()
+        self.ingestion_cache = get_ingestion_cache()
+        self.index_registry = get_index_registry()
+        self.vector_registry = get_vector_registry()
+        self.pdf_pages_cache = {}
+        self._document_hashes = {}
     
     @error_boundary("Document processing", show_user=True)
     def process_document(self, uploaded_file) -> Optional[str]:
@@ -65,6 +103,10 @@ class DocumentProcessor:
         if not validation_result.is_valid:
             raise FileProcessingError(validation_result.error_message, "file_validation_failed")
         
+        # Giữ lại hash đã tính khi validate để dùng cho page store / ingestion cache
+        if validation_result.metadata.get('hash'):
+            self._document_hashes[self._document_memo_key(uploaded_file)] = validation_result.metadata['hash']
+        
         # Check file size warning
         if uploaded_file.size > 50 * 1024 * 1024:  # 50MB
             show_warning_message('large_file')
@@ -98,7 +140,7 @@ class DocumentProcessor:
             show_warning_message('many_pages')
         
         if progress_tracker:
-            progress_tracker.update("Thực hiện OCR")
+            progress_tracker.update("Trích xuất nội dung (text layer + OCR)")
         
         content = self.extract_pdf_content(uploaded_file)
         
@@ -147,80 +189,539 @@ class DocumentProcessor:
         except Exception as e:
             raise FileProcessingError(f"Lỗi xử lý text file: {str(e)}", "text_processing_failed")
     
-    def extract_pdf_content(self, uploaded_file):
-        """Trích xuất text từ file PDF sử dụng Mistral OCR"""
-        if not self.mistral_client:
-            st.error("Mistral API Key chưa được cấu hình. Không thể xử lý PDF.")
+    def get_document_hash(self, uploaded_file) -> str:
+        """
+        Lấy SHA-256 của file upload (được nhớ theo file để không phải hash lại mỗi lần rerun)
+        
+        Args:
+            uploaded_file: File đã upload
+            
+        Returns:
+            Hex digest SHA-256 của nội dung file
+        """
+        memo_key = self._document_memo_key(uploaded_file)
+        doc_hash = self._document_hashes.get(memo_key)
+        if doc_hash is None:
+            doc_hash = FileValidator.compute_file_hash(uploaded_file)
+            self._document_hashes[memo_key] = doc_hash
+        return doc_hash
+    
+    def _document_memo_key(self, uploaded_file) -> tuple:
+        return (
+            getattr(uploaded_file, 'file_id', None) or id(uploaded_file),
+            getattr(uploaded_file, 'name', ''),
+            getattr(uploaded_file, 'size', 0)
+        )
+    
+    def get_cached_document(self, doc_hash: str) -> Optional[Dict]:
+        """
+        Lấy kết quả xử lý đã có của tài liệu từ ingestion cache (dùng chung mọi session)
+        
+        Args:
+            doc_hash: SHA-256 của file
+            
+        Returns:
+            Dict gồm content, pages, summary, questions, page_count hoặc None
+        """
+        cached = self.ingestion_cache.get(doc_hash)
+        if not cached:
             return None
+        
+        # Nạp lại nội dung từng trang để các accessor theo trang không phải OCR
+        if cached.get('pages') and not self.page_store.has_document(doc_hash):
+            self.page_store.put_document(doc_hash, cached['pages'], cached.get('page_count') or len(cached['pages']))
+        
+        # Index BM25/vector không nằm trong entry (không tính được vào giới hạn dung lượng của cache):
+        # lấy lại qua registry, BM25 build lại khi cần, embeddings đọc lại từ file .npy
+        return cached
+    
+    def cache_processed_document(self, doc_hash: str, content: str, summary: str, questions: List[str],
+                                 summary_from_llm: bool = True, questions_from_llm: bool = True) -> None:
+        """
+        Lưu kết quả xử lý (text, trang, tóm tắt, câu hỏi) vào ingestion cache
+        
+        Tóm tắt/câu hỏi fallback (LLM lỗi) không được cache để lần upload sau tạo lại;
+        tài liệu còn trang OCR lỗi thì không cache gì.
+        
+        Args:
+            doc_hash: SHA-256 của file
+            content: Text đã trích xuất
+            summary: Tóm tắt tài liệu
+            questions: Câu hỏi gợi ý
+            summary_from_llm: summary do LLM tạo (không phải fallback)
+            questions_from_llm: questions do LLM tạo (không phải fallback)
+        """
+        if self.page_store.get_missing_pages(doc_hash):
+            return
+        
+        summary = summary if summary_from_llm else ""
+        questions = questions if questions_from_llm else []
+        pages = self.page_store.get_pages(doc_hash)
+        page_count = self.page_store.get_page_count(doc_hash) if pages else None
+        self.ingestion_cache.put(doc_hash, content, summary, questions, pages=pages, page_count=page_count)
+        # Build sẵn index BM25 trong registry (giới hạn riêng theo số tài liệu)
+        self.get_retrieval_index(content)
+    
+    def get_retrieval_index(self, document_text: str) -> Optional[BM25Index]:
+        """
+        Lấy index BM25 của tài liệu, build một lần nếu chưa có
+        
+        Args:
+            document_text: Nội dung tài liệu (hoặc nội dung một trang)
             
+        Returns:
+            BM25Index dùng chung của process hoặc None nếu text rỗng
+        """
+        if not document_text:
+            return None
+        
+        index = self.index_registry.get(document_text)
+        if index is None:
+            chunks = chunk_view(document_text, chunk_size=RETRIEVAL_CHUNK_SIZE, overlap=RETRIEVAL_CHUNK_OVERLAP)
+            index = BM25Index(chunks)
+            self.index_registry.put(document_text, index)
+        return index
+    
+    def get_vector_index(self, document_text: str) -> Optional[VectorIndex]:
+        """
+        Lấy vector index (embeddings của các chunk BM25) của tài liệu, tính một lần cho mỗi tài liệu
+        
+        Vector được lưu trong registry của process và ra file .npy theo hash nội dung,
+        nên mở lại tài liệu ở session khác hoặc sau khi restart không phải embed lại.
+        
+        Args:
+            document_text: Nội dung tài liệu
+            
+        Returns:
+            VectorIndex hoặc None nếu không có embeddings
+        """
+        if not document_text or not self.openai_client or not self._embeddings_available:
+            return None
+        
+        vector_index = self.vector_registry.get(document_text)
+        if vector_index is not None:
+            return vector_index
+        
+        chunks = self.get_retrieval_index(document_text).chunks
+        if not chunks:
+            return None
+        
+        vector_index = self._load_vector_index(document_text, len(chunks))
+        if vector_index is None:
+            vectors = self.embed_texts(chunks)
+            if vectors is None:
+                self._embeddings_available = False
+                show_warning_message('embeddings_unavailable')
+                return None
+            vector_index = self._store_vector_index(document_text, vectors)
+        
+        self.vector_registry.put(document_text, vector_index)
+        return vector_index
+    
+    def _load_vector_index(self, document_text: str, chunk_count: int) -> Optional[VectorIndex]:
+        """Đọc embeddings đã lưu (.npy) của tài liệu, None nếu chưa có hoặc không khớp số chunk"""
+        cache_path = self._embeddings_cache_path(document_text)
+        if not os.path.exists(cache_path):
+            return None
         try:
-            # Mã hóa PDF thành base64
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
-            
-            # Gọi Mistral OCR API
-            with st.spinner("Đang xử lý PDF bằng Mistral OCR..."):
-                ocr_response = self.mistral_client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={
-                        "type": "document_url",
-                        "document_url": f"data:application/pdf;base64,{base64_pdf}"
-                    }
-                )
-                
-                # Lưu thông tin từng trang vào cache
-                self.pdf_pages_cache = {}
-                
-                # Trích xuất nội dung từ tất cả các trang
-                content = ""
-                for i, page in enumerate(ocr_response.pages):
-                    if hasattr(page, 'markdown') and page.markdown:
-                        page_content = page.markdown.strip()
-                        content += page_content + "\n\n"
-                        # Cache nội dung từng trang
-                        self.pdf_pages_cache[i + 1] = page_content
-                
-                return content.strip() if content else None
-                
+            vector_index = VectorIndex.load(cache_path)
+            return vector_index if len(vector_index) == chunk_count else None
         except Exception as e:
-            st.error(f"Lỗi khi xử lý PDF với Mistral OCR: {str(e)}")
+            handle_error(e, "Đọc embeddings đã lưu", show_user=False)
             return None
     
-    def get_pdf_page_count(self, uploaded_file) -> int:
+    def _store_vector_index(self, document_text: str, vectors: np.ndarray) -> VectorIndex:
+        """Tạo VectorIndex từ embeddings và lưu ra file .npy"""
+        vector_index = VectorIndex(vectors)
+        try:
+            os.makedirs(self.embeddings_dir, exist_ok=True)
+            vector_index.save(self._embeddings_cache_path(document_text))
+        except Exception as e:
+            handle_error(e, "Lưu embeddings", show_user=False)
+        return vector_index
+    
+    def embed_texts(self, texts: List[str], timeout: Optional[float] = None) -> Optional[np.ndarray]:
         """
-        Lấy số trang của file PDF
+        Embed danh sách text theo batch qua endpoint /v1/embeddings của Local LLM
         
         Args:
-            uploaded_file: File PDF đã upload
+            texts: Các đoạn text cần embed
+            timeout: Tổng thời gian tối đa (giây) cho mọi request, không retry;
+                None = timeout và retry mặc định của client
             
         Returns:
-            Số trang của PDF
+            Ma trận float32 (len(texts) x số chiều) hoặc None nếu lỗi / hết thời gian
         """
-        if not self.mistral_client:
-            st.error("Mistral API Key chưa được cấu hình.")
-            return 0
-            
+        if not texts:
+            return None
+        
+        deadline = time.perf_counter() + timeout if timeout is not None else None
         try:
-            # Nếu đã có cache từ lần xử lý trước
-            if hasattr(self, 'pdf_pages_cache') and self.pdf_pages_cache:
-                return len(self.pdf_pages_cache)
+            rows = []
+            for start in range(0, len(texts), EMBEDDING_BATCH_SIZE):
+                batch = texts[start:start + EMBEDDING_BATCH_SIZE]
+                client = self.openai_client
+                if deadline is not None:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        return None
+                    # Retry mặc định của client (2 lần, có backoff) sẽ vượt xa ngân sách
+                    client = client.with_options(max_retries=0, timeout=remaining)
+                response = client.embeddings.create(model=self.embedding_model, input=batch)
+                rows.extend(item.embedding for item in sorted(response.data, key=lambda item: item.index))
+            return np.asarray(rows, dtype=np.float32)
+        except Exception as e:
+            handle_error(e, "Tạo embeddings", show_user=False)
+            return None
+    
+    def embed_query(self, text: str, timeout: Optional[float] = None) -> Optional[np.ndarray]:
+        """Embed câu hỏi (có cache theo session)"""
+        cached = self.embeddings_cache.get(text)
+        if cached is not None:
+            return cached
+        
+        vectors = self.embed_texts([text], timeout=timeout)
+        if vectors is None:
+            return None
+        self.embeddings_cache.put(text, vectors[0])
+        return vectors[0]
+    
+    def search_dense(self, question: str, document_text: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Tìm các chunk gần nghĩa nhất với câu hỏi bằng embeddings
+        
+        Returns:
+            List (chunk_id, score) theo thứ tự chunk của index BM25, rỗng nếu không có embeddings
+        """
+        vector_index = self.get_vector_index(document_text)
+        if vector_index is None:
+            return []
+        
+        query_vector = self.embed_query(question)
+        if query_vector is None:
+            return []
+        return vector_index.search(query_vector, top_k=top_k)
+    
+    def retrieve_chunks(self, question: str, document_text: str, mode: Optional[str] = None,
+                        top_k: int = RETRIEVAL_TOP_K) -> Tuple[Optional[BM25Index], List[Tuple[int, float]]]:
+        """
+        Tìm các chunk liên quan đến câu hỏi theo chế độ retrieval
+        
+        Chế độ hybrid chạy BM25 và dense trên cùng tập chunk rồi gộp thứ hạng bằng
+        reciprocal-rank fusion. Nhánh dense chỉ được chạy trong ngân sách
+        RETRIEVAL_LATENCY_BUDGET_MS, quá ngân sách hoặc lỗi thì dùng kết quả BM25.
+        
+        Args:
+            question: Câu hỏi
+            document_text: Nội dung tài liệu
+            mode: bm25 | dense | hybrid (None = self.retrieval_mode)
+            top_k: Số chunk mỗi retriever trả về
             
-            # Mã hóa PDF thành base64
+        Returns:
+            (index BM25 chứa các chunk, list (chunk_id, score) theo độ liên quan giảm dần)
+        """
+        mode = mode or self.retrieval_mode
+        started = time.perf_counter()
+        index = self.get_retrieval_index(document_text)
+        if index is None:
+            return None, []
+        
+        lexical = index.search(question, top_k=top_k) if mode != 'dense' else []
+        dense = []
+        fallback = False
+        
+        if mode in ('dense', 'hybrid'):
+            remaining = RETRIEVAL_LATENCY_BUDGET_MS / 1000 - (time.perf_counter() - started)
+            dense = self._search_dense_within_budget(question, document_text, index, top_k, remaining)
+            fallback = not dense
+        
+        if mode == 'hybrid' and dense:
+            ranked = reciprocal_rank_fusion([lexical, dense])
+        elif dense:
+            ranked = dense
+        else:
+            ranked = lexical if mode != 'dense' else index.search(question, top_k=top_k)
+        
+        self.last_retrieval_stats = {
+            'mode': mode,
+            'fallback': fallback,
+            'latency_ms': (time.perf_counter() - started) * 1000,
+            'chunks': len(ranked)
+        }
+        return index, ranked
+    
+    def _search_dense_within_budget(self, question: str, document_text: str, index: BM25Index,
+                                    top_k: int, remaining: float) -> List[Tuple[int, float]]:
+        """Nhánh dense của retrieve_chunks, trả về rỗng nếu không kịp trong ngân sách còn lại (giây)"""
+        if remaining <= 0:
+            return []
+        
+        deadline = time.perf_counter() + remaining
+        vector_index = self.vector_registry.get(document_text)
+        if vector_index is None:
+            vector_index = self._load_vector_index(document_text, len(index))
+            # Chỉ embed tài liệu ở query time khi vừa một batch (trong ngân sách, không retry),
+            # tài liệu lớn đã được embed lúc ingestion
+            if vector_index is None and self.openai_client and self._embeddings_available \
+                    and len(index) <= EMBEDDING_BATCH_SIZE:
+                vectors = self.embed_texts(index.chunks, timeout=remaining)
+                if vectors is not None:
+                    vector_index = self._store_vector_index(document_text, vectors)
+            if vector_index is None:
+                return []
+            self.vector_registry.put(document_text, vector_index)
+        
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            return []
+        query_vector = self.embed_query(question, timeout=remaining)
+        if query_vector is None:
+            return []
+        return vector_index.search(query_vector, top_k=top_k)
+    
+    def _embeddings_cache_path(self, document_text: str) -> str:
+        """File .npy chứa embeddings của tài liệu (key theo model + nội dung)"""
+        key = hashlib.sha256(f"{self.embedding_model}\n{document_text}".encode('utf-8')).hexdigest()
+        return os.path.join(self.embeddings_dir, f"{key}.npy")
+    
+    def extract_pdf_content(self, uploaded_file):
+        """Trích xuất text từ file PDF (text layer + Mistral OCR, mỗi tài liệu chỉ xử lý một lần)"""
+        doc_hash = self.get_document_hash(uploaded_file)
+        
+        if not self.page_store.has_document(doc_hash):
+            if not self._run_pdf_ocr(uploaded_file, doc_hash):
+                return None
+        
+        # Giữ pdf_pages_cache trỏ tới tài liệu vừa xử lý (tương thích ngược)
+        self.pdf_pages_cache = self.page_store.get_pages(doc_hash)
+        
+        content = "\n\n".join(self.pdf_pages_cache.values())
+        return content.strip() if content else None
+    
+    def _run_pdf_ocr(self, uploaded_file, doc_hash: str) -> bool:
+        """
+        Trích xuất nội dung PDF một lần và lưu từng trang vào page store.
+        
+        Các trang có text layer được đọc trực tiếp bằng PyMuPDF, chỉ những trang
+        scan/ảnh (không có text dùng được) mới gửi sang Mistral OCR.
+        
+        Args:
+            uploaded_file: File PDF đã upload
+            doc_hash: SHA-256 của file
+            
+        Returns:
+            True nếu trích xuất thành công
+        """
+        try:
             uploaded_file.seek(0)
             pdf_bytes = uploaded_file.read()
-            base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
             
-            # Gọi Mistral OCR API để lấy thông tin trang
+            missing_pages = self.page_store.get_missing_pages(doc_hash)
+            if missing_pages:
+                # Lần trước có shard OCR lỗi: chỉ OCR lại các trang còn thiếu
+                pages = self.page_store.get_pages(doc_hash)
+                page_count = self.page_store.get_page_count(doc_hash)
+                ocr_page_numbers = missing_pages
+            else:
+                # Bước 1: đọc text layer cục bộ
+                pages, ocr_page_numbers, page_count = self._extract_text_layer(pdf_bytes)
+            
+            # Bước 2: OCR các trang không có text
+            failed_pages = []
+            if ocr_page_numbers:
+                if self.mistral_client:
+                    ocr_pages, failed_pages = self._ocr_pdf_pages(pdf_bytes, ocr_page_numbers, page_count)
+                    pages.update(ocr_pages)
+                elif pages:
+                    st.warning(f"⚠️ {len(ocr_page_numbers)} trang không có text layer và chưa cấu hình Mistral API Key nên sẽ bị bỏ qua.")
+                else:
+                    st.error("Mistral API Key chưa được cấu hình. Không thể xử lý PDF.")
+                    return False
+            
+            if not pages:
+                # Không trích xuất được gì (vd: Mistral OCR lỗi toàn bộ): không lưu để lần sau thử lại
+                st.error("❌ Không trích xuất được nội dung PDF. Vui lòng thử lại sau.")
+                return False
+            
+            # Ghép kết quả theo thứ tự trang, trang OCR lỗi được đánh dấu để xử lý lại
+            pages = dict(sorted(pages.items()))
+            self.page_store.put_document(doc_hash, pages, page_count, missing_pages=failed_pages)
+            return True
+                
+        except Exception as e:
+            st.error(f"Lỗi khi xử lý PDF với Mistral OCR: {str(e)}")
+            return False
+    
+    def _extract_text_layer(self, pdf_bytes: bytes) -> Tuple[Dict[int, str], List[int], int]:
+        """
+        Đọc text layer của từng trang bằng PyMuPDF
+        
+        Args:
+            pdf_bytes: Nội dung file PDF
+            
+        Returns:
+            Tuple (các trang có text, danh sách trang cần OCR, tổng số trang)
+        """
+        pages = {}
+        ocr_page_numbers = []
+        
+        import fitz  # PyMuPDF, chỉ import khi xử lý PDF
+
+        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            page_count = pdf_document.page_count
+            for index in range(page_count):
+                text = pdf_document[index].get_text("text").strip()
+                if self._has_usable_text(text):
+                    pages[index + 1] = text
+                else:
+                    ocr_page_numbers.append(index + 1)
+        finally:
+            pdf_document.close()
+        
+        return pages, ocr_page_numbers, page_count
+    
+    def _has_usable_text(self, text: str) -> bool:
+        """Kiểm tra text layer có dùng được không (đủ ký tự, không phải font lỗi)"""
+        if not text:
+            return False
+        
+        meaningful_chars = sum(1 for char in text if char.isalnum())
+        if meaningful_chars < MIN_TEXT_LAYER_CHARS:
+            return False
+        
+        # Font không có ToUnicode map thường trả về ký tự thay thế
+        return text.count('\ufffd') / len(text) < 0.1
+    
+    def _ocr_pdf_pages(self, pdf_bytes: bytes, page_numbers: List[int],
+                       page_count: int) -> Tuple[Dict[int, str], List[int]]:
+        """
+        OCR một tập trang của PDF bằng Mistral OCR, chia thành các shard theo dải trang
+        và xử lý song song với số worker giới hạn.
+        
+        Args:
+            pdf_bytes: Nội dung file PDF gốc
+            page_numbers: Các trang cần OCR (từ 1, tăng dần)
+            page_count: Tổng số trang của PDF
+            
+        Returns:
+            Tuple (dict số trang -> nội dung OCR, các trang thuộc shard OCR lỗi)
+        """
+        shards = [
+            page_numbers[i:i + OCR_SHARD_PAGES]
+            for i in range(0, len(page_numbers), OCR_SHARD_PAGES)
+        ]
+        shard_documents = self._build_ocr_shards(pdf_bytes, shards, page_count)
+        
+        pages = {}
+        failed_pages = []
+        progress_tracker = ProgressTracker(len(shards), f"OCR {len(page_numbers)} trang")
+        
+        try:
+            with ThreadPoolExecutor(max_workers=min(OCR_MAX_WORKERS, len(shards))) as executor:
+                futures = {
+                    executor.submit(self._ocr_shard_with_retry, shard_bytes): shard
+                    for shard, shard_bytes in zip(shards, shard_documents)
+                }
+                
+                # Cập nhật progress trên script thread khi từng shard hoàn thành
+                for future in as_completed(futures):
+                    shard = futures[future]
+                    success, shard_pages, _ = future.result()
+                    
+                    if success:
+                        # Map kết quả về số trang gốc
+                        for page_number, page_content in zip(shard, shard_pages):
+                            if page_content:
+                                pages[page_number] = page_content
+                    else:
+                        failed_pages.extend(shard)
+                    
+                    progress_tracker.update(f"Trang {shard[0]}-{shard[-1]}")
+        finally:
+            progress_tracker.cleanup()
+        
+        if failed_pages:
+            st.warning(f"⚠️ Không thể OCR {len(failed_pages)} trang: {', '.join(map(str, sorted(failed_pages)))}")
+        
+        return pages, sorted(failed_pages)
+    
+    def _build_ocr_shards(self, pdf_bytes: bytes, shards: List[List[int]], page_count: int) -> List[bytes]:
+        """Tách các dải trang thành các PDF nhỏ bằng PyMuPDF (chạy trên một thread)"""
+        # Một shard chứa toàn bộ tài liệu thì gửi nguyên file
+        if len(shards) == 1 and len(shards[0]) == page_count:
+            return [pdf_bytes]
+        
+        import fitz  # PyMuPDF, chỉ import khi xử lý PDF
+
+        shard_documents = []
+        source_document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        try:
+            for shard in shards:
+                shard_document = fitz.open()
+                try:
+                    for page_number in shard:
+                        shard_document.insert_pdf(source_document, from_page=page_number - 1, to_page=page_number - 1)
+                    shard_documents.append(shard_document.tobytes())
+                finally:
+                    shard_document.close()
+        finally:
+            source_document.close()
+        
+        return shard_documents
+    
+    def _ocr_shard_with_retry(self, shard_bytes: bytes) -> Tuple[bool, Optional[List[Optional[str]]], Optional[str]]:
+        """OCR một shard với retry (chạy trong worker thread, không gọi Streamlit)"""
+        base64_pdf = base64.b64encode(shard_bytes).decode('utf-8')
+        
+        def _call_ocr():
             ocr_response = self.mistral_client.ocr.process(
-                model="mistral-ocr-latest",
+                model=OCR_MODEL,
                 document={
                     "type": "document_url",
                     "document_url": f"data:application/pdf;base64,{base64_pdf}"
                 }
             )
+            return [
+                page.markdown.strip() if getattr(page, 'markdown', None) else None
+                for page in (ocr_response.pages or [])
+            ]
+        
+        return safe_execute_with_retry(
+            _call_ocr,
+            max_retries=OCR_SHARD_MAX_RETRIES,
+            delay=1.0,
+            context="Mistral OCR shard",
+            show_user=False
+        )
+    
+    def _ensure_pdf_pages(self, uploaded_file) -> Optional[str]:
+        """Đảm bảo các trang của PDF đã có trong page store, trả về doc hash nếu có"""
+        doc_hash = self.get_document_hash(uploaded_file)
+        if self.page_store.has_document(doc_hash):
+            return doc_hash
+        if self._run_pdf_ocr(uploaded_file, doc_hash):
+            return doc_hash
+        return None
+    
+    def get_pdf_page_count(self, uploaded_file) -> int:
+        """
+        Lấy số trang của file PDF
+        
+        Args:
+            uploaded_file: File PDF đã upload
             
-            return len(ocr_response.pages) if ocr_response.pages else 0
+        Returns:
+            Số trang của PDF
+        """
+        try:
+            # Nếu đã có trong page store từ lần xử lý trước
+            doc_hash = self.get_document_hash(uploaded_file)
+            if self.page_store.has_document(doc_hash):
+                return self.page_store.get_page_count(doc_hash)
+            
+            # Đếm trang không cần OCR
+            return self.get_pdf_page_count_with_pymupdf(uploaded_file)
             
         except Exception as e:
             st.error(f"Lỗi khi đếm trang PDF: {str(e)}")
@@ -237,37 +738,12 @@ class DocumentProcessor:
         Returns:
             Nội dung của trang đó hoặc None nếu lỗi
         """
-        if not self.mistral_client:
-            st.error("Mistral API Key chưa được cấu hình.")
-            return None
-            
         try:
-            # Kiểm tra cache trước
-            if hasattr(self, 'pdf_pages_cache') and page_number in self.pdf_pages_cache:
-                return self.pdf_pages_cache[page_number]
-            
-            # Mã hóa PDF thành base64
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
-            
-            # Gọi Mistral OCR API
-            with st.spinner(f"Đang xử lý trang {page_number}..."):
-                ocr_response = self.mistral_client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={
-                        "type": "document_url",
-                        "document_url": f"data:application/pdf;base64,{base64_pdf}"
-                    }
-                )
-                
-                # Lấy nội dung trang cụ thể
-                if ocr_response.pages and len(ocr_response.pages) >= page_number:
-                    page = ocr_response.pages[page_number - 1]  # Index từ 0
-                    if hasattr(page, 'markdown') and page.markdown:
-                        return page.markdown.strip()
-                
+            doc_hash = self._ensure_pdf_pages(uploaded_file)
+            if not doc_hash:
                 return None
+            
+            return self.page_store.get_page(doc_hash, page_number)
                 
         except Exception as e:
             st.error(f"Lỗi khi xử lý trang {page_number}: {str(e)}")
@@ -285,37 +761,12 @@ class DocumentProcessor:
         Returns:
             Dict với key là số trang, value là nội dung
         """
-        if not self.mistral_client:
-            st.error("Mistral API Key chưa được cấu hình.")
-            return {}
-            
         try:
-            # Mã hóa PDF thành base64
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            base64_pdf = base64.b64encode(pdf_bytes).decode('utf-8')
-            
-            # Gọi Mistral OCR API
-            with st.spinner(f"Đang xử lý trang {start_page}-{end_page}..."):
-                ocr_response = self.mistral_client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={
-                        "type": "document_url",
-                        "document_url": f"data:application/pdf;base64,{base64_pdf}"
-                    }
-                )
-                
-                # Trích xuất nội dung từ dải trang
-                pages_content = {}
-                if ocr_response.pages:
-                    for page_num in range(start_page, min(end_page + 1, len(ocr_response.pages) + 1)):
-                        page_index = page_num - 1  # Index từ 0
-                        if page_index < len(ocr_response.pages):
-                            page = ocr_response.pages[page_index]
-                            if hasattr(page, 'markdown') and page.markdown:
-                                pages_content[page_num] = page.markdown.strip()
-                
-                return pages_content
+            doc_hash = self._ensure_pdf_pages(uploaded_file)
+            if not doc_hash:
+                return {}
+            
+            return self.page_store.get_pages_range(doc_hash, start_page, end_page)
                 
         except Exception as e:
             st.error(f"Lỗi khi xử lý trang {start_page}-{end_page}: {str(e)}")
@@ -324,6 +775,8 @@ class DocumentProcessor:
     def extract_docx_content(self, uploaded_file):
         """Trích xuất text từ file DOCX"""
         try:
+            import docx  # python-docx, chỉ import khi xử lý file DOCX
+
             doc = docx.Document(BytesIO(uploaded_file.read()))
             text = ""
             for paragraph in doc.paragraphs:
@@ -360,40 +813,24 @@ class DocumentProcessor:
         if not text:
             return []
         
-        chunks = []
-        start = 0
-        text_length = len(text)
-        
-        while start < text_length:
-            end = start + chunk_size
-            
-            # Tìm điểm ngắt tự nhiên (kết thúc câu hoặc đoạn)
-            if end < text_length:
-                # Tìm ngắt câu gần nhất
-                for i in range(end, start + chunk_size - 100, -1):
-                    if text[i] in '.!?\n':
-                        end = i + 1
-                        break
-            
-            chunk = text[start:end].strip()
-            if chunk:
-                chunks.append(chunk)
-            
-            start = end - overlap if end > overlap else end
-        
-        return chunks
+        # Ranh giới câu được tính một lần cho mỗi tài liệu, mọi chunk_size/overlap dùng lại
+        return [text[start:end] for start, end in chunk_spans(text, chunk_size, overlap)]
     
     def summarize_text_with_openai(self, text, max_words=150):
         """Tóm tắt văn bản sử dụng Local LLM"""
+        self.last_summary_from_llm = False
         if not self.openai_client:
             return "Không thể kết nối Local LLM. Vui lòng khởi động LM Studio trước."
             
+        # Chunk nào lỗi sẽ đặt lại cờ về False
+        self.last_summary_from_llm = True
         try:
-            # Chia text thành chunks nếu quá dài (GPT có giới hạn token)
-            max_input_length = 3000  # Khoảng 3000 characters ~ 750 tokens
+            # Chia text thành chunks nếu vượt ngân sách token của model
+            max_input_tokens = context_token_budget(SUMMARY_MAX_TOKENS, PROMPT_OVERHEAD_TOKENS)
             
-            if len(text) > max_input_length:
-                chunks = self.chunk_text(text, chunk_size=max_input_length, overlap=200)
+            if estimate_tokens(text) > max_input_tokens:
+                chunk_size = chars_for_tokens(text, max_input_tokens)
+                chunks = self.chunk_text(text, chunk_size=chunk_size, overlap=200)
                 summaries = []
                 
                 # Tóm tắt từng chunk
@@ -405,7 +842,7 @@ class DocumentProcessor:
                 
                 # Kết hợp và tóm tắt final
                 combined_text = " ".join(summaries)
-                if len(combined_text) > max_input_length:
+                if estimate_tokens(combined_text) > max_input_tokens:
                     final_summary = self._summarize_chunk_with_openai(combined_text, max_words)
                     return final_summary
                 else:
@@ -414,6 +851,7 @@ class DocumentProcessor:
                 return self._summarize_chunk_with_openai(text, max_words)
                 
         except Exception as e:
+            self.last_summary_from_llm = False
             st.error(f"Lỗi khi tóm tắt với OpenAI: {str(e)}")
             return f"Không thể tóm tắt tài liệu. Lỗi: {str(e)}"
     
@@ -433,7 +871,7 @@ Tóm tắt ngắn gọn, dễ hiểu:"""
                     {"role": "system", "content": "Bạn là một chuyên gia tóm tắt văn bản. Hãy tóm tắt nội dung một cách súc tích và chính xác bằng tiếng Việt."},
                     {"role": "user", "content": prompt}
                 ],
-                max_tokens=300,
+                max_tokens=SUMMARY_MAX_TOKENS,
                 temperature=0.3,  # Thấp để có kết quả ổn định
             )
             
@@ -452,6 +890,7 @@ Tóm tắt ngắn gọn, dễ hiểu:"""
             return result
         else:
             # Fallback summary
+            self.last_summary_from_llm = False
             return f"📄 **Tóm tắt tự động:** Tài liệu chứa {len(text)} ký tự. Nội dung bao gồm các thông tin quan trọng cần được phân tích chi tiết. (Local LLM không khả dụng - {str(error_message)[:50]}...)"
     
     # Để tương thích backward, tạo alias
@@ -472,6 +911,8 @@ Tóm tắt ngắn gọn, dễ hiểu:"""
                 "Thông tin nào đáng chú ý nhất?"
             ]
         
+        self.last_questions_from_llm = False
+        
         # Nếu không có Mistral client, trả về câu hỏi mặc định
         if not self.mistral_client:
             return _get_fallback_questions()
@@ -513,6 +954,7 @@ Yêu cầu:
         )
         
         if success and result and len(result) >= 3:
+            self.last_questions_from_llm = True
             return result
         else:
             # Xử lý lỗi cụ thể và trả về câu hỏi phù hợp
@@ -611,80 +1053,148 @@ Yêu cầu:
             return "Không thể kết nối Local LLM. Vui lòng khởi động LM Studio trước."
             
         try:
-            # Tìm phần văn bản liên quan đến câu hỏi
-            relevant_text = self._find_relevant_text_for_question(question, document_text, max_length=2500)
-            
-            # Tạo system prompt chuyên biệt cho Q&A
-            system_prompt = """Bạn là một AI assistant chuyên trả lời câu hỏi dựa trên tài liệu được cung cấp. 
-Hãy trả lời chính xác, chi tiết và dựa hoàn toàn vào nội dung tài liệu. 
-Nếu thông tin không có trong tài liệu, hãy nói rõ là không tìm thấy thông tin đó."""
-            
-            # Tạo user prompt với context và question
-            user_prompt = f"""Dựa vào đoạn văn bản sau, hãy trả lời câu hỏi một cách chính xác và chi tiết:
-
-ĐOẠN VĂN BẢN:
-{relevant_text}
-
-CÂU HỎI: {question}
-
-Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong đoạn văn bản trên:"""
-
             response = self.openai_client.chat.completions.create(
                 model="local-model",
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=400,
+                messages=self._build_document_qa_messages(question, document_text),
+                max_tokens=DOCUMENT_QA_MAX_TOKENS,
                 temperature=0.2,  # Thấp để có câu trả lời chính xác
             )
             
             answer = response.choices[0].message.content.strip()
             
             # Thêm prefix để người dùng biết đây là câu trả lời dựa trên tài liệu
-            return f"📄 **Dựa trên tài liệu:** {answer}"
+            return f"{DOCUMENT_ANSWER_PREFIX} {answer}"
             
         except Exception as e:
             st.error(f"Lỗi khi trả lời câu hỏi với Local LLM: {str(e)}")
             # Fallback với keyword matching
             return self._simple_keyword_answer(question, document_text)
     
+    def answer_question_stream(self, question, document_text):
+        """
+        Trả lời câu hỏi dựa trên tài liệu dạng streaming
+        
+        Yields:
+            Từng đoạn text của câu trả lời ngay khi Local LLM sinh ra (dùng với st.write_stream)
+        """
+        if not document_text:
+            yield "Không có tài liệu nào để trả lời câu hỏi."
+            return
+        
+        if not self.openai_client:
+            yield "Không thể kết nối Local LLM. Vui lòng khởi động LM Studio trước."
+            return
+        
+        received_tokens = False
+        try:
+            stream = self.openai_client.chat.completions.create(
+                model="local-model",
+                messages=self._build_document_qa_messages(question, document_text),
+                max_tokens=DOCUMENT_QA_MAX_TOKENS,
+                temperature=0.2,  # Thấp để có câu trả lời chính xác
+                stream=True
+            )
+            
+            for chunk in stream:
+                delta = chunk.choices[0].delta.content if chunk.choices else None
+                if not delta:
+                    continue
+                if not received_tokens:
+                    received_tokens = True
+                    yield f"{DOCUMENT_ANSWER_PREFIX} "
+                yield delta
+            
+            # Stream kết thúc mà không có token nào -> không để câu trả lời rỗng
+            if not received_tokens:
+                yield self._simple_keyword_answer(question, document_text)
+                
+        except Exception as e:
+            if received_tokens:
+                handle_error(e, "Local LLM streaming", show_user=False)
+                yield "\n\n⚠️ Phản hồi bị gián đoạn, vui lòng thử lại."
+            else:
+                st.error(f"Lỗi khi trả lời câu hỏi với Local LLM: {str(e)}")
+                # Fallback với keyword matching
+                yield self._simple_keyword_answer(question, document_text)
+    
+    def _build_document_qa_messages(self, question, document_text) -> List[Dict]:
+        """Tạo messages (system + user prompt kèm context liên quan) cho document Q&A"""
+        # Tạo system prompt chuyên biệt cho Q&A
+        system_prompt = """Bạn là một AI assistant chuyên trả lời câu hỏi dựa trên tài liệu được cung cấp. 
+Hãy trả lời chính xác, chi tiết và dựa hoàn toàn vào nội dung tài liệu. 
+Nếu thông tin không có trong tài liệu, hãy nói rõ là không tìm thấy thông tin đó."""
+        
+        # Tìm phần văn bản liên quan đến câu hỏi, lấy nhiều nhất có thể trong ngân sách token
+        context_budget = context_token_budget(
+            DOCUMENT_QA_MAX_TOKENS,
+            estimate_tokens(system_prompt) + estimate_tokens(question) + PROMPT_OVERHEAD_TOKENS
+        )
+        relevant_text = self._find_relevant_text_for_question(question, document_text, max_tokens=context_budget)
+        
+        # Tạo user prompt với context và question
+        user_prompt = f"""Dựa vào đoạn văn bản sau, hãy trả lời câu hỏi một cách chính xác và chi tiết:
+
+ĐOẠN VĂN BẢN:
+{relevant_text}
+
+CÂU HỎI: {question}
+
+Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong đoạn văn bản trên:"""
+        
+        return [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+    
     # Để tương thích backward, tạo alias
     def answer_question_with_bart(self, question, document_text):
         """Alias cho backward compatibility"""
         return self.answer_question_with_openai(question, document_text)
     
-    def _find_relevant_text_for_question(self, question, document_text, max_length=1500):
-        """Tìm phần văn bản liên quan nhất với câu hỏi"""
-        # Trích xuất keywords từ câu hỏi
-        question_keywords = self._extract_keywords(question.lower())
+    def _find_relevant_text_for_question(self, question, document_text, max_length=1500, max_tokens=None):
+        """
+        Tìm phần văn bản liên quan nhất với câu hỏi (BM25 / dense / hybrid theo retrieval_mode)
         
-        # Chia document thành các đoạn
-        chunks = self.chunk_text(document_text, chunk_size=500, overlap=100)
+        Args:
+            question: Câu hỏi
+            document_text: Nội dung tài liệu
+            max_length: Giới hạn số ký tự của context
+            max_tokens: Giới hạn số token của context (ưu tiên hơn max_length nếu có)
+        """
+        index = self.get_retrieval_index(document_text)
+        if index is None:
+            return ""
         
-        # Tính điểm relevance cho mỗi chunk
-        chunk_scores = []
-        for chunk in chunks:
-            score = self._calculate_relevance_score(question_keywords, chunk.lower())
-            chunk_scores.append((chunk, score))
+        # Kết hợp các chunks tốt nhất trong ngân sách (token nếu có, ngược lại là ký tự)
+        if max_tokens is not None:
+            budget, chunk_costs = max_tokens, index.token_counts
+        else:
+            budget, chunk_costs = max_length, None
         
-        # Sắp xếp theo điểm số và lấy chunks tốt nhất
-        chunk_scores.sort(key=lambda x: x[1], reverse=True)
+        # Lấy đủ chunk ứng viên để lấp đầy ngân sách
+        average_cost = index.avg_token_count if chunk_costs is not None else RETRIEVAL_CHUNK_SIZE
+        top_k = max(RETRIEVAL_TOP_K, int(budget / max(average_cost, 1)) + 1)
+        index, ranked = self.retrieve_chunks(question, document_text, top_k=top_k)
         
-        # Kết hợp các chunks tốt nhất trong giới hạn max_length
-        relevant_text = ""
-        current_length = 0
+        selected = []
+        used = 0
         
-        for chunk, score in chunk_scores:
-            if score > 0 and current_length + len(chunk) <= max_length:
-                relevant_text += chunk + "\n\n"
-                current_length += len(chunk)
-            if current_length >= max_length:
+        for chunk_id, score in ranked:
+            cost = chunk_costs[chunk_id] if chunk_costs is not None else len(index.chunks[chunk_id])
+            if used + cost <= budget:
+                selected.append(index.chunks[chunk_id])
+                used += cost
+            if used >= budget:
                 break
         
+        relevant_text = "\n\n".join(selected)
+        
         # Nếu không tìm thấy gì liên quan, lấy phần đầu document
         if not relevant_text.strip():
-            relevant_text = document_text[:max_length]
+            if max_tokens is not None:
+                relevant_text = truncate_to_tokens(document_text, max_tokens)
+            else:
+                relevant_text = document_text[:max_length]
         
         return relevant_text.strip()
     
@@ -697,13 +1207,6 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
         keywords = [word for word in words if len(word) > 2 and word not in stop_words]
         return keywords
     
-    def _calculate_relevance_score(self, keywords, text):
-        """Tính điểm relevance dựa trên số lượng keywords xuất hiện"""
-        score = 0
-        for keyword in keywords:
-            score += text.count(keyword)
-        return score
-    
     def _simple_keyword_answer(self, question, document_text):
         """Fallback method với keyword matching đơn giản"""
         keywords = self._extract_keywords(question.lower())
@@ -724,7 +1227,7 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
         else:
             return f"Không tìm thấy thông tin cụ thể về '{question}' trong tài liệu."
     
-    def extract_pdf_page_as_image(self, uploaded_file, page_number: int, dpi: int = 150) -> Optional[Image.Image]:
+    def extract_pdf_page_as_image(self, uploaded_file, page_number: int, dpi: int = 150) -> Optional["Image.Image"]:
         """
         Convert trang PDF thành hình ảnh PIL Image
         
@@ -734,47 +1237,132 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
             dpi: Độ phân giải (mặc định 150 DPI)
             
         Returns:
-            PIL Image hoặc None nếu lỗi
+            PIL Image hoặc None nếu lỗi (ảnh lấy từ cache dùng chung, không sửa tại chỗ)
         """
         try:
-            # Reset file pointer
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            
-            # Mở PDF với PyMuPDF
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-            
+            handle = self._get_pdf_handle(uploaded_file)
             # Kiểm tra page number hợp lệ
-            if page_number < 1 or page_number > pdf_document.page_count:
-                st.error(f"❌ Trang {page_number} không tồn tại. PDF có {pdf_document.page_count} trang.")
-                pdf_document.close()
+            if page_number < 1 or page_number > handle.page_count:
+                st.error(f"❌ Trang {page_number} không tồn tại. PDF có {handle.page_count} trang.")
                 return None
             
-            # Lấy trang (index từ 0)
-            page = pdf_document[page_number - 1]
+            # Các mức zoom gần nhau dùng chung một ảnh render ở DPI bucket (>= dpi yêu cầu)
+            return self._get_page_image(uploaded_file, page_number, dpi_bucket(dpi))
             
-            # Tạo matrix với DPI cụ thể
-            zoom = dpi / 72.0  # 72 DPI là mặc định
-            matrix = fitz.Matrix(zoom, zoom)
+        except Exception as e:
+            st.error(f"❌ Lỗi khi convert PDF sang ảnh: {str(e)}")
+            return None
+    
+    def get_pdf_page_image_bytes(self, uploaded_file, page_number: int, dpi: int = 150,
+                                 image_format: str = PAGE_IMAGE_FORMAT,
+                                 quality: int = PAGE_IMAGE_QUALITY) -> Optional[bytes]:
+        """
+        Ảnh trang PDF đã nén (JPEG/WebP) để gửi thẳng xuống trình duyệt qua st.image
+        
+        Args:
+            uploaded_file: File PDF đã upload
+            page_number: Số trang cần convert (bắt đầu từ 1)
+            dpi: Độ phân giải (mặc định 150 DPI)
+            image_format: Định dạng ảnh (PAGE_IMAGE_FORMATS)
+            quality: Chất lượng nén JPEG/WebP
             
-            # Render trang thành pixmap
-            pixmap = page.get_pixmap(matrix=matrix)
+        Returns:
+            Nội dung file ảnh hoặc None nếu lỗi
+        """
+        try:
+            bucket = dpi_bucket(dpi)
+            return self.page_images.get_or_encode(
+                (self.get_document_hash(uploaded_file), page_number, bucket),
+                image_format,
+                quality,
+                lambda: self.extract_pdf_page_as_image(uploaded_file, page_number, bucket)
+            )
             
-            # Convert pixmap thành PIL Image
-            img_data = pixmap.tobytes("ppm")
-            pil_image = Image.open(BytesIO(img_data))
+        except Exception as e:
+            st.error(f"❌ Lỗi khi nén ảnh trang PDF: {str(e)}")
+            return None
+    
+    def get_pdf_page_thumbnail(self, uploaded_file, page_number: int,
+                               max_side: int = PAGE_THUMBNAIL_MAX_SIDE) -> Optional["Image.Image"]:
+        """
+        Thumbnail của trang PDF (render ở DPI thấp, cache riêng) cho page picker
+        
+        Args:
+            uploaded_file: File PDF đã upload
+            page_number: Số trang (bắt đầu từ 1)
+            max_side: Cạnh dài nhất của thumbnail (pixels)
             
-            # Đóng resources
-            pixmap = None
-            pdf_document.close()
+        Returns:
+            PIL Image hoặc None nếu lỗi
+        """
+        try:
+            page_size = self._get_pdf_handle(uploaded_file).page_size(page_number)
+            if not page_size or max(page_size) <= 0:
+                return None
             
-            return pil_image
+            zoom = max_side / max(page_size)
+            return self.page_images.get_or_render(
+                (self.get_document_hash(uploaded_file), page_number, f"{THUMBNAIL_BUCKET}{max_side}"),
+                lambda: self._render_pdf_page(uploaded_file, page_number, zoom)
+            )
             
-        except Exception as e:
-            st.error(f"❌ Lỗi khi convert PDF sang ảnh: {str(e)}")
+        except Exception:
             return None
     
-    def get_pdf_page_image_base64(self, uploaded_file, page_number: int, dpi: int = 150) -> Optional[str]:
+    def prefetch_pdf_page(self, uploaded_file, page_number: int, dpi: int = 150) -> bool:
+        """
+        Render và nén trước ảnh trang vào cache (chạy ở background thread)
+        
+        Chỉ prefetch ảnh: nội dung trang đã nằm sẵn trong page store sau lần xử lý tài liệu
+        (text layer + OCR), nên không có gì để nạp trước. Không gọi st.* và không chạy OCR.
+        
+        Args:
+            uploaded_file: File PDF đã upload (đã được hash ở main thread)
+            page_number: Số trang (bắt đầu từ 1)
+            dpi: Độ phân giải trang đang xem
+            
+        Returns:
+            True nếu ảnh trang (cả bản đã nén) đã có trong cache
+        """
+        handle = self._get_pdf_handle(uploaded_file)
+        if page_number < 1 or page_number > handle.page_count:
+            return False
+        
+        doc_hash = self.get_document_hash(uploaded_file)
+        bucket = dpi_bucket(dpi)
+        data = self.page_images.get_or_encode(
+            (doc_hash, page_number, bucket),
+            PAGE_IMAGE_FORMAT,
+            PAGE_IMAGE_QUALITY,
+            lambda: self._get_page_image(uploaded_file, page_number, bucket)
+        )
+        return data is not None
+    
+    def _get_page_image(self, uploaded_file, page_number: int, bucket: int) -> Optional["Image.Image"]:
+        """Ảnh trang ở DPI bucket, render một lần rồi lấy từ cache"""
+        return self.page_images.get_or_render(
+            (self.get_document_hash(uploaded_file), page_number, bucket),
+            lambda: self._render_pdf_page(uploaded_file, page_number, bucket / 72.0)
+        )
+    
+    def _render_pdf_page(self, uploaded_file, page_number: int, zoom: float) -> Optional["Image.Image"]:
+        """Rasterize một trang (72 DPI x zoom) thành PIL Image"""
+        import fitz  # PyMuPDF, chỉ import khi render trang
+        
+        # fitz.Document được mở một lần cho mỗi PDF và dùng lại cho mọi lần render
+        with self._open_pdf(uploaded_file) as handle:
+            # Lấy trang (index từ 0)
+            page = handle.document[page_number - 1]
+            
+            # Render trang thành pixmap
+            pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+        
+        # Dựng PIL Image thẳng từ sample buffer (không encode/parse PPM trung gian)
+        return pixmap_to_image(pixmap)
+    
+    def get_pdf_page_image_base64(self, uploaded_file, page_number: int, dpi: int = 150,
+                                  image_format: str = PAGE_IMAGE_FORMAT,
+                                  quality: int = PAGE_IMAGE_QUALITY) -> Optional[str]:
         """
         Convert trang PDF thành base64 string để hiển thị trong Streamlit
         
@@ -782,24 +1370,20 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
             uploaded_file: File PDF đã upload
             page_number: Số trang cần convert (bắt đầu từ 1)
             dpi: Độ phân giải (mặc định 150 DPI)
+            image_format: Định dạng ảnh, data URI dùng MIME image/<định dạng viết thường>
+            quality: Chất lượng nén JPEG/WebP
             
         Returns:
             Base64 string hoặc None nếu lỗi
         """
         try:
-            # Lấy PIL Image
-            pil_image = self.extract_pdf_page_as_image(uploaded_file, page_number, dpi)
+            # Bản nén đã cache, không encode lại mỗi lần
+            img_bytes = self.get_pdf_page_image_bytes(uploaded_file, page_number, dpi, image_format, quality)
             
-            if pil_image is None:
+            if img_bytes is None:
                 return None
             
-            # Convert PIL Image thành base64
-            buffer = BytesIO()
-            pil_image.save(buffer, format="PNG")
-            img_bytes = buffer.getvalue()
-            img_base64 = base64.b64encode(img_bytes).decode()
-            
-            return img_base64
+            return base64.b64encode(img_bytes).decode()
             
         except Exception as e:
             st.error(f"❌ Lỗi khi tạo base64 image: {str(e)}")
@@ -816,15 +1400,8 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
             Số trang của PDF
         """
         try:
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            
-            # Mở PDF với PyMuPDF
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-            page_count = pdf_document.page_count
-            pdf_document.close()
-            
-            return page_count
+            # Số trang được tính sẵn khi mở PDF lần đầu
+            return self._get_pdf_handle(uploaded_file).page_count
             
         except Exception as e:
             st.error(f"❌ Lỗi khi đếm trang PDF với PyMuPDF: {str(e)}")
@@ -842,22 +1419,34 @@ Hãy trả lời bằng tiếng Việt, dựa hoàn toàn vào thông tin trong
             Tuple (width, height) hoặc (0, 0) nếu lỗi
         """
         try:
-            uploaded_file.seek(0)
-            pdf_bytes = uploaded_file.read()
-            
-            pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-            
-            if page_number < 1 or page_number > pdf_document.page_count:
-                pdf_document.close()
+            # Kích thước các trang được tính sẵn khi mở PDF lần đầu
+            page_size = self._get_pdf_handle(uploaded_file).page_size(page_number)
+            if page_size is None:
                 return (0, 0)
             
-            page = pdf_document[page_number - 1]
-            rect = page.rect
-            
-            pdf_document.close()
-            
-            return (int(rect.width), int(rect.height))
+            return (int(page_size[0]), int(page_size[1]))
             
         except Exception as e:
             st.error(f"❌ Lỗi khi lấy kích thước PDF: {str(e)}")
             return (0, 0)
+    
+    def _read_upload_bytes(self, uploaded_file) -> bytes:
+        # getvalue() không đổi vị trí đọc của file nên gọi được từ thread prefetch
+        if hasattr(uploaded_file, 'getvalue'):
+            return uploaded_file.getvalue()
+        uploaded_file.seek(0)
+        return uploaded_file.read()
+    
+    def _get_pdf_handle(self, uploaded_file):
+        """PDFHandle dùng chung của process cho file upload (chỉ đọc file khi mở lần đầu)"""
+        return self.pdf_handles.get(
+            self.get_document_hash(uploaded_file),
+            lambda: self._read_upload_bytes(uploaded_file)
+        )
+    
+    def _open_pdf(self, uploaded_file):
+        """Context manager giữ lock của fitz.Document trong lúc render"""
+        return self.pdf_handles.open_document(
+            self.get_document_hash(uploaded_file),
+            lambda: self._read_upload_bytes(uploaded_file)
+        )
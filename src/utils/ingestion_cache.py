@@ -0,0 +1,94 @@
+"""
+Ingestion cache dùng chung giữa các user và session, key theo SHA-256 của file upload
+"""
+import sys
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+from .cache import LRUCache
+from ..config.constants import INGESTION_CACHE_MAX_DOCUMENTS, INGESTION_CACHE_MAX_MB
+
+
+def _estimate_entry_size(entry: Dict) -> int:
+    """Ước lượng bộ nhớ (bytes) của một entry"""
+    size = sys.getsizeof(entry.get("content") or "")
+    size += sys.getsizeof(entry.get("summary") or "")
+    size += sum(sys.getsizeof(page) for page in (entry.get("pages") or {}).values())
+    size += sum(sys.getsizeof(question) for question in (entry.get("questions") or []))
+    return size
+
+
+class IngestionCache:
+    """
+    Lưu kết quả xử lý tài liệu (text, nội dung từng trang, tóm tắt, câu hỏi gợi ý).
+
+    Khi cùng một file được upload lại ở bất kỳ session nào, kết quả được lấy
+    từ cache thay vì chạy lại OCR, summarize_text và generate_questions.
+    """
+
+    def __init__(self, max_documents: int = INGESTION_CACHE_MAX_DOCUMENTS,
+                 max_mb: int = INGESTION_CACHE_MAX_MB):
+        self._entries = LRUCache(
+            max_items=max_documents,
+            max_size=max_mb * 1024 * 1024,
+            sizeof=_estimate_entry_size
+        )
+
+    def get(self, doc_hash: str) -> Optional[Dict]:
+        """Lấy kết quả đã xử lý của tài liệu, None nếu chưa có"""
+        if not doc_hash:
+            return None
+        return self._entries.get(doc_hash)
+
+    def put(self, doc_hash: str, content: str, summary: str, questions: List[str],
+            pages: Optional[Dict[int, str]] = None, page_count: Optional[int] = None) -> None:
+        """
+        Lưu kết quả xử lý của một tài liệu
+
+        Args:
+            doc_hash: SHA-256 của file
+            content: Text đã trích xuất
+            summary: Tóm tắt tài liệu
+            questions: Câu hỏi gợi ý
+            pages: Nội dung từng trang (cho PDF)
+            page_count: Số trang (cho PDF)
+        """
+        if not doc_hash or not content:
+            return
+        self._entries.put(doc_hash, {
+            "hash": doc_hash,
+            "content": content,
+            "summary": summary,
+            "questions": list(questions or []),
+            "pages": dict(pages or {}),
+            "page_count": page_count,
+            "cached_at": datetime.now(timezone.utc)
+        })
+
+    def update(self, doc_hash: str, **fields) -> None:
+        """
+        Cập nhật thêm trường vào entry đã có
+
+        Chỉ dùng cho dữ liệu mà _estimate_entry_size tính được (text); index BM25/vector
+        được giữ trong registry riêng của retrieval.
+        """
+        entry = self._entries.get(doc_hash)
+        if entry is None:
+            return
+        updated = dict(entry)
+        updated.update(fields)
+        self._entries.put(doc_hash, updated)
+
+    def __contains__(self, doc_hash: str) -> bool:
+        return doc_hash in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_ingestion_cache = IngestionCache()
+
+
+def get_ingestion_cache() -> IngestionCache:
+    """Lấy ingestion cache dùng chung của process"""
+    return _ingestion_cache
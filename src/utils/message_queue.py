@@ -0,0 +1,274 @@
+"""
+Write-behind queue cho tin nhắn chat: nhận tin nhắn ngay, ghi xuống Supabase theo batch
+"""
+import atexit
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Tuple
+
+from .resources import get_resource
+from .db_errors import is_missing_object_error, is_permanent_error
+from ..config.constants import (
+    MESSAGE_FLUSH_INTERVAL, MESSAGE_BATCH_SIZE, MESSAGE_RETRY_DELAY, MESSAGE_SHUTDOWN_TIMEOUT,
+    MESSAGE_MAX_ATTEMPTS, MESSAGE_DEAD_LETTER_MAX, MESSAGE_FLUSH_TIMEOUT
+)
+
+
+class MessageWriteQueue:
+    """
+    Hàng đợi ghi tin nhắn chạy nền (một thread cho cả process).
+
+    - Mỗi lần flush chèn nhiều tin nhắn bằng một multi-row insert
+    - Cập nhật message_count và updated_at gộp thành một lần cho mỗi session
+    - Thứ tự tin nhắn giữ nguyên (FIFO, một flusher tại một thời điểm)
+    - At-least-once: batch lỗi tạm thời được đưa lại đầu hàng đợi, còn lại được flush khi process tắt
+    - Lỗi vĩnh viễn (vd: vi phạm khóa ngoại) được cô lập bằng cách chia đôi batch; chỉ tin nhắn
+      lỗi bị chuyển vào dead-letter, các tin nhắn còn lại vẫn được ghi
+    - Mỗi tin nhắn được thử tối đa max_attempts lần khi lỗi tạm thời
+    """
+
+    def __init__(self, flush_interval: float = MESSAGE_FLUSH_INTERVAL, batch_size: int = MESSAGE_BATCH_SIZE,
+                 max_attempts: int = MESSAGE_MAX_ATTEMPTS):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.logger = logging.getLogger(__name__)
+        self._pending: Deque[Tuple[Any, Dict]] = deque()
+        # Số lần ghi lỗi tạm thời của mỗi tin nhắn đang chờ (key: id của dict tin nhắn)
+        self._attempts: Dict[int, int] = {}
+        self.dead_letters: Deque[Tuple[Dict, str]] = deque(maxlen=MESSAGE_DEAD_LETTER_MAX)
+        # Callback (message, error) khi tin nhắn bị bỏ, theo tên (đăng ký lại cùng tên thì thay thế)
+        self._dead_letter_listeners: Dict[str, Callable[[Dict, str], None]] = {}
+        self._pending_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._worker = None
+        self._stopped = False
+        # Supabase chưa có RPC touch_chat_session -> dùng RPC/update cũ
+        self._touch_rpc_available = True
+        self.stats = {"enqueued": 0, "flushed": 0, "batches": 0, "failures": 0, "dead_lettered": 0}
+
+    def enqueue(self, supabase_client, message_data: Dict) -> None:
+        """Đưa tin nhắn vào hàng đợi (không chờ database)"""
+        with self._pending_lock:
+            self._pending.append((supabase_client, message_data))
+            self.stats["enqueued"] += 1
+        self._ensure_worker()
+        if self.pending_count() >= self.batch_size:
+            self._wakeup.set()
+
+    def add_dead_letter_listener(self, name: str, callback: Callable[[Dict, str], None]) -> None:
+        """
+        Đăng ký callback được gọi khi một tin nhắn bị chuyển vào dead-letter
+
+        save_message đã trả về True và cập nhật cache trước khi tin nhắn được ghi, nên nơi giữ
+        cache cần biết tin nhắn nào không bao giờ tới database.
+
+        Args:
+            name: Tên listener (đăng ký lại cùng tên thì thay thế)
+            callback: Hàm nhận (message_data, error message), chạy ở thread flush
+        """
+        self._dead_letter_listeners[name] = callback
+
+    def pending_count(self, session_id: str = None) -> int:
+        """Số tin nhắn đang chờ ghi (của một session hoặc tất cả)"""
+        with self._pending_lock:
+            if session_id is None:
+                return len(self._pending)
+            return sum(1 for _, message in self._pending if message.get("session_id") == session_id)
+
+    def flush(self, timeout: float = MESSAGE_FLUSH_TIMEOUT) -> bool:
+        """
+        Ghi toàn bộ tin nhắn đang chờ (chặn tới khi xong hoặc hết timeout)
+
+        Args:
+            timeout: Số giây chờ tối đa (None = MESSAGE_FLUSH_TIMEOUT)
+
+        Returns:
+            True nếu hàng đợi đã trống
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else MESSAGE_FLUSH_TIMEOUT)
+        while self.pending_count():
+            if not self._flush_batch():
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                time.sleep(min(MESSAGE_RETRY_DELAY, remaining))
+            elif time.monotonic() >= deadline:
+                return not self.pending_count()
+        return True
+
+    def shutdown(self) -> None:
+        """Dừng worker và flush phần còn lại (gọi tự động khi process thoát)"""
+        self._stopped = True
+        self._wakeup.set()
+        if not self.flush(timeout=MESSAGE_SHUTDOWN_TIMEOUT):
+            self.logger.error(f"Write-behind queue shutdown with {self.pending_count()} unsaved messages")
+
+    def _ensure_worker(self) -> None:
+        if self._worker is not None and self._worker.is_alive():
+            return
+        with self._pending_lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="message-write-behind", daemon=True)
+                self._worker.start()
+
+    def _run(self) -> None:
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            while self.pending_count() and not self._stopped:
+                if not self._flush_batch():
+                    time.sleep(MESSAGE_RETRY_DELAY)
+                    break
+
+    def _flush_batch(self) -> bool:
+        """
+        Ghi một batch từ đầu hàng đợi
+
+        Returns:
+            False nếu gặp lỗi tạm thời (phần chưa ghi được đưa lại đầu hàng đợi)
+        """
+        with self._flush_lock:
+            with self._pending_lock:
+                batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+            if not batch:
+                return True
+
+            for client, messages in self._group_by_client(batch):
+                written: List[Dict] = []
+                try:
+                    self._insert_messages(client, messages, written)
+                except Exception as e:
+                    self.stats["failures"] += 1
+                    written_ids = {id(message) for message in written}
+                    unwritten = [message for message in messages if id(message) not in written_ids]
+                    self.logger.warning(f"Batch message insert failed, requeueing {len(unwritten)} messages: {e}")
+                    self._record_written(client, written)
+                    # Các nhóm client chưa thử ghi giữ nguyên số lần thử
+                    remaining = [item for item in batch if item[0] is not client]
+                    self._requeue(self._count_attempts(client, unwritten, e) + remaining)
+                    return False
+
+                self._record_written(client, written)
+                # Tin nhắn đã ghi thành công, lỗi cập nhật session không làm mất tin nhắn
+                batch = [item for item in batch if item[0] is not client]
+
+            self.stats["batches"] += 1
+            return True
+
+    def _insert_messages(self, client, messages: List[Dict], written: List[Dict]) -> None:
+        """
+        Multi-row insert; lỗi vĩnh viễn thì chia đôi batch để cô lập tin nhắn lỗi
+
+        Args:
+            client: Supabase client
+            messages: Tin nhắn cần ghi (giữ thứ tự)
+            written: Danh sách nhận các tin nhắn đã ghi thành công
+
+        Raises:
+            Exception: Lỗi tạm thời (tin nhắn chưa ghi được caller đưa lại hàng đợi)
+        """
+        try:
+            client.table("messages").insert(messages).execute()
+            written.extend(messages)
+        except Exception as e:
+            if not is_permanent_error(e):
+                raise
+            if len(messages) == 1:
+                self._dead_letter(messages[0], e)
+                return
+            middle = len(messages) // 2
+            self._insert_messages(client, messages[:middle], written)
+            self._insert_messages(client, messages[middle:], written)
+
+    def _record_written(self, client, written: List[Dict]) -> None:
+        if not written:
+            return
+        for message in written:
+            self._attempts.pop(id(message), None)
+        self.stats["flushed"] += len(written)
+        self._touch_sessions(client, written)
+
+    def _count_attempts(self, client, messages: List[Dict], error: Exception) -> List[Tuple[Any, Dict]]:
+        """Tăng số lần thử của các tin nhắn lỗi tạm thời, tin nhắn quá max_attempts chuyển dead-letter"""
+        retry = []
+        for message in messages:
+            attempts = self._attempts.get(id(message), 0) + 1
+            if attempts >= self.max_attempts:
+                self._dead_letter(message, error)
+            else:
+                self._attempts[id(message)] = attempts
+                retry.append((client, message))
+        return retry
+
+    def _dead_letter(self, message: Dict, error: Exception) -> None:
+        """Bỏ tin nhắn không thể ghi khỏi hàng đợi, giữ lại trong dead_letters để kiểm tra"""
+        self._attempts.pop(id(message), None)
+        self.dead_letters.append((message, str(error)))
+        self.stats["dead_lettered"] += 1
+        self.logger.error(
+            f"Dropping message for session {message.get('session_id')} after write error: {error}"
+        )
+        for name, callback in list(self._dead_letter_listeners.items()):
+            try:
+                callback(message, str(error))
+            except Exception as e:
+                self.logger.warning(f"Dead-letter listener {name} failed: {e}")
+
+    def _requeue(self, batch: List[Tuple[Any, Dict]]) -> None:
+        with self._pending_lock:
+            self._pending.extendleft(reversed(batch))
+
+    @staticmethod
+    def _group_by_client(batch: List[Tuple[Any, Dict]]) -> List[Tuple[Any, List[Dict]]]:
+        """Nhóm tin nhắn theo Supabase client, giữ nguyên thứ tự trong mỗi nhóm"""
+        groups: Dict[int, Tuple[Any, List[Dict]]] = {}
+        for client, message in batch:
+            groups.setdefault(id(client), (client, []))[1].append(message)
+        return list(groups.values())
+
+    def _touch_sessions(self, client, messages: List[Dict]) -> None:
+        """Cập nhật message_count và updated_at một lần cho mỗi session trong batch"""
+        sessions: Dict[str, Dict] = {}
+        for message in messages:
+            session = sessions.setdefault(message["session_id"], {"count": 0, "updated_at": message["created_at"]})
+            session["count"] += 1
+            session["updated_at"] = max(session["updated_at"], message["created_at"])
+
+        for session_id, session in sessions.items():
+            try:
+                if self._touch_rpc_available:
+                    try:
+                        client.rpc("touch_chat_session", {
+                            "session_uuid": session_id,
+                            "message_delta": session["count"],
+                            "touched_at": session["updated_at"]
+                        }).execute()
+                        continue
+                    except Exception as e:
+                        # Lỗi tạm thời không tắt RPC (fallback có thể cộng trùng nếu RPC đã chạy)
+                        if not is_missing_object_error(e):
+                            raise
+                        self._touch_rpc_available = False
+                        self.logger.warning(f"RPC touch_chat_session unavailable, falling back: {e}")
+
+                for _ in range(session["count"]):
+                    client.rpc("increment_message_count", {"session_uuid": session_id}).execute()
+                client.table("chat_sessions").update({
+                    "updated_at": session["updated_at"]
+                }).eq("id", session_id).execute()
+            except Exception as e:
+                self.logger.error(f"Session update failed for {session_id}: {e}")
+
+
+def get_message_queue() -> MessageWriteQueue:
+    """Lấy write-behind queue dùng chung của process"""
+    def _create_queue():
+        queue = MessageWriteQueue()
+        atexit.register(queue.shutdown)
+        return queue
+
+    return get_resource("message_write_queue", _create_queue)
@@ -0,0 +1,224 @@
+"""
+Cache ảnh trang PDF đã render: tầng bộ nhớ (giới hạn theo byte), tầng đĩa (tùy chọn) và thumbnail
+"""
+import os
+import threading
+from io import BytesIO
+from typing import TYPE_CHECKING, Callable, Dict, Hashable, Optional, Tuple
+
+from .cache import LRUCache
+from ..config.constants import (
+    PAGE_IMAGE_DPI_BUCKETS, PAGE_IMAGE_CACHE_MAX_BYTES, PAGE_IMAGE_CACHE_DIR, FEATURES,
+    PAGE_IMAGE_FORMATS, PAGE_IMAGE_ENCODED_CACHE_MAX_BYTES
+)
+
+if TYPE_CHECKING:
+    from PIL import Image
+
+THUMBNAIL_BUCKET = "thumb"
+
+
+def dpi_bucket(dpi: int) -> int:
+    """Làm tròn DPI lên bucket gần nhất để các mức zoom gần nhau dùng chung một ảnh"""
+    for bucket in PAGE_IMAGE_DPI_BUCKETS:
+        if dpi <= bucket:
+            return bucket
+    return PAGE_IMAGE_DPI_BUCKETS[-1]
+
+
+def image_nbytes(image: "Image.Image") -> int:
+    """Dung lượng ảnh đã giải nén (width x height x số kênh)"""
+    return image.width * image.height * len(image.getbands())
+
+
+def pixmap_to_image(pixmap) -> "Image.Image":
+    """
+    PIL Image dựng thẳng từ sample buffer của fitz.Pixmap (không qua định dạng file trung gian)
+
+    Args:
+        pixmap: fitz.Pixmap (1 kênh xám, RGB hoặc RGBA)
+
+    Returns:
+        PIL Image sở hữu dữ liệu của nó (pixmap có thể được giải phóng ngay sau đó)
+    """
+    from PIL import Image
+
+    mode = {1: "L", 3: "RGB", 4: "RGBA"}[pixmap.n]
+    return Image.frombuffer(mode, (pixmap.width, pixmap.height), pixmap.samples, "raw", mode, pixmap.stride, 1)
+
+
+def encode_image(image: "Image.Image", image_format: str, quality: int) -> bytes:
+    """
+    Nén ảnh để gửi xuống trình duyệt
+
+    Args:
+        image: PIL Image
+        image_format: Một trong PAGE_IMAGE_FORMATS
+        quality: Chất lượng nén JPEG/WebP (1-100)
+
+    Returns:
+        Nội dung file ảnh đã nén
+    """
+    image_format = image_format.upper()
+    if image_format not in PAGE_IMAGE_FORMATS:
+        raise ValueError(f"Định dạng ảnh không hỗ trợ: {image_format}")
+    if image_format == "JPEG" and image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+
+    buffer = BytesIO()
+    if image_format == "PNG":
+        image.save(buffer, format=image_format)
+    else:
+        image.save(buffer, format=image_format, quality=quality)
+    return buffer.getvalue()
+
+
+class PageImageCache:
+    """
+    Cache ảnh trang PDF dùng chung của process, key (doc_hash, page_number, dpi_bucket).
+
+    - Tầng bộ nhớ: LRU giới hạn theo tổng số byte của ảnh
+    - Tầng đĩa (tùy chọn): PNG theo key, sống qua các lần restart
+    - Mỗi key chỉ được render một lần kể cả khi nhiều thread cùng yêu cầu
+    - Bản đã nén (JPEG/WebP) gửi xuống trình duyệt được cache riêng, giới hạn theo byte
+    """
+
+    def __init__(self, max_bytes: int = PAGE_IMAGE_CACHE_MAX_BYTES, disk_dir: Optional[str] = None,
+                 encoded_max_bytes: int = PAGE_IMAGE_ENCODED_CACHE_MAX_BYTES):
+        self._memory = LRUCache(max_items=100000, max_size=max_bytes, sizeof=image_nbytes)
+        self._encoded = LRUCache(max_items=100000, max_size=encoded_max_bytes, sizeof=len)
+        self.disk_dir = disk_dir
+        self._lock = threading.Lock()
+        self._in_flight: Dict[Hashable, threading.Event] = {}
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "renders": 0, "encodes": 0}
+
+    def get(self, key: Tuple[str, int, object]) -> Optional["Image.Image"]:
+        """Lấy ảnh từ bộ nhớ, rồi từ đĩa (ảnh từ đĩa được đưa lại vào bộ nhớ)"""
+        image = self._memory.get(key)
+        if image is not None:
+            self.stats["memory_hits"] += 1
+            return image
+
+        image = self._load_from_disk(key)
+        if image is not None:
+            self.stats["disk_hits"] += 1
+            self._memory.put(key, image)
+        return image
+
+    def put(self, key: Tuple[str, int, object], image: "Image.Image") -> None:
+        self._memory.put(key, image)
+        self._save_to_disk(key, image)
+
+    def get_or_render(self, key: Tuple[str, int, object], render: Callable[[], Optional["Image.Image"]]) -> Optional["Image.Image"]:
+        """
+        Lấy ảnh đã cache hoặc render (một lần cho mỗi key)
+
+        Args:
+            key: (doc_hash, page_number, dpi_bucket hoặc THUMBNAIL_BUCKET)
+            render: Hàm render ảnh khi chưa có trong cache
+
+        Returns:
+            PIL Image (dùng chung, không được sửa tại chỗ) hoặc None nếu render lỗi
+        """
+        image = self.get(key)
+        if image is not None:
+            return image
+
+        with self._lock:
+            # Thread khác có thể vừa render xong giữa lần get() ở trên và lúc lấy lock
+            image = self._memory.get(key)
+            if image is not None:
+                return image
+            event = self._in_flight.get(key)
+            owner = event is None
+            if owner:
+                event = self._in_flight[key] = threading.Event()
+
+        if not owner:
+            # Thread khác đang render key này: chờ rồi đọc lại từ cache
+            event.wait()
+            return self.get(key)
+
+        try:
+            image = render()
+            if image is not None:
+                self.stats["renders"] += 1
+                self.put(key, image)
+            return image
+        finally:
+            with self._lock:
+                self._in_flight.pop(key, None)
+            event.set()
+
+    def get_or_encode(self, key: Tuple[str, int, object], image_format: str, quality: int,
+                      load_image: Callable[[], Optional["Image.Image"]]) -> Optional[bytes]:
+        """
+        Lấy bản nén của ảnh trang, nén từ load_image() nếu chưa có
+
+        Args:
+            key: (doc_hash, page_number, dpi_bucket)
+            image_format: Một trong PAGE_IMAGE_FORMATS
+            quality: Chất lượng nén JPEG/WebP
+            load_image: Hàm lấy PIL Image (thường qua get_or_render)
+
+        Returns:
+            Nội dung file ảnh hoặc None nếu không lấy được ảnh
+        """
+        encoded_key = (key, image_format.upper(), quality)
+        data = self._encoded.get(encoded_key)
+        if data is not None:
+            return data
+
+        image = load_image()
+        if image is None:
+            return None
+        data = encode_image(image, image_format, quality)
+        self.stats["encodes"] += 1
+        self._encoded.put(encoded_key, data)
+        return data
+
+    def __contains__(self, key) -> bool:
+        path = self._disk_path(key)
+        return key in self._memory or (path is not None and os.path.exists(path))
+
+    def _disk_path(self, key: Tuple[str, int, object]) -> Optional[str]:
+        if not self.disk_dir:
+            return None
+        doc_hash, page_number, bucket = key
+        return os.path.join(self.disk_dir, f"{doc_hash}_{page_number}_{bucket}.png")
+
+    def _load_from_disk(self, key) -> Optional["Image.Image"]:
+        path = self._disk_path(key)
+        if path is None or not os.path.exists(path):
+            return None
+        try:
+            from PIL import Image
+
+            with Image.open(path) as image:
+                image.load()
+                return image.copy()
+        except Exception:
+            return None
+
+    def _save_to_disk(self, key, image: "Image.Image") -> None:
+        path = self._disk_path(key)
+        if path is None:
+            return
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            temp_path = f"{path}.{threading.get_ident()}.tmp"
+            image.save(temp_path, format="PNG")
+            os.replace(temp_path, path)
+        except Exception:
+            pass
+
+
+_page_image_cache = PageImageCache(
+    disk_dir=os.getenv("PAGE_IMAGE_CACHE_DIR", PAGE_IMAGE_CACHE_DIR)
+    if FEATURES.get('enable_page_image_disk_cache', False) else None
+)
+
+
+def get_page_image_cache() -> PageImageCache:
+    """Lấy cache ảnh trang dùng chung của process"""
+    return _page_image_cache
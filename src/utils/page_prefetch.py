@@ -0,0 +1,158 @@
+"""
+Prefetch nền ảnh các trang PDF kế bên trang đang xem
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, List, Optional
+
+from .cache import TTLCache
+from ..config.constants import (
+    PAGE_PREFETCH_WORKERS, PAGE_PREFETCH_MAX_IN_FLIGHT, PAGE_PREFETCH_RADIUS,
+    PAGE_PREFETCH_MAX_SESSIONS, PAGE_PREFETCH_SESSION_TTL
+)
+
+
+def neighbour_pages(pages: List[int], current_page: int, radius: int = PAGE_PREFETCH_RADIUS) -> List[int]:
+    """
+    Các trang đã chọn kế bên trang hiện tại, gần nhất trước (trang sau trước trang trước)
+
+    Args:
+        pages: Danh sách trang đã chọn theo thứ tự điều hướng
+        current_page: Trang đang xem
+        radius: Số trang mỗi phía
+
+    Returns:
+        Danh sách số trang cần prefetch
+    """
+    if current_page not in pages:
+        return []
+    index = pages.index(current_page)
+    neighbours = []
+    for distance in range(1, radius + 1):
+        if index + distance < len(pages):
+            neighbours.append(pages[index + distance])
+        if index - distance >= 0:
+            neighbours.append(pages[index - distance])
+    return neighbours
+
+
+class _PrefetchSession:
+    """Trạng thái prefetch của một session: selection hiện tại và các task chưa xong"""
+
+    def __init__(self):
+        self.selection: Optional[Hashable] = None
+        self.generation = 0
+        self.futures: Dict[int, Future] = {}
+
+
+class PagePrefetcher:
+    """
+    Thread pool dùng chung của process render trước các trang kế bên trang đang xem.
+
+    - Mỗi session có tối đa max_in_flight task đang chờ/đang chạy
+    - Khi selection của session đổi (tài liệu, danh sách trang, DPI), task cũ chưa chạy bị hủy
+      và task cũ chưa bắt đầu sẽ bỏ qua khi tới lượt
+    - Trạng thái session nằm trong TTLCache: session đóng tab (không gọi cancel) tự hết hạn,
+      số session giữ lại bị giới hạn; task của session đã bị loại sẽ bỏ qua khi tới lượt
+    """
+
+    def __init__(self, max_workers: int = PAGE_PREFETCH_WORKERS,
+                 max_in_flight: int = PAGE_PREFETCH_MAX_IN_FLIGHT,
+                 max_sessions: int = PAGE_PREFETCH_MAX_SESSIONS,
+                 session_ttl: float = PAGE_PREFETCH_SESSION_TTL):
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._sessions = TTLCache(max_items=max_sessions, ttl=session_ttl)
+        self._lock = threading.Lock()
+
+    def prefetch(self, session_id: str, selection: Hashable, current_page: int, pages: List[int],
+                 task: Callable[[int], object]) -> Dict[int, Future]:
+        """
+        Lên lịch prefetch các trang kế bên current_page
+
+        Args:
+            session_id: ID của session người dùng (giới hạn in-flight tính theo session)
+            selection: Key của selection hiện tại; khác lần gọi trước thì hủy prefetch cũ
+            current_page: Trang đang xem
+            pages: Danh sách trang đã chọn
+            task: Hàm prefetch một trang, chạy ở background thread (không được gọi st.*)
+
+        Returns:
+            Dict số trang -> Future của các task vừa được lên lịch
+        """
+        scheduled = {}
+        with self._lock:
+            session = self._sessions.get(session_id) or _PrefetchSession()
+            # put lại mỗi lần xem trang để gia hạn TTL của session
+            self._sessions.put(session_id, session)
+            if session.selection != selection:
+                self._cancel_locked(session)
+                session.selection = selection
+
+            session.futures = {page: future for page, future in session.futures.items() if not future.done()}
+            for page_number in neighbour_pages(pages, current_page):
+                if page_number in session.futures:
+                    continue
+                if len(session.futures) >= self.max_in_flight:
+                    break
+                future = self._get_executor().submit(
+                    self._run, session_id, session.generation, page_number, task
+                )
+                session.futures[page_number] = future
+                scheduled[page_number] = future
+        return scheduled
+
+    def cancel(self, session_id: str) -> None:
+        """Hủy mọi prefetch của session (vd: bỏ chọn trang hoặc đổi tài liệu)"""
+        with self._lock:
+            session = self._sessions.peek(session_id)
+            self._sessions.invalidate(session_id)
+            if session is not None:
+                self._cancel_locked(session)
+
+    def in_flight(self, session_id: str) -> int:
+        """Số task prefetch chưa xong của session"""
+        with self._lock:
+            session = self._sessions.peek(session_id)
+            if session is None:
+                return 0
+            return sum(1 for future in session.futures.values() if not future.done())
+
+    def _cancel_locked(self, session: _PrefetchSession) -> None:
+        # Task đang chạy không dừng được giữa chừng (render fitz), task chưa chạy thì hủy luôn
+        session.generation += 1
+        for future in session.futures.values():
+            future.cancel()
+        session.futures = {}
+
+    def _is_current(self, session_id: str, generation: int) -> bool:
+        with self._lock:
+            session = self._sessions.peek(session_id)
+            return session is not None and session.generation == generation
+
+    def _run(self, session_id: str, generation: int, page_number: int, task: Callable[[int], object]):
+        if not self._is_current(session_id, generation):
+            return None
+        try:
+            return task(page_number)
+        except Exception:
+            # Prefetch chỉ là tối ưu: lỗi sẽ được báo lại khi người dùng thực sự mở trang
+            return None
+
+    def active_sessions(self) -> int:
+        """Số session đang giữ trạng thái prefetch (kể cả entry hết hạn chưa bị dọn)"""
+        return len(self._sessions)
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="page-prefetch")
+        return self._executor
+
+
+_page_prefetcher = PagePrefetcher()
+
+
+def get_page_prefetcher() -> PagePrefetcher:
+    """Lấy prefetcher dùng chung của process"""
+    return _page_prefetcher
@@ -0,0 +1,95 @@
+"""
+Page store cho nội dung từng trang PDF, key theo SHA-256 của tài liệu
+"""
+from typing import Dict, List, Optional
+
+from .cache import LRUCache
+from ..config.constants import PAGE_STORE_MAX_DOCUMENTS
+
+
+class PDFPageStore:
+    """
+    Lưu nội dung OCR/text của từng trang theo content hash của tài liệu.
+
+    Store được dùng chung trong process nên tồn tại qua các lần rerun và giữa
+    nhiều tài liệu đang mở; mỗi tài liệu chỉ cần OCR một lần.
+
+    Tài liệu có trang OCR lỗi được lưu kèm danh sách trang còn thiếu: các trang đã có
+    vẫn đọc được, nhưng has_document() trả về False để lần sau chỉ OCR lại các trang thiếu.
+    """
+
+    def __init__(self, max_documents: int = PAGE_STORE_MAX_DOCUMENTS):
+        self._documents = LRUCache(max_items=max_documents)
+
+    def has_document(self, doc_hash: str) -> bool:
+        """Kiểm tra tài liệu đã có đầy đủ trong store chưa (không còn trang OCR lỗi)"""
+        if not doc_hash:
+            return False
+        entry = self._documents.get(doc_hash)
+        return entry is not None and not entry["missing_pages"]
+
+    def put_document(self, doc_hash: str, pages: Dict[int, str], page_count: int,
+                     missing_pages: Optional[List[int]] = None) -> None:
+        """
+        Lưu toàn bộ trang của một tài liệu
+
+        Args:
+            doc_hash: SHA-256 của file
+            pages: Dict số trang (từ 1) -> nội dung
+            page_count: Tổng số trang của PDF
+            missing_pages: Các trang OCR lỗi, cần xử lý lại ở lần sau
+        """
+        if not doc_hash:
+            return
+        self._documents.put(doc_hash, {
+            "pages": dict(pages),
+            "page_count": page_count,
+            "missing_pages": sorted(missing_pages or [])
+        })
+
+    def get_missing_pages(self, doc_hash: str) -> List[int]:
+        """Các trang OCR lỗi của tài liệu (rỗng nếu tài liệu đầy đủ hoặc chưa có)"""
+        entry = self._documents.get(doc_hash)
+        return list(entry["missing_pages"]) if entry else []
+
+    def get_page(self, doc_hash: str, page_number: int) -> Optional[str]:
+        """Lấy nội dung một trang, None nếu trang trống hoặc chưa có"""
+        entry = self._documents.get(doc_hash)
+        if not entry:
+            return None
+        return entry["pages"].get(page_number)
+
+    def get_pages(self, doc_hash: str) -> Dict[int, str]:
+        """Lấy tất cả các trang (theo thứ tự trang)"""
+        entry = self._documents.get(doc_hash)
+        if not entry:
+            return {}
+        return dict(sorted(entry["pages"].items()))
+
+    def get_pages_range(self, doc_hash: str, start_page: int, end_page: int) -> Dict[int, str]:
+        """Lấy các trang trong khoảng [start_page, end_page]"""
+        entry = self._documents.get(doc_hash)
+        if not entry:
+            return {}
+        pages = entry["pages"]
+        return {
+            page_num: pages[page_num]
+            for page_num in range(start_page, end_page + 1)
+            if page_num in pages
+        }
+
+    def get_page_count(self, doc_hash: str) -> int:
+        """Lấy số trang đã lưu, 0 nếu chưa có"""
+        entry = self._documents.get(doc_hash)
+        return entry["page_count"] if entry else 0
+
+    def remove_document(self, doc_hash: str) -> None:
+        self._documents.pop(doc_hash)
+
+
+_page_store = PDFPageStore()
+
+
+def get_page_store() -> PDFPageStore:
+    """Lấy page store dùng chung của process"""
+    return _page_store
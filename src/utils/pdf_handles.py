@@ -0,0 +1,101 @@
+"""
+Cache các fitz.Document đã mở, key theo SHA-256 của PDF (mở một lần, dùng cho mọi lần render)
+"""
+import threading
+from contextlib import contextmanager
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from .cache import LRUCache
+from ..config.constants import PDF_HANDLE_CACHE_SIZE
+
+
+class PDFHandle:
+    """
+    Một fitz.Document đang mở kèm metadata tính sẵn.
+
+    fitz.Document không an toàn khi dùng đồng thời từ nhiều thread, nên mọi thao tác
+    trên document phải giữ `lock`; số trang và kích thước trang đọc không cần lock.
+    """
+
+    def __init__(self, pdf_bytes: bytes):
+        import fitz  # PyMuPDF, chỉ import khi mở PDF đầu tiên
+
+        self.document = fitz.open(stream=pdf_bytes, filetype="pdf")
+        self.lock = threading.RLock()
+        self.closed = False
+        self.page_count = self.document.page_count
+        self.page_sizes: List[Tuple[float, float]] = [
+            (page.rect.width, page.rect.height) for page in self.document
+        ]
+
+    def page_size(self, page_number: int) -> Optional[Tuple[float, float]]:
+        """Kích thước (width, height) theo point của trang (bắt đầu từ 1), None nếu không tồn tại"""
+        if page_number < 1 or page_number > self.page_count:
+            return None
+        return self.page_sizes[page_number - 1]
+
+    def close(self) -> None:
+        """Đóng document (chờ thao tác đang chạy trên document kết thúc)"""
+        with self.lock:
+            if not self.closed:
+                self.closed = True
+                self.document.close()
+
+
+class PDFHandleCache:
+    """LRU cache các PDFHandle dùng chung của process, handle bị loại bỏ sẽ được đóng"""
+
+    def __init__(self, max_documents: int = PDF_HANDLE_CACHE_SIZE):
+        self._handles = LRUCache(max_items=max_documents, on_evict=lambda key, handle: self._evicted.append(handle))
+        self._evicted: List[PDFHandle] = []
+        self._lock = threading.Lock()
+
+    def get(self, doc_hash: str, load_bytes: Callable[[], bytes]) -> PDFHandle:
+        """
+        Lấy handle của PDF, mở từ load_bytes() nếu chưa có
+
+        Args:
+            doc_hash: SHA-256 của file PDF
+            load_bytes: Hàm trả về nội dung file (chỉ gọi khi cần mở)
+
+        Returns:
+            PDFHandle đang mở
+        """
+        with self._lock:
+            handle = self._handles.get(doc_hash)
+            if handle is None or handle.closed:
+                handle = PDFHandle(load_bytes())
+                self._handles.put(doc_hash, handle)
+            evicted, self._evicted = self._evicted, []
+
+        # Đóng ngoài lock của cache: close() chờ thread đang render trên handle đó
+        for old_handle in evicted:
+            old_handle.close()
+        return handle
+
+    @contextmanager
+    def open_document(self, doc_hash: str, load_bytes: Callable[[], bytes]) -> Iterator[PDFHandle]:
+        """Giữ lock của handle trong khối with (handle bị đóng giữa chừng thì mở lại)"""
+        while True:
+            handle = self.get(doc_hash, load_bytes)
+            with handle.lock:
+                if handle.closed:
+                    continue
+                yield handle
+                return
+
+    def remove(self, doc_hash: str) -> None:
+        handle = self._handles.pop(doc_hash)
+        if handle is not None:
+            handle.close()
+
+    def __contains__(self, doc_hash: str) -> bool:
+        return doc_hash in self._handles
+
+
+_handle_cache = PDFHandleCache()
+
+
+def get_pdf_handle_cache() -> PDFHandleCache:
+    """Lấy cache fitz.Document dùng chung của process"""
+    return _handle_cache
@@ -0,0 +1,89 @@
+"""
+Resource registry dùng chung của process: client LLM/OCR và connection pool HTTP.
+
+Mỗi browser session chỉ giữ state riêng của user; các client (và connection pool
+keep-alive của chúng) được tạo một lần cho cả process và dùng chung an toàn giữa
+các thread của Streamlit.
+
+Các SDK (httpx, openai, mistralai) chỉ được import khi tạo client lần đầu, để trang
+login không phải trả thời gian import chúng lúc khởi động.
+"""
+import threading
+from typing import TYPE_CHECKING, Any, Callable, Dict, Hashable, Optional
+
+if TYPE_CHECKING:
+    import httpx
+    import openai
+    from mistralai import Mistral
+
+from ..config.constants import (
+    HTTP_MAX_CONNECTIONS, HTTP_MAX_KEEPALIVE_CONNECTIONS, HTTP_KEEPALIVE_EXPIRY,
+    HTTP_CONNECT_TIMEOUT, LLM_REQUEST_TIMEOUT, OCR_REQUEST_TIMEOUT
+)
+
+_resources: Dict[Hashable, Any] = {}
+_lock = threading.Lock()
+
+
+def get_resource(key: Hashable, factory: Callable[[], Any]) -> Any:
+    """
+    Lấy resource dùng chung theo key, tạo bằng factory ở lần gọi đầu tiên
+
+    Args:
+        key: Key định danh resource
+        factory: Hàm tạo resource (chỉ được gọi một lần cho mỗi key)
+
+    Returns:
+        Instance dùng chung của process
+    """
+    resource = _resources.get(key)
+    if resource is not None:
+        return resource
+
+    with _lock:
+        resource = _resources.get(key)
+        if resource is None:
+            resource = factory()
+            _resources[key] = resource
+        return resource
+
+
+def _create_http_client(timeout: float) -> "httpx.Client":
+    """httpx client với connection pool keep-alive (httpx.Client an toàn khi dùng từ nhiều thread)"""
+    import httpx
+
+    return httpx.Client(
+        timeout=httpx.Timeout(timeout, connect=HTTP_CONNECT_TIMEOUT),
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY
+        )
+    )
+
+
+def get_llm_client(base_url: str) -> "openai.OpenAI":
+    """Lấy OpenAI client dùng chung cho Local LLM (LM Studio) tại base_url"""
+    def _create_llm_client():
+        import openai
+
+        return openai.OpenAI(
+            base_url=base_url,
+            api_key="not_needed",
+            http_client=_create_http_client(LLM_REQUEST_TIMEOUT)
+        )
+
+    return get_resource(("llm", base_url), _create_llm_client)
+
+
+def get_mistral_client(api_key: str) -> Optional["Mistral"]:
+    """Lấy Mistral client dùng chung (OCR + chat), None nếu chưa cấu hình API key"""
+    if not api_key:
+        return None
+
+    def _create_mistral_client():
+        from mistralai import Mistral
+
+        return Mistral(api_key=api_key, client=_create_http_client(OCR_REQUEST_TIMEOUT))
+
+    return get_resource(("mistral", api_key), _create_mistral_client)
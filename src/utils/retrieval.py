@@ -0,0 +1,216 @@
+"""
+Retrieval cho RAG: inverted index BM25 và vector index được build một lần cho mỗi tài liệu
+"""
+import math
+import re
+import heapq
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .cache import LRUCache
+from .tokens import estimate_tokens
+from ..config.constants import RETRIEVAL_INDEX_MAX_DOCUMENTS, BM25_K1, BM25_B, RRF_K
+
+# Stop words tiếng Việt + tiếng Anh (giống DocumentProcessor._extract_keywords)
+STOP_WORDS = {
+    'là', 'gì', 'của', 'có', 'được', 'này', 'đó', 'và', 'với', 'cho', 'từ', 'trong', 'một',
+    'các', 'những', 'khi', 'nào', 'ai', 'ở', 'đâu', 'sao', 'như', 'thế',
+    'what', 'is', 'are', 'the', 'of', 'and', 'or', 'in', 'on', 'at', 'to', 'for', 'with', 'by'
+}
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Tách text thành các token (lowercase, bỏ stop words và token 1 ký tự)"""
+    if not text:
+        return []
+    return [
+        token for token in _TOKEN_PATTERN.findall(text.lower())
+        if len(token) > 1 and token not in STOP_WORDS
+    ]
+
+
+class BM25Index:
+    """
+    Inverted index BM25 trên danh sách chunk của một tài liệu.
+
+    Postings và IDF được tính sẵn khi build, nên mỗi truy vấn chỉ duyệt
+    postings của các từ khóa trong câu hỏi thay vì quét lại toàn bộ tài liệu.
+    """
+
+    def __init__(self, chunks: List[str], k1: float = BM25_K1, b: float = BM25_B):
+        self.chunks = chunks
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.doc_freqs: Dict[str, int] = {}
+        self.idf: Dict[str, float] = {}
+        self.chunk_lengths: List[int] = []
+        self.token_counts: List[int] = []
+        self.avg_chunk_length = 0.0
+        self.avg_token_count = 0.0
+        self._build()
+
+    def _build(self):
+        for chunk_id, chunk in enumerate(self.chunks):
+            term_counts = Counter(tokenize(chunk))
+            self.chunk_lengths.append(sum(term_counts.values()))
+            self.token_counts.append(estimate_tokens(chunk))
+            for term, term_frequency in term_counts.items():
+                self.postings.setdefault(term, []).append((chunk_id, term_frequency))
+
+        total_chunks = len(self.chunks)
+        self.avg_chunk_length = (sum(self.chunk_lengths) / total_chunks) if total_chunks else 0.0
+        self.avg_token_count = (sum(self.token_counts) / total_chunks) if total_chunks else 0.0
+
+        for term, postings in self.postings.items():
+            doc_freq = len(postings)
+            self.doc_freqs[term] = doc_freq
+            self.idf[term] = math.log(1 + (total_chunks - doc_freq + 0.5) / (doc_freq + 0.5))
+
+        # Chuẩn hóa độ dài chunk một lần cho công thức BM25
+        avg_length = self.avg_chunk_length or 1.0
+        self._length_norms = [
+            self.k1 * (1 - self.b + self.b * length / avg_length)
+            for length in self.chunk_lengths
+        ]
+
+    def search(self, query: str, top_k: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Tìm các chunk liên quan nhất với câu truy vấn
+
+        Args:
+            query: Câu hỏi / truy vấn
+            top_k: Số kết quả tối đa (None = tất cả chunk có điểm > 0)
+
+        Returns:
+            List (chunk_id, score) sắp xếp theo điểm giảm dần
+        """
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = self.idf[term]
+            for chunk_id, term_frequency in postings:
+                score = idf * term_frequency * (self.k1 + 1) / (term_frequency + self._length_norms[chunk_id])
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + score
+
+        if top_k is None:
+            return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+
+class VectorIndex:
+    """
+    Vector index trên embeddings của các chunk, lưu trong một ma trận float32 liên tục.
+
+    Các vector được chuẩn hóa khi build nên cosine similarity của một truy vấn
+    với toàn bộ chunk chỉ là một phép nhân ma trận-vector.
+    """
+
+    def __init__(self, vectors):
+        matrix = np.ascontiguousarray(vectors, dtype=np.float32)
+        if matrix.ndim != 2:
+            raise ValueError("Embeddings phải là ma trận 2 chiều (số chunk x số chiều)")
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        self.vectors = np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+    def search(self, query_vector, top_k: int = 5) -> List[Tuple[int, float]]:
+        """
+        Tìm các chunk gần nhất với vector truy vấn
+
+        Args:
+            query_vector: Embedding của câu hỏi
+            top_k: Số kết quả tối đa
+
+        Returns:
+            List (chunk_id, cosine similarity) sắp xếp theo điểm giảm dần
+        """
+        query = np.asarray(query_vector, dtype=np.float32).ravel()
+        norm = np.linalg.norm(query)
+        if norm == 0 or query.shape[0] != self.dimensions:
+            return []
+
+        scores = self.vectors @ (query / norm)
+        k = min(top_k, scores.shape[0])
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(int(chunk_id), float(scores[chunk_id])) for chunk_id in top]
+
+    @property
+    def dimensions(self) -> int:
+        return self.vectors.shape[1]
+
+    def save(self, path: str) -> None:
+        """Lưu ma trận vector ra file .npy"""
+        np.save(path, self.vectors)
+
+    @classmethod
+    def load(cls, path: str) -> "VectorIndex":
+        """Đọc ma trận vector từ file .npy"""
+        return cls(np.load(path))
+
+    def __len__(self) -> int:
+        return self.vectors.shape[0]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Tuple[int, float]]], k: int = RRF_K) -> List[Tuple[int, float]]:
+    """
+    Gộp nhiều bảng xếp hạng chunk bằng reciprocal-rank fusion
+
+    Chỉ dùng thứ hạng (không dùng điểm gốc) nên điểm BM25 và cosine similarity
+    không cần chuẩn hóa về cùng thang đo.
+
+    Args:
+        rankings: Các list (chunk_id, score) đã sắp xếp theo điểm giảm dần
+        k: Hằng số làm mượt của RRF
+
+    Returns:
+        List (chunk_id, fused score) sắp xếp theo điểm giảm dần
+    """
+    fused: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, (chunk_id, _) in enumerate(ranking, start=1):
+            fused[chunk_id] = fused.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
+
+
+class RetrievalIndexRegistry:
+    """Registry dùng chung của process: text tài liệu -> index đã build"""
+
+    def __init__(self, max_documents: int = RETRIEVAL_INDEX_MAX_DOCUMENTS):
+        self._indexes = LRUCache(max_items=max_documents)
+
+    def get(self, text: str) -> Optional[Any]:
+        # hash() của str được Python cache trên object nên lookup lặp lại là O(1)
+        entry = self._indexes.get(hash(text))
+        if entry and entry[0] == text:
+            return entry[1]
+        return None
+
+    def put(self, text: str, index: Any) -> None:
+        self._indexes.put(hash(text), (text, index))
+
+
+_index_registry = RetrievalIndexRegistry()
+_vector_registry = RetrievalIndexRegistry()
+
+
+def get_index_registry() -> RetrievalIndexRegistry:
+    """Lấy registry index BM25 dùng chung của process"""
+    return _index_registry
+
+
+def get_vector_registry() -> RetrievalIndexRegistry:
+    """Lấy registry vector index dùng chung của process"""
+    return _vector_registry
@@ -0,0 +1,483 @@
+"""
+Storage backend cho ChatPersistence.
+
+ChatPersistence và write-behind queue chỉ dùng một phần nhỏ API của Supabase client:
+``table(name)`` với select/insert/update/delete, các filter eq/lt/in_/or_, order/limit,
+``execute()`` trả về object có ``.data`` / ``.count``, và ``rpc(name, params)``.
+Mọi backend implement đúng interface đó, nên code persistence (cache, batch, phân trang)
+chạy giống hệt nhau trên Supabase và trên SQLite local.
+
+- ``supabase``: Supabase client (mặc định)
+- ``sqlite``: file SQLite (WAL mode) trên máy, dùng cho triển khai một node và load test
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+from .resources import get_resource
+from ..config.constants import STORAGE_BACKENDS, SQLITE_DB_PATH, SQLITE_BUSY_TIMEOUT
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS "user" (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE,
+    email TEXT UNIQUE,
+    password_hash TEXT,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE TABLE IF NOT EXISTS chat_sessions (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    preview TEXT,
+    message_count INTEGER DEFAULT 0,
+    session_metadata TEXT,
+    is_active INTEGER DEFAULT 1,
+    created_at TEXT,
+    updated_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL REFERENCES chat_sessions (id) ON DELETE CASCADE,
+    user_id TEXT,
+    role TEXT NOT NULL,
+    content TEXT,
+    message_metadata TEXT,
+    is_processed INTEGER DEFAULT 0,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS session_documents (
+    id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    user_id TEXT,
+    file_name TEXT,
+    file_type TEXT,
+    file_size INTEGER,
+    content TEXT,
+    summary TEXT,
+    questions TEXT,
+    page_count INTEGER,
+    created_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS document_pages (
+    id TEXT PRIMARY KEY,
+    document_id TEXT NOT NULL REFERENCES session_documents (id) ON DELETE CASCADE,
+    page_number INTEGER NOT NULL,
+    content TEXT,
+    created_at TEXT
+);
+
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_user_updated ON chat_sessions (user_id, updated_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_chat_sessions_updated ON chat_sessions (updated_at);
+CREATE INDEX IF NOT EXISTS idx_messages_session_created ON messages (session_id, created_at DESC, id DESC);
+CREATE INDEX IF NOT EXISTS idx_session_documents_session ON session_documents (session_id, created_at);
+CREATE INDEX IF NOT EXISTS idx_document_pages_document_page ON document_pages (document_id, page_number);
+
+CREATE TRIGGER IF NOT EXISTS trg_set_chat_session_preview
+AFTER INSERT ON messages
+WHEN NEW.role = 'user'
+BEGIN
+    UPDATE chat_sessions SET preview = substr(NEW.content, 1, 100)
+    WHERE id = NEW.session_id AND preview IS NULL;
+END;
+
+CREATE VIEW IF NOT EXISTS user_chat_stats AS
+SELECT
+    s.user_id,
+    COUNT(DISTINCT s.id) AS session_count,
+    COUNT(m.id) AS message_count,
+    SUM(CASE WHEN m.role = 'user' THEN 1 ELSE 0 END) AS user_messages,
+    SUM(CASE WHEN m.role = 'assistant' THEN 1 ELSE 0 END) AS ai_messages,
+    MAX(s.updated_at) AS last_activity,
+    CURRENT_TIMESTAMP AS refreshed_at
+FROM chat_sessions s
+LEFT JOIN messages m ON m.session_id = s.id
+GROUP BY s.user_id;
+"""
+
+# Bảng có khóa chính UUID (tạo ở client nếu payload chưa có id)
+_UUID_TABLES = {"chat_sessions", "messages", "session_documents", "document_pages"}
+_IDENTIFIER = re.compile(r'^\w+$')
+_OPERATORS = {"eq": "=", "neq": "!=", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+
+
+class StorageResult:
+    """Kết quả của một query (giống APIResponse của Supabase: .data và .count)"""
+
+    def __init__(self, data: Any, count: Optional[int] = None):
+        self.data = data
+        self.count = count
+
+
+class SQLiteBackend:
+    """
+    Backend SQLite cho ChatPersistence, cùng interface query với Supabase client.
+
+    Một connection dùng chung (WAL mode, một writer tại một thời điểm) được bảo vệ
+    bằng lock, nên an toàn khi dùng từ các thread của Streamlit và write-behind queue.
+    """
+
+    def __init__(self, path: str = SQLITE_DB_PATH):
+        self.path = path
+        self._lock = threading.RLock()
+        directory = os.path.dirname(path)
+        if directory and path != ":memory:":
+            os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, check_same_thread=False, timeout=SQLITE_BUSY_TIMEOUT)
+        self._connection.row_factory = sqlite3.Row
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("PRAGMA foreign_keys=ON")
+            self._connection.executescript(_SCHEMA)
+
+    def table(self, name: str) -> "SQLiteQuery":
+        return SQLiteQuery(self, name)
+
+    def rpc(self, name: str, params: Optional[Dict] = None) -> "SQLiteRpc":
+        return SQLiteRpc(self, name, params or {})
+
+    def close(self) -> None:
+        with self._lock:
+            self._connection.close()
+
+    def execute(self, sql: str, params: List[Any] = ()) -> List[Dict]:
+        """Chạy một câu SQL trong transaction riêng, trả về các dòng dạng dict"""
+        with self._lock, self._connection:
+            cursor = self._connection.execute(sql, params)
+            return [dict(row) for row in cursor.fetchall()]
+
+
+class SQLiteQuery:
+    """Query builder tương thích với phần API Supabase/PostgREST mà ChatPersistence sử dụng"""
+
+    def __init__(self, backend: SQLiteBackend, table: str):
+        self.backend = backend
+        self.table = table
+        self._action = "select"
+        self._columns = "*"
+        self._payload = None
+        self._count = None
+        self._head = False
+        self._returning = True
+        self._where: List[str] = []
+        self._params: List[Any] = []
+        self._order: List[str] = []
+        self._limit: Optional[int] = None
+        self._offset: Optional[int] = None
+
+    def select(self, *columns: str, count: Optional[str] = None, head: Optional[bool] = None) -> "SQLiteQuery":
+        self._columns = ",".join(columns) if columns else "*"
+        self._count = count
+        self._head = bool(head)
+        return self
+
+    def insert(self, payload) -> "SQLiteQuery":
+        self._action, self._payload = "insert", payload
+        return self
+
+    def update(self, payload: Dict) -> "SQLiteQuery":
+        self._action, self._payload = "update", payload
+        return self
+
+    def delete(self, count: Optional[str] = None, returning: Any = "representation") -> "SQLiteQuery":
+        self._action, self._count = "delete", count
+        self._returning = str(getattr(returning, "value", returning)) != "minimal"
+        return self
+
+    def eq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "=", value)
+
+    def neq(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "!=", value)
+
+    def lt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "<", value)
+
+    def lte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, "<=", value)
+
+    def gt(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, ">", value)
+
+    def gte(self, column: str, value: Any) -> "SQLiteQuery":
+        return self._filter(column, ">=", value)
+
+    def in_(self, column: str, values: List[Any]) -> "SQLiteQuery":
+        values = list(values)
+        if not values:
+            self._where.append("0")
+            return self
+        self._where.append(f"{_quote(column)} IN ({','.join('?' * len(values))})")
+        self._params.extend(values)
+        return self
+
+    def or_(self, filters: str) -> "SQLiteQuery":
+        """Filter dạng PostgREST: 'a.lt.x,and(a.eq.x,b.lt.y)'"""
+        clause, params = _parse_logic(filters, "OR")
+        self._where.append(clause)
+        self._params.extend(params)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "SQLiteQuery":
+        self._order.append(f"{_quote(column)} {'DESC' if desc else 'ASC'}")
+        return self
+
+    def limit(self, size: int) -> "SQLiteQuery":
+        self._limit = size
+        return self
+
+    def range(self, start: int, end: int) -> "SQLiteQuery":
+        self._offset, self._limit = start, end - start + 1
+        return self
+
+    def execute(self) -> StorageResult:
+        if self._action == "insert":
+            return self._execute_insert()
+        if self._action == "update":
+            return self._execute_update()
+        if self._action == "delete":
+            return self._execute_delete()
+        return self._execute_select()
+
+    def _filter(self, column: str, operator: str, value: Any) -> "SQLiteQuery":
+        self._where.append(f"{_quote(column)} {operator} ?")
+        self._params.append(_to_sql(value))
+        return self
+
+    def _where_sql(self) -> str:
+        return f" WHERE {' AND '.join(self._where)}" if self._where else ""
+
+    def _execute_select(self) -> StorageResult:
+        table = _quote(self.table)
+        count = None
+        if self._count:
+            count = self.backend.execute(
+                f"SELECT COUNT(*) AS count FROM {table}{self._where_sql()}", self._params
+            )[0]["count"]
+        if self._head:
+            return StorageResult([], count)
+
+        columns = ",".join(_quote(column.strip()) for column in self._columns.split(","))
+        sql = f"SELECT {columns} FROM {table}{self._where_sql()}"
+        if self._order:
+            sql += f" ORDER BY {', '.join(self._order)}"
+        if self._limit is not None or self._offset is not None:
+            sql += f" LIMIT {int(self._limit if self._limit is not None else -1)} OFFSET {int(self._offset or 0)}"
+        return StorageResult(self.backend.execute(sql, self._params), count)
+
+    def _execute_insert(self) -> StorageResult:
+        rows = self._payload if isinstance(self._payload, list) else [self._payload]
+        rows = [dict(row) for row in rows]
+        if not rows:
+            return StorageResult([], 0)
+        if self.table in _UUID_TABLES:
+            for row in rows:
+                row.setdefault("id", str(uuid.uuid4()))
+
+        # Mọi dòng được ghi trong một transaction (một lần fsync WAL cho cả batch)
+        statements = []
+        for row in rows:
+            columns = list(row.keys())
+            statements.append((
+                f"INSERT INTO {_quote(self.table)} ({','.join(_quote(c) for c in columns)}) "
+                f"VALUES ({','.join('?' * len(columns))}) RETURNING *",
+                [_to_sql(row[c]) for c in columns]
+            ))
+        inserted = []
+        with self.backend._lock, self.backend._connection:
+            for sql, params in statements:
+                inserted.extend(dict(row) for row in self.backend._connection.execute(sql, params).fetchall())
+        return StorageResult(inserted, len(inserted))
+
+    def _execute_update(self) -> StorageResult:
+        columns = list(self._payload.keys())
+        assignments = ",".join(f"{_quote(column)} = ?" for column in columns)
+        params = [_to_sql(self._payload[column]) for column in columns] + self._params
+        rows = self.backend.execute(
+            f"UPDATE {_quote(self.table)} SET {assignments}{self._where_sql()} RETURNING *", params
+        )
+        return StorageResult(rows, len(rows))
+
+    def _execute_delete(self) -> StorageResult:
+        returning = " RETURNING *" if self._returning else " RETURNING 1"
+        rows = self.backend.execute(f"DELETE FROM {_quote(self.table)}{self._where_sql()}{returning}", self._params)
+        return StorageResult(rows if self._returning else [], len(rows))
+
+
+class SQLiteRpc:
+    """Các function trong database_functions.sql, viết lại cho SQLite"""
+
+    def __init__(self, backend: SQLiteBackend, name: str, params: Dict):
+        self.backend = backend
+        self.name = name
+        self.params = params
+
+    def execute(self) -> StorageResult:
+        handler = getattr(self, f"_rpc_{self.name}", None)
+        if handler is None:
+            raise ValueError(f"function {self.name} does not exist (không có trong SQLite backend)")
+        return StorageResult(handler(**self.params))
+
+    def _rpc_increment_message_count(self, session_uuid: str) -> None:
+        self.backend.execute(
+            "UPDATE chat_sessions SET message_count = COALESCE(message_count, 0) + 1 WHERE id = ?",
+            [session_uuid]
+        )
+
+    def _rpc_touch_chat_session(self, session_uuid: str, message_delta: int, touched_at: str) -> None:
+        self.backend.execute(
+            "UPDATE chat_sessions SET message_count = COALESCE(message_count, 0) + ?, "
+            "updated_at = MAX(COALESCE(updated_at, ?), ?) WHERE id = ?",
+            [message_delta, touched_at, touched_at, session_uuid]
+        )
+
+    def _rpc_session_message_stats(self, session_uuid: str) -> List[Dict]:
+        return self.backend.execute(
+            "SELECT role, COUNT(*) AS message_count FROM messages WHERE session_id = ? GROUP BY role",
+            [session_uuid]
+        )
+
+    def _rpc_session_previews(self, session_ids: List[str]) -> List[Dict]:
+        if not session_ids:
+            return []
+        placeholders = ",".join("?" * len(session_ids))
+        # SQLite không có DISTINCT ON: lấy tin nhắn user sớm nhất của mỗi session
+        return self.backend.execute(
+            f"SELECT m.session_id, substr(m.content, 1, 100) AS preview FROM messages m "
+            f"WHERE m.session_id IN ({placeholders}) AND m.role = 'user' AND m.created_at = ("
+            f"SELECT MIN(created_at) FROM messages WHERE session_id = m.session_id AND role = 'user') "
+            f"GROUP BY m.session_id",
+            list(session_ids)
+        )
+
+    def _rpc_database_statistics(self, use_estimates: bool = True) -> Dict:
+        # SQLite không có thống kê ước lượng, COUNT(*) trên file local đủ nhanh
+        stats = self.backend.execute(
+            "SELECT "
+            "(SELECT COUNT(*) FROM chat_sessions) AS total_sessions, "
+            "(SELECT COUNT(*) FROM messages) AS total_messages, "
+            "(SELECT COUNT(*) FROM \"user\") AS total_users, "
+            "(SELECT COUNT(*) FROM messages WHERE role = 'user') AS user_messages, "
+            "(SELECT COUNT(*) FROM messages WHERE role = 'assistant') AS ai_messages"
+        )[0]
+        stats["estimated"] = False
+        return stats
+
+    def _rpc_cleanup_old_sessions_batch(self, cutoff: str, batch_size: int = 500) -> Dict:
+        with self.backend._lock, self.backend._connection:
+            connection = self.backend._connection
+            session_ids = [row[0] for row in connection.execute(
+                "SELECT id FROM chat_sessions WHERE updated_at < ? ORDER BY updated_at LIMIT ?",
+                [cutoff, batch_size]
+            ).fetchall()]
+            if not session_ids:
+                return {"sessions": 0, "messages": 0, "documents": 0, "pages": 0}
+
+            placeholders = ",".join("?" * len(session_ids))
+            pages = connection.execute(
+                f"DELETE FROM document_pages WHERE document_id IN "
+                f"(SELECT id FROM session_documents WHERE session_id IN ({placeholders}))", session_ids
+            ).rowcount
+            documents = connection.execute(
+                f"DELETE FROM session_documents WHERE session_id IN ({placeholders})", session_ids
+            ).rowcount
+            messages = connection.execute(
+                f"DELETE FROM messages WHERE session_id IN ({placeholders})", session_ids
+            ).rowcount
+            sessions = connection.execute(
+                f"DELETE FROM chat_sessions WHERE id IN ({placeholders})", session_ids
+            ).rowcount
+            return {"sessions": sessions, "messages": messages, "documents": documents, "pages": pages}
+
+    def _rpc_refresh_user_chat_stats(self) -> None:
+        # user_chat_stats là view thường trong SQLite, luôn mới
+        return None
+
+
+def _quote(identifier: str) -> str:
+    """Quote tên bảng/cột ("user" là từ khóa); giữ nguyên '*' và literal số"""
+    if identifier == "*" or identifier.isdigit():
+        return identifier
+    if not _IDENTIFIER.match(identifier):
+        raise ValueError(f"Tên cột không hợp lệ: {identifier}")
+    return f'"{identifier}"'
+
+
+def _to_sql(value: Any) -> Any:
+    if isinstance(value, bool):
+        return int(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False)
+    if isinstance(value, datetime):
+        return value.astimezone(timezone.utc).isoformat() if value.tzinfo else value.isoformat()
+    return value
+
+
+def _split_top_level(expression: str) -> List[str]:
+    """Tách theo dấu phẩy ngoài ngoặc và ngoài chuỗi trong ngoặc kép"""
+    parts, depth, quoted, current = [], 0, False, []
+    for char in expression:
+        if char == '"':
+            quoted = not quoted
+        elif not quoted and char == "(":
+            depth += 1
+        elif not quoted and char == ")":
+            depth -= 1
+        elif not quoted and depth == 0 and char == ",":
+            parts.append("".join(current))
+            current = []
+            continue
+        current.append(char)
+    if current:
+        parts.append("".join(current))
+    return parts
+
+
+def _parse_logic(expression: str, joiner: str) -> Tuple[str, List[Any]]:
+    clauses, params = [], []
+    for part in _split_top_level(expression):
+        part = part.strip()
+        group = re.match(r'^(and|or)\((.*)\)$', part)
+        if group:
+            clause, group_params = _parse_logic(group.group(2), group.group(1).upper())
+        else:
+            column, operator, value = part.split(".", 2)
+            if operator not in _OPERATORS:
+                raise ValueError(f"Toán tử không hỗ trợ: {operator}")
+            clause, group_params = f"{_quote(column)} {_OPERATORS[operator]} ?", [value.strip('"')]
+        clauses.append(f"({clause})")
+        params.extend(group_params)
+    return f" {joiner} ".join(clauses), params
+
+
+def get_sqlite_backend(path: str = SQLITE_DB_PATH) -> SQLiteBackend:
+    """Lấy SQLite backend dùng chung của process cho file path"""
+    return get_resource(("sqlite_backend", path), lambda: SQLiteBackend(path))
+
+
+def get_storage_backend(kind: str, supabase_factory=None):
+    """
+    Tạo client storage theo cấu hình
+
+    Args:
+        kind: Một trong STORAGE_BACKENDS ('supabase' hoặc 'sqlite')
+        supabase_factory: Hàm tạo Supabase client (chỉ gọi khi kind = 'supabase')
+
+    Returns:
+        Client có interface table()/rpc() dùng cho ChatPersistence
+    """
+    if kind not in STORAGE_BACKENDS:
+        raise ValueError(f"Storage backend không hợp lệ: {kind} (hỗ trợ: {', '.join(STORAGE_BACKENDS)})")
+    if kind == "sqlite":
+        return get_sqlite_backend(os.getenv("SQLITE_DB_PATH", SQLITE_DB_PATH))
+    return supabase_factory()
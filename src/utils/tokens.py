@@ -0,0 +1,87 @@
+"""
+Ước lượng số token và ngân sách context cho prompt gửi Local LLM
+"""
+import math
+from functools import lru_cache
+
+from ..config.constants import (
+    MAX_CONTEXT_LENGTH, CHARS_PER_TOKEN, TOKENS_PER_EXTRA_BYTE,
+    CONTEXT_SAFETY_MARGIN_TOKENS, TOKEN_COUNT_CACHE_SIZE, TOKEN_COUNT_CACHE_MAX_CHARS
+)
+
+
+def _estimate(text: str) -> int:
+    # Text ASCII ~ CHARS_PER_TOKEN ký tự/token; ký tự có dấu (tiếng Việt) được
+    # encode nhiều byte và tokenizer BPE tách dày hơn, nên tính thêm theo số byte dư
+    char_count = len(text)
+    extra_bytes = len(text.encode('utf-8')) - char_count
+    return max(1, math.ceil(char_count / CHARS_PER_TOKEN + extra_bytes * TOKENS_PER_EXTRA_BYTE))
+
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def _estimate_cached(text: str) -> int:
+    return _estimate(text)
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Ước lượng nhanh số token của text (không cần tokenizer của model)
+
+    Args:
+        text: Text cần đếm
+
+    Returns:
+        Số token ước lượng (0 nếu text rỗng)
+    """
+    if not text:
+        return 0
+    # Chỉ cache text ngắn (chunk, câu hỏi, prompt) để không giữ cả tài liệu trong bộ nhớ
+    if len(text) <= TOKEN_COUNT_CACHE_MAX_CHARS:
+        return _estimate_cached(text)
+    return _estimate(text)
+
+
+def context_token_budget(reserved_output_tokens: int, prompt_tokens: int = 0,
+                         context_window: int = MAX_CONTEXT_LENGTH) -> int:
+    """
+    Số token còn lại cho context tài liệu trong một prompt
+
+    Args:
+        reserved_output_tokens: Token dành cho câu trả lời (max_tokens)
+        prompt_tokens: Token của phần còn lại của prompt (system prompt, lịch sử, câu hỏi)
+        context_window: Context window của model (mặc định MAX_CONTEXT_LENGTH)
+
+    Returns:
+        Số token tối đa cho context (>= 0)
+    """
+    return max(0, context_window - reserved_output_tokens - prompt_tokens - CONTEXT_SAFETY_MARGIN_TOKENS)
+
+
+def chars_for_tokens(text: str, max_tokens: int) -> int:
+    """Số ký tự của text tương ứng với max_tokens (theo mật độ token của chính text đó)"""
+    if not text or max_tokens <= 0:
+        return 0
+    chars_per_token = len(text) / estimate_tokens(text)
+    return max(1, int(max_tokens * chars_per_token))
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """
+    Cắt text để vừa max_tokens
+
+    Returns:
+        Text gốc nếu đã vừa, ngược lại là phần đầu dài nhất không vượt ngân sách
+    """
+    if not text or estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= 0:
+        return ""
+
+    low, high = 0, min(len(text), chars_for_tokens(text, max_tokens) * 2)
+    while low < high:
+        middle = (low + high + 1) // 2
+        if _estimate(text[:middle]) <= max_tokens:
+            low = middle
+        else:
+            high = middle - 1
+    return text[:low]
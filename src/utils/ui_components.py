@@ -1,6 +1,10 @@
 import streamlit as st
 from datetime import datetime
 import time
+import uuid
+from ..config.constants import PAGE_THUMBNAIL_STRIP_MAX, PAGE_THUMBNAIL_MAX_SIDE, FEATURES
+from .page_images import dpi_bucket
+from .page_prefetch import get_page_prefetcher
 
 # Enhanced UI Components for Study Buddy
 # Author: Nguyễn Ngọc Công Anh - Frontend & UI/UX Enhancement
@@ -71,6 +75,23 @@ def render_typing_animation():
     
     typing_placeholder.empty()
 
+def render_streaming_message(stream):
+    """
+    Render phản hồi AI dạng streaming: từng đoạn text hiện ra ngay khi model sinh
+    
+    Args:
+        stream: Generator trả về các đoạn text (ChatHandler/DocumentProcessor *_stream)
+        
+    Returns:
+        Toàn bộ nội dung phản hồi sau khi stream kết thúc
+    """
+    with st.chat_message("assistant", avatar="🤖"):
+        content = st.write_stream(stream)
+    
+    if isinstance(content, str):
+        return content
+    return "".join(str(part) for part in content)
+
 def render_message_actions(content):
     """Render action buttons cho messages với responsive layout"""
     # Xác định nếu đang ở màn hình nhỏ (có thể dựa vào session state)
@@ -271,11 +292,9 @@ def render_question_carousel(questions, document_text):
         
         # Tạo response
         if document_text and hasattr(st.session_state, 'doc_processor'):
-            with st.spinner("🤖 Đang trả lời..."):
-                response = st.session_state.doc_processor.answer_question_with_openai(
-                    question,
-                    document_text
-                )
+            response = render_streaming_message(
+                st.session_state.doc_processor.answer_question_stream(question, document_text)
+            )
         else:
             response = "Vui lòng upload tài liệu để tôi có thể trả lời câu hỏi này."
         
@@ -826,9 +845,25 @@ def render_page_selector(documents, doc_processor):
     
     # Nếu không có trang nào được chọn
     if not selected_pages:
+        get_page_prefetcher().cancel(_get_prefetch_session_id())
         st.info("👆 Hãy chọn ít nhất một trang để bắt đầu.")
         return selected_doc, None, None, 0
     
+    # Thumbnail các trang đã chọn (render DPI thấp, cache riêng với ảnh xem trang)
+    if hasattr(selected_doc.get('file', {}), 'name'):
+        thumbnail_pages = selected_pages[:PAGE_THUMBNAIL_STRIP_MAX]
+        thumbnails = [
+            (page_num, doc_processor.get_pdf_page_thumbnail(selected_doc['file'], page_num))
+            for page_num in thumbnail_pages
+        ]
+        thumbnails = [(page_num, image) for page_num, image in thumbnails if image is not None]
+        if thumbnails:
+            st.image(
+                [image for _, image in thumbnails],
+                caption=[f"Trang {page_num}" for page_num, _ in thumbnails],
+                width=PAGE_THUMBNAIL_MAX_SIDE // 2
+            )
+    
     # Determine current page to display
     if len(selected_pages) > 1:
         # Initialize current page index trong session state
@@ -863,9 +898,11 @@ def render_page_preview(doc_processor, selected_doc, selected_page, max_chars=30
                 selected_page
             )
         else:
-            # Document từ database - cần load từ document_pages table
-            # (sẽ implement sau khi có database schema)
-            page_content = f"Nội dung trang {selected_page} của {selected_doc.get('file_name', 'Document')}"
+            # Document từ database: nội dung load theo yêu cầu (đã cache)
+            page_content = st.session_state.chat_persistence.load_document_page_content(
+                selected_doc['id'],
+                selected_page
+            )
         
         if page_content:
             # Hiển thị preview
@@ -983,15 +1020,14 @@ def render_page_chat_interface(page_content, selected_doc, selected_page):
         with messages_container:
             render_message(user_message)
         
-        # Tạo AI response dựa trên nội dung trang
-        with st.spinner("🤖 Đang phân tích trang..."):
-            if hasattr(st.session_state, 'doc_processor'):
-                response = st.session_state.doc_processor.answer_question_with_openai(
-                    prompt,
-                    page_content
+        # Tạo AI response dựa trên nội dung trang (streaming)
+        if hasattr(st.session_state, 'doc_processor'):
+            with messages_container:
+                response = render_streaming_message(
+                    st.session_state.doc_processor.answer_question_stream(prompt, page_content)
                 )
-            else:
-                response = "Không thể xử lý câu hỏi. Vui lòng thử lại."
+        else:
+            response = "Không thể xử lý câu hỏi. Vui lòng thử lại."
         
         # Thêm AI response
         ai_message = {
@@ -1101,8 +1137,8 @@ def render_pdf_page_image_viewer(doc_processor, selected_doc, selected_page, sel
         dpi = int(zoom_level * 1.5)  # Convert zoom % to DPI
         
         with st.spinner(f"🔄 Đang tải trang {selected_page} với zoom {zoom_level}%..."):
-            # Lấy ảnh PDF
-            pdf_image = doc_processor.extract_pdf_page_as_image(
+            # Lấy ảnh PDF đã nén (JPEG/WebP), trình duyệt nhận thẳng bytes không encode lại
+            pdf_image = doc_processor.get_pdf_page_image_bytes(
                 pdf_file, 
                 selected_page, 
                 dpi=dpi
@@ -1119,6 +1155,16 @@ def render_pdf_page_image_viewer(doc_processor, selected_doc, selected_page, sel
                 
             else:
                 st.error("❌ Không thể tải ảnh PDF. Vui lòng thử lại.")
+        
+        # Render trước trang kế bên trong lúc người dùng đọc trang hiện tại
+        if selected_pages and len(selected_pages) > 1 and FEATURES.get('enable_page_prefetch', False):
+            get_page_prefetcher().prefetch(
+                _get_prefetch_session_id(),
+                (doc_processor.get_document_hash(pdf_file), tuple(selected_pages), dpi_bucket(dpi)),
+                selected_page,
+                selected_pages,
+                lambda page_number: doc_processor.prefetch_pdf_page(pdf_file, page_number, dpi)
+            )
                 
     except Exception as e:
         st.error(f"❌ Lỗi khi hiển thị ảnh PDF: {str(e)}")
@@ -1165,6 +1211,12 @@ def render_pdf_page_image_viewer(doc_processor, selected_doc, selected_page, sel
     if st.session_state.get('show_fullscreen', False):
         render_fullscreen_pdf_modal(doc_processor, selected_doc, selected_page)
 
+def _get_prefetch_session_id():
+    """ID dùng để giới hạn prefetch trang theo session Streamlit"""
+    if "page_prefetch_session_id" not in st.session_state:
+        st.session_state.page_prefetch_session_id = str(uuid.uuid4())
+    return st.session_state.page_prefetch_session_id
+
 def render_fullscreen_pdf_modal(doc_processor, selected_doc, selected_page):
     """Hiển thị PDF trong modal toàn màn hình"""
     with st.expander("🖼️ Xem toàn màn hình", expanded=True):
@@ -1184,7 +1236,7 @@ def render_fullscreen_pdf_modal(doc_processor, selected_doc, selected_page):
             
             with st.spinner("🔄 Đang tải ảnh độ phân giải cao..."):
                 # Sử dụng DPI cao cho fullscreen
-                high_res_image = doc_processor.extract_pdf_page_as_image(
+                high_res_image = doc_processor.get_pdf_page_image_bytes(
                     pdf_file, 
                     selected_page, 
                     dpi=200
@@ -1220,8 +1272,11 @@ def render_page_summary_from_ocr(doc_processor, selected_doc, selected_page, max
                 selected_page
             )
         else:
-            # Từ database - implement sau
-            page_content = selected_doc.get('content', '')
+            # Từ database: nội dung load theo yêu cầu (đã cache)
+            page_content = st.session_state.chat_persistence.load_document_page_content(
+                selected_doc['id'],
+                selected_page
+            )
         
         if page_content:
             # Tạo tóm tắt ngắn
@@ -341,6 +341,14 @@ class FileValidator:
         
         return ValidationResult(is_valid=True, metadata=metadata)
     
+    @staticmethod
+    def compute_file_hash(uploaded_file) -> str:
+        """Tính SHA-256 của nội dung file (giữ nguyên vị trí đọc ở đầu file)"""
+        uploaded_file.seek(0)
+        content = uploaded_file.read()
+        uploaded_file.seek(0)
+        return hashlib.sha256(content).hexdigest()
+
     @staticmethod
     def _generate_file_metadata(uploaded_file) -> Dict[str, Any]:
         """Generate comprehensive file metadata"""
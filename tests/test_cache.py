@@ -0,0 +1,177 @@
+"""
+Unit tests cho cache và page store
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.cache import LRUCache, TTLCache
+from src.utils.page_store import PDFPageStore
+from src.utils.ingestion_cache import IngestionCache
+
+class TestLRUCache:
+    """Test LRUCache class"""
+
+    def test_get_put(self):
+        """Test get/put cơ bản"""
+        cache = LRUCache(max_items=2)
+        cache.put("a", 1)
+        assert cache.get("a") == 1
+        assert cache.get("missing") is None
+        assert "a" in cache
+
+    def test_evicts_least_recently_used(self):
+        """Test loại bỏ phần tử ít dùng nhất"""
+        evicted = []
+        cache = LRUCache(max_items=2, on_evict=lambda k, v: evicted.append(k))
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")  # "b" trở thành cũ nhất
+        cache.put("c", 3)
+
+        assert "b" not in cache
+        assert "a" in cache and "c" in cache
+        assert evicted == ["b"]
+
+    def test_evicts_by_size(self):
+        """Test loại bỏ theo tổng dung lượng"""
+        cache = LRUCache(max_items=10, max_size=10, sizeof=len)
+        cache.put("a", "x" * 6)
+        cache.put("b", "y" * 6)
+
+        assert "a" not in cache
+        assert "b" in cache
+        assert cache.current_size == 6
+
+class TestTTLCache:
+    """Test TTLCache class"""
+
+    def test_hits_misses_and_expiry(self):
+        """Test phần tử hết hạn được tính là miss"""
+        cache = TTLCache(max_items=10, ttl=60)
+        cache.put("a", 1)
+        cache.put("b", 2, ttl=0)
+
+        assert cache.get("a") == 1
+        assert cache.get("b") is None
+        assert cache.get("c") is None
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 2
+        assert stats["expirations"] == 1
+
+    def test_invalidate_prefix(self):
+        """Test xóa theo prefix của key"""
+        cache = TTLCache(max_items=10, ttl=60)
+        cache.put(("sessions", "u1", 20, None), [1])
+        cache.put(("sessions", "u2", 20, None), [2])
+        cache.put(("messages", "s1"), [3])
+
+        cache.invalidate_prefix(("sessions", "u1"))
+
+        assert cache.peek(("sessions", "u1", 20, None)) is None
+        assert cache.peek(("sessions", "u2", 20, None)) == [2]
+        assert cache.stats()["invalidations"] == 1
+
+class TestPDFPageStore:
+    """Test PDFPageStore class"""
+
+    def test_pages_by_hash(self):
+        """Test lưu và đọc trang theo hash"""
+        store = PDFPageStore(max_documents=4)
+        store.put_document("hash1", {1: "Trang 1", 3: "Trang 3"}, page_count=3)
+
+        assert store.has_document("hash1")
+        assert store.get_page_count("hash1") == 3
+        assert store.get_page("hash1", 1) == "Trang 1"
+        assert store.get_page("hash1", 2) is None
+        assert store.get_pages_range("hash1", 1, 3) == {1: "Trang 1", 3: "Trang 3"}
+
+    def test_multiple_documents(self):
+        """Test nhiều tài liệu mở cùng lúc"""
+        store = PDFPageStore(max_documents=4)
+        store.put_document("hash1", {1: "A"}, page_count=1)
+        store.put_document("hash2", {1: "B"}, page_count=1)
+
+        assert store.get_page("hash1", 1) == "A"
+        assert store.get_page("hash2", 1) == "B"
+        assert not store.has_document("unknown")
+        assert store.get_page_count("unknown") == 0
+
+class TestIngestionCache:
+    """Test IngestionCache class"""
+
+    def test_put_get(self):
+        """Test lưu kết quả xử lý theo hash"""
+        cache = IngestionCache(max_documents=2, max_mb=1)
+        cache.put("hash1", "Nội dung", "Tóm tắt", ["Câu hỏi?"], pages={1: "Nội dung"}, page_count=1)
+
+        entry = cache.get("hash1")
+        assert entry["content"] == "Nội dung"
+        assert entry["summary"] == "Tóm tắt"
+        assert entry["pages"] == {1: "Nội dung"}
+        assert cache.get("hash2") is None
+
+    def test_size_bounded(self):
+        """Test giới hạn dung lượng"""
+        cache = IngestionCache(max_documents=10, max_mb=1)
+        big_content = "a" * (700 * 1024)
+        cache.put("hash1", big_content, "", [])
+        cache.put("hash2", big_content, "", [])
+
+        assert "hash1" not in cache
+        assert "hash2" in cache
+
+    def test_processed_document_holds_no_indexes(self):
+        """Test entry chỉ chứa text (tính được dung lượng), index lấy lại qua registry"""
+        from src.utils.document_processor import DocumentProcessor
+
+        processor = DocumentProcessor()
+        processor.ingestion_cache = IngestionCache(max_documents=2, max_mb=1)
+        content = "Gradient descent tối ưu hàm mất mát. " * 50 + "ingestion-index-test"
+        processor.cache_processed_document("hash-index", content, "Tóm tắt", ["Câu hỏi?"])
+
+        entry = processor.get_cached_document("hash-index")
+        assert set(entry) == {"hash", "content", "summary", "questions", "pages", "page_count", "cached_at"}
+        assert processor.get_retrieval_index(entry["content"]) is processor.index_registry.get(content)
+
+    def test_llm_fallback_not_cached(self):
+        """Test tóm tắt/câu hỏi fallback (LLM lỗi) không được cache, lần sau tạo lại"""
+        from src.utils.document_processor import DocumentProcessor
+
+        processor = DocumentProcessor()
+        processor.openai_client = None
+        processor.mistral_client = None
+        processor.ingestion_cache = IngestionCache(max_documents=2, max_mb=1)
+        content = "Nội dung tài liệu học máy. " * 20
+
+        summary = processor.summarize_text(content)
+        questions = processor.generate_questions(content)
+        assert not processor.last_summary_from_llm
+        assert not processor.last_questions_from_llm
+
+        processor.cache_processed_document(
+            "hash-fallback", content, summary, questions,
+            summary_from_llm=processor.last_summary_from_llm,
+            questions_from_llm=processor.last_questions_from_llm
+        )
+        entry = processor.get_cached_document("hash-fallback")
+        assert entry["content"] == content
+        assert entry["summary"] == ""
+        assert entry["questions"] == []
+
+    def test_partial_ocr_not_cached(self):
+        """Test tài liệu còn trang OCR lỗi không được đưa vào ingestion cache"""
+        from src.utils.document_processor import DocumentProcessor
+        from src.utils.page_store import PDFPageStore
+
+        processor = DocumentProcessor()
+        processor.page_store = PDFPageStore()
+        processor.ingestion_cache = IngestionCache(max_documents=2, max_mb=1)
+        processor.page_store.put_document("hash-partial", {1: "Trang 1"}, 2, missing_pages=[2])
+
+        processor.cache_processed_document("hash-partial", "Trang 1", "Tóm tắt", ["Câu hỏi?"])
+        assert processor.get_cached_document("hash-partial") is None
@@ -0,0 +1,454 @@
+"""
+Unit tests cho ChatPersistence (dùng Supabase client giả trong bộ nhớ)
+"""
+import sys
+import os
+import uuid
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.cache import TTLCache
+from src.utils.chat_persistence import ChatPersistence
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = len(data) if count is None else count
+
+class FakeQuery:
+    """Query builder giả: hỗ trợ các filter mà ChatPersistence dùng"""
+
+    def __init__(self, db, table):
+        self.db = db
+        self.table = table
+        self.action = "select"
+        self.payload = None
+        self.filters = []
+        self.order_by = []
+        self.limit_count = None
+        self.head = False
+
+    def select(self, columns="*", count=None, head=False):
+        self.head = head
+        return self
+
+    def insert(self, payload):
+        self.action, self.payload = "insert", payload
+        return self
+
+    def update(self, payload):
+        self.action, self.payload = "update", payload
+        return self
+
+    def delete(self, count=None, returning=None):
+        self.action = "delete"
+        return self
+
+    def eq(self, column, value):
+        self.filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def lt(self, column, value):
+        self.filters.append(lambda row: row.get(column) < value)
+        return self
+
+    def or_(self, expression):
+        # Chỉ hỗ trợ dạng keyset: a.lt."x",and(a.eq."x",b.lt.y)
+        first, second = expression.split(",and(", 1)
+        column, _, value = first.split(".", 2)
+        equal, tie_break = second.rstrip(")").split(",")
+        tie_column, _, tie_value = tie_break.split(".", 2)
+        value = value.strip('"')
+        self.filters.append(lambda row: row.get(column) < value or (
+            row.get(column) == value and row.get(tie_column) < tie_value
+        ))
+        return self
+
+    def in_(self, column, values):
+        self.filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column, desc=False):
+        self.order_by.append((column, desc))
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def range(self, start, end):
+        self.limit_count = end - start + 1
+        return self
+
+    def execute(self):
+        self.db.queries.append((self.action, self.table))
+        rows = self.db.tables.setdefault(self.table, [])
+        if self.action == "insert":
+            new_rows = self.payload if isinstance(self.payload, list) else [self.payload]
+            inserted = []
+            for row in new_rows:
+                row = dict(row)
+                row.setdefault("id", str(uuid.uuid4()))
+                rows.append(row)
+                inserted.append(row)
+            return FakeResult(inserted)
+
+        matched = [row for row in rows if all(check(row) for check in self.filters)]
+        if self.action == "update":
+            for row in matched:
+                row.update(self.payload)
+            return FakeResult(matched)
+        if self.action == "delete":
+            self.db.tables[self.table] = [row for row in rows if row not in matched]
+            return FakeResult(matched)
+
+        if self.head:
+            return FakeResult([], count=len(matched))
+        for column, desc in reversed(self.order_by):
+            matched.sort(key=lambda row: row.get(column) or "", reverse=desc)
+        if self.limit_count is not None:
+            matched = matched[:self.limit_count]
+        return FakeResult([dict(row) for row in matched])
+
+class FakeRpc:
+    def __init__(self, db, name, params):
+        self.db = db
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.db.queries.append(("rpc", self.name))
+        if self.name not in self.db.functions:
+            raise Exception(f"Could not find the function public.{self.name}")
+        result = self.db.functions[self.name](self.params)
+        if isinstance(result, Exception):
+            raise result
+        return FakeResult(result)
+
+class FakeSupabase:
+    def __init__(self):
+        self.tables = {"user": [{"id": 1}]}
+        self.queries = []
+        self.functions = {"increment_message_count": lambda params: []}
+
+    def table(self, name):
+        return FakeQuery(self, name)
+
+    def rpc(self, name, params):
+        return FakeRpc(self, name, params)
+
+class TestChatPersistenceCache:
+    """Test read-through cache và write-through invalidation"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        # Cache riêng cho từng test, ghi tin nhắn đồng bộ
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._write_queue = None
+        self.user_id = str(uuid.uuid4())
+        self.session_id = self.persistence.create_session(self.user_id, "Test")
+        self.db.queries.clear()
+
+    def _select_count(self, table):
+        return sum(1 for action, name in self.db.queries if action == "select" and name == table)
+
+    def test_messages_cached(self):
+        """Test lần load thứ hai lấy từ cache"""
+        self.persistence.load_session_messages(self.session_id)
+        self.persistence.load_session_messages(self.session_id)
+
+        assert self._select_count("messages") == 1
+        assert self.persistence.get_cache_stats()["hits"] >= 1
+
+    def test_save_message_write_through(self):
+        """Test tin nhắn mới xuất hiện trong cache mà không query lại"""
+        self.persistence.load_session_messages(self.session_id)
+        self.persistence.save_message(self.user_id, self.session_id, "user", "Xin chào")
+
+        messages = self.persistence.load_session_messages(self.session_id)
+        assert [message["content"] for message in messages] == ["Xin chào"]
+        assert self._select_count("messages") == 1
+
+    def test_message_pages(self):
+        """Test load trang mới nhất rồi tải các trang cũ hơn theo cursor"""
+        for index in range(5):
+            self.persistence.save_message(self.user_id, self.session_id, "user", f"Tin nhắn {index}")
+
+        messages, has_older = self.persistence.load_message_page(self.session_id, limit=2)
+        assert [message["content"] for message in messages] == ["Tin nhắn 3", "Tin nhắn 4"]
+        assert has_older
+
+        older, has_older = self.persistence.load_message_page(
+            self.session_id, limit=2, before=messages[0]["cursor"]
+        )
+        assert [message["content"] for message in older] == ["Tin nhắn 1", "Tin nhắn 2"]
+        assert has_older
+
+        oldest, has_older = self.persistence.load_message_page(
+            self.session_id, limit=2, before=older[0]["cursor"]
+        )
+        assert [message["content"] for message in oldest] == ["Tin nhắn 0"]
+        assert not has_older
+
+    def test_session_list_invalidated(self):
+        """Test danh sách sessions được làm mới sau khi đổi title / xóa"""
+        sessions = self.persistence.get_user_sessions(self.user_id)
+        assert sessions[0]["title"] == "Test"
+
+        self.persistence.update_session_title(self.session_id, "Mới")
+        assert self.persistence.get_user_sessions(self.user_id)[0]["title"] == "Mới"
+
+        self.persistence.delete_session(self.session_id, self.user_id)
+        assert self.persistence.get_user_sessions(self.user_id) == []
+
+class TestSessionListing:
+    """Test danh sách sessions phân trang keyset và preview"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._write_queue = None
+        self.user_id = str(uuid.uuid4())
+        # s-1 và s-2 cùng updated_at: thứ tự được quyết định bởi id
+        updated = ["2024-01-05", "2024-01-04", "2024-01-04", "2024-01-03", "2024-01-01"]
+        self.db.tables["chat_sessions"] = [
+            {
+                "id": f"s-{index}", "user_id": self.user_id, "title": f"Session {index}",
+                "preview": f"Câu hỏi {index}", "created_at": "2024-01-01T00:00:00+00:00",
+                "updated_at": f"{day}T00:00:00+00:00"
+            }
+            for index, day in enumerate(updated)
+        ] + [{
+            "id": "other", "user_id": str(uuid.uuid4()), "title": "Khác", "preview": "",
+            "created_at": "2024-01-01T00:00:00+00:00", "updated_at": "2024-01-09T00:00:00+00:00"
+        }]
+        self.db.tables["messages"] = [
+            {"id": f"m-{index}-{turn}", "session_id": f"s-{index}", "role": role,
+             "content": f"{role} {index}.{turn}", "created_at": f"2024-01-01T00:00:0{turn}+00:00"}
+            for index in range(5) for turn, role in enumerate(["assistant", "user", "user"])
+        ]
+        self.db.queries.clear()
+
+    def _all_pages(self, limit):
+        pages, cursor = [], None
+        while True:
+            page = self.persistence.get_user_sessions(self.user_id, limit=limit, cursor=cursor)
+            if not page:
+                return pages
+            pages.append([session["id"] for session in page])
+            cursor = page[-1]["cursor"]
+
+    def test_keyset_pages(self):
+        """Test các trang nối tiếp theo (updated_at, id) giảm dần, không trùng/thiếu khi updated_at bằng nhau"""
+        assert self._all_pages(limit=2) == [["s-0", "s-2"], ["s-1", "s-3"], ["s-4"]]
+
+    def test_pages_cached_per_cursor(self):
+        """Test mỗi trang (cursor) được cache riêng"""
+        first = self.persistence.get_user_sessions(self.user_id, limit=2)
+        second = self.persistence.get_user_sessions(self.user_id, limit=2, cursor=first[-1]["cursor"])
+        self.db.queries.clear()
+
+        assert self.persistence.get_user_sessions(self.user_id, limit=2) == first
+        assert self.persistence.get_user_sessions(self.user_id, limit=2, cursor=first[-1]["cursor"]) == second
+        assert self.db.queries == []
+
+    def test_preview_from_column(self):
+        """Test preview lấy từ cột chat_sessions.preview, không query messages"""
+        sessions = self.persistence.get_user_sessions(self.user_id, limit=2)
+        assert [session["preview"] for session in sessions] == ["Câu hỏi 0", "Câu hỏi 2"]
+        assert ("select", "messages") not in self.db.queries
+
+    def test_preview_from_rpc(self):
+        """Test chưa có cột preview thì lấy preview bằng RPC session_previews"""
+        self.persistence._preview_column_available = False
+        self.db.functions["session_previews"] = lambda params: [
+            {"session_id": session_id, "preview": f"rpc {session_id}"} for session_id in params["session_ids"]
+        ]
+
+        sessions = self.persistence.get_user_sessions(self.user_id, limit=2)
+        assert [session["preview"] for session in sessions] == ["rpc s-0", "rpc s-2"]
+        assert ("select", "messages") not in self.db.queries
+
+    def test_preview_limited_query_fallback(self):
+        """Test chưa có RPC thì dùng query messages có giới hạn, chỉ tắt RPC khi function không tồn tại"""
+        self.persistence._preview_column_available = False
+        self.db.functions["session_previews"] = lambda params: TimeoutError("statement timeout")
+
+        sessions = self.persistence.get_user_sessions(self.user_id, limit=2)
+        assert [session["preview"] for session in sessions] == ["user 0.1", "user 2.1"]
+        assert self.persistence._session_previews_rpc_available
+
+        del self.db.functions["session_previews"]
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        sessions = self.persistence.get_user_sessions(self.user_id, limit=2)
+        assert [session["preview"] for session in sessions] == ["user 0.1", "user 2.1"]
+        assert not self.persistence._session_previews_rpc_available
+
+class TestDocumentLoading:
+    """Test load metadata tài liệu và nội dung theo yêu cầu"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._content_cache = TTLCache(max_items=100, ttl=60, max_size=10000, sizeof=len)
+        self.user_id = str(uuid.uuid4())
+        self.session_id = str(uuid.uuid4())
+        self.document_id = self.persistence.save_document_to_session(
+            self.user_id, self.session_id, "bai_giang.pdf", "pdf", 1024, "Nội dung " * 100, page_count=3
+        )
+        self.db.queries.clear()
+
+    def test_listing_excludes_content(self):
+        """Test danh sách tài liệu không chứa nội dung"""
+        documents = self.persistence.load_session_documents(self.session_id)
+        assert documents[0]["file_name"] == "bai_giang.pdf"
+        assert "content" not in documents[0]
+
+    def test_content_cached_after_first_access(self):
+        """Test nội dung được load một lần rồi lấy từ cache"""
+        first = self.persistence.load_document_content(self.document_id)
+        second = self.persistence.load_document_content(self.document_id)
+
+        assert first == second == "Nội dung " * 100
+        assert len(self.db.queries) == 1
+
+    def test_page_falls_back_to_content(self):
+        """Test trang chưa lưu riêng dùng nội dung đầy đủ, lần sau không query lại"""
+        self.persistence.save_document_page(self.document_id, 2, "Trang hai")
+
+        assert self.persistence.load_document_page_content(self.document_id, 2) == "Trang hai"
+        assert self.persistence.load_document_page_content(self.document_id, 1) == "Nội dung " * 100
+
+        query_count = len(self.db.queries)
+        self.persistence.load_document_page_content(self.document_id, 1)
+        assert len(self.db.queries) == query_count
+
+class TestDocumentPagesIngestion:
+    """Test lưu nội dung từng trang bằng multi-row insert"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._content_cache = TTLCache(max_items=1000, ttl=60)
+        self.db.queries.clear()
+
+    def test_pages_saved_in_batches(self):
+        """Test các trang được ghi theo batch và tra cứu không cần query"""
+        pages = {page_number: f"Trang {page_number}" for page_number in range(1, 251)}
+        document_id = self.persistence.save_document_to_session(
+            str(uuid.uuid4()), str(uuid.uuid4()), "sach.pdf", "pdf", 2048, "Nội dung", page_count=250, pages=pages
+        )
+
+        inserts = [name for action, name in self.db.queries if action == "insert" and name == "document_pages"]
+        assert len(inserts) == 3
+        assert len(self.db.tables["document_pages"]) == 250
+
+        self.db.queries.clear()
+        assert self.persistence.load_document_page_content(document_id, 42) == "Trang 42"
+        assert self.db.queries == []
+
+    def test_batches_bounded_by_chars(self):
+        """Test batch bị cắt khi vượt tổng số ký tự"""
+        rows = [{"page_number": index, "content": "x" * 400000} for index in range(5)]
+        batches = ChatPersistence._batch_page_rows(rows)
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+
+class TestStatistics:
+    """Test thống kê đếm ở server"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._write_queue = None
+        self.user_id = str(uuid.uuid4())
+        self.session_id = self.persistence.create_session(self.user_id, "Test")
+        for role in ("user", "assistant", "user"):
+            self.persistence.save_message(self.user_id, self.session_id, role, "Xin chào")
+
+    def test_session_stats_from_rpc(self):
+        """Test dùng RPC session_message_stats khi có"""
+        self.db.functions["session_message_stats"] = lambda params: [
+            {"role": "user", "message_count": 2}, {"role": "assistant", "message_count": 1}
+        ]
+
+        stats = self.persistence.get_session_stats(self.session_id)
+        assert stats == {"total_messages": 3, "user_messages": 2, "ai_messages": 1}
+
+    def test_count_query_fallback(self):
+        """Test fallback count queries không tải dòng nào về"""
+        stats = self.persistence.get_session_stats(self.session_id)
+        assert stats == {"total_messages": 3, "user_messages": 2, "ai_messages": 1}
+
+        database_stats = self.persistence.get_database_statistics(exact=True)
+        assert database_stats["total_sessions"] == 1
+        assert database_stats["total_messages"] == 3
+        assert database_stats["total_users"] == 1
+
+    def test_stats_flags_independent(self):
+        """Test thiếu một RPC chỉ tắt RPC đó, lỗi tạm thời không tắt RPC nào"""
+        self.db.functions["session_message_stats"] = lambda params: TimeoutError("statement timeout")
+        self.db.functions["database_statistics"] = lambda params: {"total_sessions": 7}
+
+        assert self.persistence.get_session_stats(self.session_id)["total_messages"] == 3
+        assert self.persistence._session_stats_rpc_available
+        assert self.persistence.get_database_statistics()["total_sessions"] == 7
+
+        del self.db.functions["session_message_stats"]
+        self.persistence.get_session_stats(self.session_id)
+        assert not self.persistence._session_stats_rpc_available
+        assert self.persistence._database_stats_rpc_available
+        assert self.persistence._user_stats_view_available
+        assert self.persistence.get_database_statistics()["total_sessions"] == 7
+
+class TestCleanupOldSessions:
+    """Test retention job xóa sessions cũ theo batch"""
+
+    def setup_method(self):
+        self.db = FakeSupabase()
+        self.persistence = ChatPersistence(self.db)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.db.tables["chat_sessions"] = [
+            {"id": f"old-{index}", "updated_at": "2020-01-01T00:00:00+00:00"} for index in range(5)
+        ] + [{"id": "new", "updated_at": "2999-01-01T00:00:00+00:00"}]
+        self.db.tables["messages"] = [
+            {"id": f"m-{index}", "session_id": f"old-{index % 5}"} for index in range(10)
+        ] + [{"id": "m-new", "session_id": "new"}]
+        self.db.tables["session_documents"] = [{"id": "d-0", "session_id": "old-0"}]
+        self.db.tables["document_pages"] = [{"id": "p-0", "document_id": "d-0"}]
+
+    def test_deletes_in_batches(self):
+        """Test xóa hết sessions cũ theo batch, giữ session mới"""
+        assert self.persistence.cleanup_old_sessions(days_old=30, batch_size=2) == 5
+
+        stats = self.persistence.last_cleanup_stats
+        assert stats["batches"] == 3
+        assert stats["messages"] == 10
+        assert stats["documents"] == 1
+        assert stats["pages"] == 1
+        assert [session["id"] for session in self.db.tables["chat_sessions"]] == ["new"]
+        assert [message["id"] for message in self.db.tables["messages"]] == ["m-new"]
+        assert self.db.tables["document_pages"] == []
+
+    def test_resumable(self):
+        """Test chạy giới hạn số batch rồi chạy lại để xóa phần còn lại"""
+        assert self.persistence.cleanup_old_sessions(days_old=30, batch_size=2, max_batches=1) == 2
+        assert self.persistence.cleanup_old_sessions(days_old=30, batch_size=2) == 3
+        assert len(self.db.tables["chat_sessions"]) == 1
+
+    def test_rpc_transient_error_keeps_rpc(self):
+        """Test lỗi tạm thời của RPC chỉ fallback batch đó, thiếu function mới tắt RPC"""
+        self.db.functions["cleanup_old_sessions_batch"] = lambda params: TimeoutError("statement timeout")
+
+        assert self.persistence.cleanup_old_sessions(days_old=30, batch_size=10) == 5
+        assert self.persistence._cleanup_rpc_available
+
+        self.db.tables["chat_sessions"].append({"id": "old-x", "updated_at": "2020-01-01T00:00:00+00:00"})
+        del self.db.functions["cleanup_old_sessions_batch"]
+        assert self.persistence.cleanup_old_sessions(days_old=30, batch_size=10) == 1
+        assert not self.persistence._cleanup_rpc_available
@@ -0,0 +1,69 @@
+"""
+Unit tests cho chunking engine
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.chunking import find_boundaries, chunk_spans, chunk_view, TextBoundaries
+
+class TestFindBoundaries:
+    """Test find_boundaries function"""
+
+    def test_sentence_and_paragraph_boundaries(self):
+        """Test tìm dấu câu và xuống dòng (kể cả text có dấu tiếng Việt)"""
+        text = "Xin chào. Bạn khỏe không?\nTốt!"
+        positions = find_boundaries(text).tolist()
+        assert [text[i] for i in positions] == ['.', '?', '\n', '!']
+
+    def test_empty_text(self):
+        """Test text rỗng"""
+        assert find_boundaries("").size == 0
+
+class TestChunkSpans:
+    """Test chunk_spans function"""
+
+    def test_breaks_at_sentence_boundary(self):
+        """Test chunk kết thúc ở dấu câu gần nhất"""
+        text = "a" * 150 + ". " + "b" * 100
+        spans = chunk_spans(text, chunk_size=200, overlap=20)
+
+        start, end = spans[0]
+        assert text[start:end] == "a" * 150 + "."
+        assert spans[-1][1] == len(text)
+
+    def test_spans_are_stripped_offsets(self):
+        """Test spans không chứa khoảng trắng ở hai đầu"""
+        text = "  Câu một.   Câu hai.  " * 20
+        for start, end in chunk_spans(text, chunk_size=50, overlap=10):
+            assert 0 <= start < end <= len(text)
+            assert text[start:end] == text[start:end].strip()
+
+    def test_no_boundaries(self):
+        """Test text không có dấu câu vẫn được chia theo chunk_size"""
+        spans = chunk_spans("x" * 1000, chunk_size=300, overlap=50)
+        assert all(end - start <= 300 for start, end in spans)
+        assert spans[-1][1] == 1000
+
+    def test_different_sizes_reuse_boundaries(self):
+        """Test nhiều kích thước chunk dùng chung một mảng ranh giới"""
+        boundaries = TextBoundaries("Một. Hai. Ba. " * 100)
+        small = boundaries.spans(100, 20)
+        large = boundaries.spans(500, 50)
+
+        assert len(small) > len(large)
+        assert boundaries.spans(100, 20) is small
+
+class TestChunkView:
+    """Test ChunkView class"""
+
+    def test_slices_on_access(self):
+        """Test truy cập chunk theo index, slice và vòng lặp"""
+        text = "Câu một. Câu hai. Câu ba. " * 30
+        view = chunk_view(text, chunk_size=100, overlap=20)
+
+        assert len(view) == len(view.spans)
+        assert view[0] == text[view.spans[0][0]:view.spans[0][1]]
+        assert view[0:2] == list(view)[0:2]
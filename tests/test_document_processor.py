@@ -0,0 +1,206 @@
+"""
+Unit tests cho trích xuất PDF của DocumentProcessor (text layer + Mistral OCR)
+"""
+import sys
+import os
+import base64
+import threading
+from types import SimpleNamespace
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz
+from PIL import Image
+
+from src.utils.document_processor import DocumentProcessor
+from src.utils.page_store import PDFPageStore
+from src.config.constants import OCR_SHARD_MAX_RETRIES
+from tests.test_page_images import FakeUpload
+
+TEXT_PAGE = "Gradient descent minimizes the loss by stepping against the gradient."
+
+def make_pdf(page_texts):
+    """PDF với mỗi trang chứa text tương ứng (None = trang trắng, "image" = trang chỉ có ảnh)"""
+    document = fitz.open()
+    for text in page_texts:
+        page = document.new_page(width=300, height=200)
+        if text == "image":
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 40, 40), False)
+            pixmap.set_rect(pixmap.irect, (200, 30, 30))
+            page.insert_image(fitz.Rect(20, 20, 120, 120), pixmap=pixmap)
+        elif text:
+            page.insert_text((10, 30), text, fontsize=8)
+    data = document.tobytes()
+    document.close()
+    return data
+
+class FakeOCR:
+    def __init__(self, client):
+        self.client = client
+
+    def process(self, model, document):
+        """Trả về text của từng trang trong shard (giống Mistral OCR đọc ảnh trang)"""
+        pdf_bytes = base64.b64decode(document["document_url"].split(",", 1)[1])
+        shard = fitz.open(stream=pdf_bytes, filetype="pdf")
+        texts = [page.get_text("text").strip() for page in shard]
+        shard.close()
+
+        with self.client.lock:
+            self.client.calls.append(texts)
+            failures = self.client.failures.get(texts[0], 0)
+            if failures:
+                self.client.failures[texts[0]] = failures - 1
+                raise ConnectionError("Mistral OCR unavailable")
+
+        return SimpleNamespace(pages=[
+            SimpleNamespace(markdown=f"OCR {text}" if text else None) for text in texts
+        ])
+
+class FakeMistral:
+    """Mistral client giả: OCR trả về 'OCR <text của trang>', có thể cấu hình shard lỗi"""
+
+    def __init__(self):
+        self.calls = []
+        self.failures = {}
+        self.lock = threading.Lock()
+        self.ocr = FakeOCR(self)
+
+def make_processor(mistral_client=None):
+    processor = DocumentProcessor()
+    processor.mistral_client = mistral_client
+    processor.page_store = PDFPageStore()
+    return processor
+
+class TestTextLayer:
+    """Test đọc text layer và chọn trang cần OCR"""
+
+    def test_text_blank_and_image_pages(self):
+        """Test trang có text đọc trực tiếp, trang trắng/chỉ có ảnh gửi OCR"""
+        processor = make_processor()
+        pages, ocr_pages, page_count = processor._extract_text_layer(make_pdf([TEXT_PAGE, None, "image", TEXT_PAGE]))
+
+        assert page_count == 4
+        assert pages == {1: TEXT_PAGE, 4: TEXT_PAGE}
+        assert ocr_pages == [2, 3]
+
+    def test_short_text_needs_ocr(self):
+        """Test trang chỉ có vài ký tự (số trang, header) vẫn được OCR"""
+        processor = make_processor()
+        _, ocr_pages, _ = processor._extract_text_layer(make_pdf(["12"]))
+        assert ocr_pages == [1]
+
+    def test_has_usable_text(self):
+        """Test text nhiều ký tự thay thế U+FFFD (font không có ToUnicode) bị coi là không dùng được"""
+        processor = make_processor()
+
+        assert processor._has_usable_text(TEXT_PAGE)
+        assert not processor._has_usable_text("")
+        assert not processor._has_usable_text("abc")
+        assert not processor._has_usable_text(TEXT_PAGE + "�" * 20)
+        assert processor._has_usable_text(TEXT_PAGE + "�")
+
+    def test_merge_in_page_order(self):
+        """Test trang text layer và trang OCR được ghép theo thứ tự trang"""
+        processor = make_processor(FakeMistral())
+        upload = FakeUpload(make_pdf([TEXT_PAGE, "p2", TEXT_PAGE, "p4"]), name="merge.pdf")
+
+        assert processor._run_pdf_ocr(upload, "merge-hash")
+
+        pages = processor.page_store.get_pages("merge-hash")
+        assert list(pages) == [1, 2, 3, 4]
+        assert pages[2] == "OCR p2"
+        assert pages[3] == TEXT_PAGE
+        assert processor.mistral_client.calls == [["p2", "p4"]]
+        assert processor.page_store.get_page_count("merge-hash") == 4
+
+class TestOCRSharding:
+    """Test chia trang cần OCR thành shard, retry và map kết quả về số trang gốc"""
+
+    def setup_method(self):
+        # 20 trang: trang chẵn có text layer, trang lẻ cần OCR (không liên tiếp, 2 shard: 8 + 2 trang)
+        self.pdf_bytes = make_pdf([TEXT_PAGE if number % 2 == 0 else f"p{number}" for number in range(1, 21)])
+        self.ocr_pages = list(range(1, 21, 2))
+
+    def test_build_shards(self):
+        """Test mỗi shard là PDF nhỏ chứa đúng các trang gốc theo thứ tự"""
+        processor = make_processor()
+        shards = [self.ocr_pages[:8], self.ocr_pages[8:]]
+
+        shard_documents = processor._build_ocr_shards(self.pdf_bytes, shards, 20)
+
+        texts = []
+        for shard_bytes in shard_documents:
+            shard = fitz.open(stream=shard_bytes, filetype="pdf")
+            texts.append([page.get_text("text").strip() for page in shard])
+            shard.close()
+        assert texts == [[f"p{number}" for number in shard] for shard in shards]
+
+    def test_single_shard_whole_document(self):
+        """Test shard chứa toàn bộ tài liệu thì gửi nguyên file"""
+        processor = make_processor()
+        pdf_bytes = make_pdf(["p1", "p2"])
+        assert processor._build_ocr_shards(pdf_bytes, [[1, 2]], 2) == [pdf_bytes]
+
+    def test_maps_results_to_original_pages(self):
+        """Test kết quả OCR của từng shard được map về số trang gốc"""
+        processor = make_processor(FakeMistral())
+
+        pages, failed_pages = processor._ocr_pdf_pages(self.pdf_bytes, self.ocr_pages, 20)
+
+        assert pages == {number: f"OCR p{number}" for number in self.ocr_pages}
+        assert failed_pages == []
+        assert len(processor.mistral_client.calls) == 2
+
+    def test_failing_shard_is_retried(self):
+        """Test shard lỗi tạm thời được thử lại và không mất trang"""
+        mistral = FakeMistral()
+        mistral.failures["p17"] = 1
+        processor = make_processor(mistral)
+
+        pages, failed_pages = processor._ocr_pdf_pages(self.pdf_bytes, self.ocr_pages, 20)
+
+        assert sorted(pages) == self.ocr_pages
+        assert failed_pages == []
+        assert [texts[0] for texts in mistral.calls].count("p17") == 2
+
+    def test_partial_failure_only_drops_failed_shard(self):
+        """Test shard lỗi hết số lần retry chỉ làm thiếu các trang của shard đó"""
+        mistral = FakeMistral()
+        mistral.failures["p17"] = 100
+        processor = make_processor(mistral)
+
+        pages, failed_pages = processor._ocr_pdf_pages(self.pdf_bytes, self.ocr_pages, 20)
+        assert sorted(pages) == self.ocr_pages[:8]
+        assert failed_pages == [17, 19]
+        # 1 lần gọi + OCR_SHARD_MAX_RETRIES lần thử lại cho shard lỗi
+        assert [texts[0] for texts in mistral.calls].count("p17") == OCR_SHARD_MAX_RETRIES + 1
+
+    def test_failed_pages_retried_on_next_call(self):
+        """Test trang OCR lỗi không được cache là đã xong, lần sau chỉ OCR lại các trang đó"""
+        mistral = FakeMistral()
+        mistral.failures["p17"] = OCR_SHARD_MAX_RETRIES + 1
+        processor = make_processor(mistral)
+        upload = FakeUpload(self.pdf_bytes, name="retry.pdf")
+
+        assert processor._run_pdf_ocr(upload, "retry-hash")
+        assert not processor.page_store.has_document("retry-hash")
+        assert processor.page_store.get_missing_pages("retry-hash") == [17, 19]
+
+        mistral.calls.clear()
+        assert processor._run_pdf_ocr(upload, "retry-hash")
+        assert mistral.calls == [["p17", "p19"]]
+        assert processor.page_store.has_document("retry-hash")
+        assert list(processor.page_store.get_pages("retry-hash")) == list(range(1, 21))
+
+    def test_total_ocr_failure_not_cached(self):
+        """Test Mistral lỗi toàn bộ thì không lưu gì, lần sau OCR lại từ đầu"""
+        mistral = FakeMistral()
+        mistral.failures["p1"] = OCR_SHARD_MAX_RETRIES + 1
+        processor = make_processor(mistral)
+        upload = FakeUpload(make_pdf(["p1", "p2"]), name="outage.pdf")
+
+        assert processor.extract_pdf_content(upload) is None
+        assert not processor.page_store.has_document(processor.get_document_hash(upload))
+
+        assert processor.extract_pdf_content(upload) == "OCR p1\n\nOCR p2"
@@ -0,0 +1,176 @@
+"""
+Unit tests cho write-behind message queue
+"""
+import sys
+import os
+import sqlite3
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.message_queue import MessageWriteQueue
+from src.utils.db_errors import is_permanent_error
+
+class FakeQuery:
+    def __init__(self, client, call):
+        self.client = client
+        self.call = call
+
+    def insert(self, rows):
+        self.call = ("insert", self.call[1], rows)
+        return self
+
+    def update(self, values):
+        self.call = ("update", self.call[1], values)
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        if self.client.fail_next:
+            self.client.fail_next -= 1
+            raise ConnectionError("database unavailable")
+        if self.call[0] == "insert" and any(row["session_id"] in self.client.deleted_sessions for row in self.call[2]):
+            raise FakeAPIError("23503", 'insert or update on table "messages" violates foreign key constraint')
+        if self.call[0] == "rpc" and self.call[1] in self.client.rpc_errors:
+            raise self.client.rpc_errors[self.call[1]]
+        self.client.calls.append(self.call)
+        return self
+
+class FakeAPIError(Exception):
+    """Lỗi giống postgrest.APIError (có SQLSTATE code)"""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+class FakeSupabase:
+    """Supabase client giả, ghi lại các lệnh đã gọi"""
+
+    def __init__(self):
+        self.calls = []
+        self.fail_next = 0
+        self.deleted_sessions = set()
+        self.rpc_errors = {}
+
+    def table(self, name):
+        return FakeQuery(self, ("table", name))
+
+    def rpc(self, name, params):
+        return FakeQuery(self, ("rpc", name, params))
+
+def _message(session_id, content, created_at):
+    return {"session_id": session_id, "role": "user", "content": content, "created_at": created_at}
+
+class TestMessageWriteQueue:
+    """Test MessageWriteQueue class"""
+
+    def setup_method(self):
+        self.queue = MessageWriteQueue(flush_interval=60, batch_size=10)
+        self.client = FakeSupabase()
+
+    def test_batched_insert_and_single_session_update(self):
+        """Test nhiều tin nhắn ghi bằng một insert, mỗi session cập nhật một lần"""
+        self.queue.enqueue(self.client, _message("s1", "a", "2024-01-01T00:00:01"))
+        self.queue.enqueue(self.client, _message("s1", "b", "2024-01-01T00:00:02"))
+        self.queue.enqueue(self.client, _message("s2", "c", "2024-01-01T00:00:03"))
+
+        assert self.queue.flush(timeout=5)
+
+        inserts = [call for call in self.client.calls if call[0] == "insert"]
+        assert len(inserts) == 1
+        assert [row["content"] for row in inserts[0][2]] == ["a", "b", "c"]
+
+        touches = [call for call in self.client.calls if call[0] == "rpc"]
+        assert sorted((call[2]["session_uuid"], call[2]["message_delta"]) for call in touches) == [("s1", 2), ("s2", 1)]
+
+    def test_failed_batch_is_requeued_in_order(self):
+        """Test batch lỗi được đưa lại hàng đợi và ghi lại đúng thứ tự"""
+        self.client.fail_next = 1
+        self.queue.enqueue(self.client, _message("s1", "a", "2024-01-01T00:00:01"))
+        self.queue.enqueue(self.client, _message("s1", "b", "2024-01-01T00:00:02"))
+
+        assert not self.queue._flush_batch()
+        assert self.queue.pending_count("s1") == 2
+
+        assert self.queue.flush(timeout=5)
+        inserts = [call for call in self.client.calls if call[0] == "insert"]
+        assert [row["content"] for row in inserts[0][2]] == ["a", "b"]
+        assert self.queue.pending_count() == 0
+
+    def test_permanent_error_dead_letters_only_bad_messages(self):
+        """Test lỗi vĩnh viễn (khóa ngoại) chỉ bỏ tin nhắn lỗi, tin nhắn khác vẫn được ghi"""
+        self.client.deleted_sessions.add("gone")
+        for index, session_id in enumerate(["s1", "gone", "s1", "s2"]):
+            self.queue.enqueue(self.client, _message(session_id, str(index), f"2024-01-01T00:00:0{index}"))
+
+        assert self.queue.flush(timeout=5)
+
+        inserted = [row["content"] for call in self.client.calls if call[0] == "insert" for row in call[2]]
+        assert inserted == ["0", "2", "3"]
+        assert [message["content"] for message, _ in self.queue.dead_letters] == ["1"]
+        assert self.queue.pending_count() == 0
+
+    def test_transient_error_retry_cap(self):
+        """Test tin nhắn lỗi tạm thời quá max_attempts lần bị chuyển dead-letter"""
+        queue = MessageWriteQueue(flush_interval=60, batch_size=10, max_attempts=3)
+        self.client.fail_next = 100
+        queue.enqueue(self.client, _message("s1", "a", "2024-01-01T00:00:01"))
+
+        for _ in range(3):
+            assert not queue._flush_batch()
+
+        assert queue.pending_count() == 0
+        assert queue.stats["dead_lettered"] == 1
+
+    def test_flush_default_timeout(self):
+        """Test flush(timeout=None) không lặp vô hạn khi database lỗi"""
+        self.client.fail_next = 100
+        self.queue.enqueue(self.client, _message("s1", "a", "2024-01-01T00:00:01"))
+
+        assert not self.queue.flush(timeout=0.1)
+
+    def test_touch_rpc_disabled_only_when_missing(self):
+        """Test lỗi tạm thời của touch_chat_session không tắt RPC, lỗi thiếu function thì có"""
+        self.client.rpc_errors["touch_chat_session"] = ConnectionError("timeout")
+        self.queue.enqueue(self.client, _message("s1", "a", "2024-01-01T00:00:01"))
+        assert self.queue.flush(timeout=5)
+        assert self.queue._touch_rpc_available
+
+        self.client.rpc_errors["touch_chat_session"] = FakeAPIError(
+            "PGRST202", "Could not find the function public.touch_chat_session"
+        )
+        self.queue.enqueue(self.client, _message("s1", "b", "2024-01-01T00:00:02"))
+        assert self.queue.flush(timeout=5)
+        assert not self.queue._touch_rpc_available
+        assert ("rpc", "increment_message_count", {"session_uuid": "s1"}) in self.client.calls
+
+    def test_dead_letter_listener(self):
+        """Test listener được báo tin nhắn bị bỏ (để bỏ cache đã cập nhật lúc save_message)"""
+        dropped = []
+        self.queue.add_dead_letter_listener("test", lambda message, error: dropped.append(message["content"]))
+        self.queue.add_dead_letter_listener("broken", lambda message, error: 1 / 0)
+        self.client.deleted_sessions.add("gone")
+        self.queue.enqueue(self.client, _message("gone", "a", "2024-01-01T00:00:01"))
+        self.queue.enqueue(self.client, _message("s1", "b", "2024-01-01T00:00:02"))
+
+        assert self.queue.flush(timeout=5)
+        assert dropped == ["a"]
+
+class TestPermanentErrors:
+    """Test phân loại lỗi vĩnh viễn / tạm thời"""
+
+    def test_database_errors_permanent(self):
+        """Test mã lỗi database và lỗi ràng buộc SQLite là vĩnh viễn"""
+        assert is_permanent_error(FakeAPIError("23503", "violates foreign key constraint"))
+        assert is_permanent_error(FakeAPIError("PGRST204", "Could not find the column"))
+        assert is_permanent_error(sqlite3.IntegrityError("FOREIGN KEY constraint failed"))
+
+    def test_other_errors_transient(self):
+        """Test lỗi Python/kết nối không rõ nguồn gốc được retry thay vì dead-letter"""
+        assert not is_permanent_error(ValueError("bad value"))
+        assert not is_permanent_error(TypeError("unexpected type"))
+        assert not is_permanent_error(KeyError("id"))
+        assert not is_permanent_error(ConnectionError("database unavailable"))
+        assert not is_permanent_error(FakeAPIError("57014", "canceling statement due to statement timeout"))
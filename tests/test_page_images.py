@@ -0,0 +1,149 @@
+"""
+Unit tests cho cache ảnh trang PDF (PageImageCache)
+"""
+import sys
+import os
+import io
+import threading
+import time
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz
+import pytest
+from PIL import Image
+from src.utils.page_images import PageImageCache, dpi_bucket, image_nbytes, pixmap_to_image, encode_image
+from src.utils.document_processor import DocumentProcessor
+
+class FakeUpload(io.BytesIO):
+    """File upload giả của Streamlit"""
+
+    def __init__(self, data, name="test.pdf"):
+        super().__init__(data)
+        self.name = name
+        self.size = len(data)
+        self.file_id = name
+
+def make_pdf_upload(page_count, name="test.pdf"):
+    document = fitz.open()
+    for index in range(page_count):
+        page = document.new_page(width=200, height=300)
+        page.insert_text((20, 40), f"Trang {index + 1}")
+    data = document.tobytes()
+    document.close()
+    return FakeUpload(data, name)
+
+class TestPageImageCache:
+    """Test PageImageCache class"""
+
+    def test_dpi_bucket(self):
+        """Test DPI được làm tròn lên bucket"""
+        assert dpi_bucket(150) == 150
+        assert dpi_bucket(187) == 200
+        assert dpi_bucket(1000) == 300
+
+    def test_memory_bounded_by_bytes(self):
+        """Test tầng bộ nhớ giới hạn theo tổng byte"""
+        image = Image.new("RGB", (10, 10))
+        cache = PageImageCache(max_bytes=image_nbytes(image) * 2)
+        for page_number in range(1, 4):
+            cache.put(("doc", page_number, 150), image.copy())
+
+        assert ("doc", 1, 150) not in cache
+        assert ("doc", 3, 150) in cache
+
+    def test_concurrent_render_once(self):
+        """Test nhiều thread cùng yêu cầu một key chỉ render một lần"""
+        cache = PageImageCache()
+        calls = []
+
+        def render():
+            calls.append(1)
+            time.sleep(0.05)
+            return Image.new("RGB", (5, 5))
+
+        threads = [threading.Thread(target=cache.get_or_render, args=(("doc", 1, 150), render)) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+
+    def test_disk_tier(self, tmp_path):
+        """Test ảnh trên đĩa được dùng lại bởi cache mới (sau restart)"""
+        PageImageCache(disk_dir=str(tmp_path)).put(("doc", 2, 200), Image.new("RGB", (8, 6), "red"))
+
+        image = PageImageCache(disk_dir=str(tmp_path)).get(("doc", 2, 200))
+        assert image.size == (8, 6)
+        assert image.getpixel((0, 0)) == (255, 0, 0)
+
+class TestDocumentProcessorPageImages:
+    """Test render trang qua DocumentProcessor dùng cache"""
+
+    def test_pages_rasterized_once(self):
+        """Test lật qua lại các trang và đổi zoom trong cùng bucket không render lại"""
+        processor = DocumentProcessor()
+        processor.page_images = PageImageCache()
+        upload = make_pdf_upload(3, name="flip.pdf")
+
+        for _ in range(2):
+            for page_number in (1, 2, 3, 2, 1):
+                assert processor.extract_pdf_page_as_image(upload, page_number, dpi=187) is not None
+        processor.extract_pdf_page_as_image(upload, 1, dpi=200)
+
+        assert processor.page_images.stats["renders"] == 3
+
+    def test_thumbnail_tier(self):
+        """Test thumbnail có cạnh dài nhất bằng max_side và cache riêng"""
+        processor = DocumentProcessor()
+        processor.page_images = PageImageCache()
+        upload = make_pdf_upload(1, name="thumb.pdf")
+
+        thumbnail = processor.get_pdf_page_thumbnail(upload, 1, max_side=90)
+        assert max(thumbnail.size) == 90
+        assert processor.get_pdf_page_thumbnail(upload, 1, max_side=90) is thumbnail
+        assert processor.page_images.stats["renders"] == 1
+
+class TestPageImageEncoding:
+    """Test dựng ảnh từ pixmap và nén ảnh gửi xuống trình duyệt"""
+
+    def test_pixmap_to_image(self):
+        """Test ảnh dựng từ sample buffer giống ảnh đi qua PPM"""
+        document = fitz.open()
+        page = document.new_page(width=50, height=40)
+        page.draw_rect(fitz.Rect(0, 0, 25, 40), color=(1, 0, 0), fill=(1, 0, 0))
+        pixmap = page.get_pixmap()
+        document.close()
+
+        image = pixmap_to_image(pixmap)
+        expected = Image.open(io.BytesIO(pixmap.tobytes("ppm")))
+        assert image.mode == "RGB"
+        assert image.tobytes() == expected.tobytes()
+
+    def test_encode_formats(self):
+        """Test nén JPEG/WebP nhỏ hơn PNG và định dạng lạ bị từ chối"""
+        image = Image.effect_noise((200, 200), 40).convert("RGB")
+        jpeg = encode_image(image, "jpeg", 70)
+        webp = encode_image(image, "WEBP", 70)
+
+        assert Image.open(io.BytesIO(jpeg)).format == "JPEG"
+        assert Image.open(io.BytesIO(webp)).format == "WEBP"
+        assert len(jpeg) < len(encode_image(image, "PNG", 70))
+        with pytest.raises(ValueError):
+            encode_image(image, "BMP", 70)
+
+    def test_encoded_bytes_cached(self):
+        """Test bản nén được cache theo (key, định dạng, chất lượng)"""
+        processor = DocumentProcessor()
+        processor.page_images = PageImageCache()
+        upload = make_pdf_upload(2, name="encode.pdf")
+
+        first = processor.get_pdf_page_image_bytes(upload, 1, dpi=150, image_format="JPEG", quality=75)
+        assert processor.get_pdf_page_image_bytes(upload, 1, dpi=140, image_format="JPEG", quality=75) is first
+        processor.get_pdf_page_image_bytes(upload, 1, dpi=150, image_format="WEBP", quality=75)
+
+        assert first[:3] == b"\xff\xd8\xff"
+        assert processor.page_images.stats["renders"] == 1
+        assert processor.page_images.stats["encodes"] == 2
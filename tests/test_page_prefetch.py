@@ -0,0 +1,122 @@
+"""
+Unit tests cho prefetch nền các trang PDF kế bên
+"""
+import sys
+import os
+import threading
+import time
+from concurrent.futures import wait
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.page_prefetch import PagePrefetcher, neighbour_pages
+from src.utils.page_images import PageImageCache
+from src.utils.document_processor import DocumentProcessor
+from tests.test_page_images import make_pdf_upload
+
+class TestPagePrefetcher:
+    """Test PagePrefetcher class"""
+
+    def test_neighbour_pages(self):
+        """Test trang kế bên lấy theo danh sách trang đã chọn"""
+        assert neighbour_pages([2, 5, 9], 5) == [9, 2]
+        assert neighbour_pages([2, 5, 9], 9) == [5]
+        assert neighbour_pages([2, 5, 9], 4) == []
+
+    def test_prefetch_neighbours(self):
+        """Test trang sau và trang trước được prefetch ở background"""
+        prefetcher = PagePrefetcher(max_workers=2, max_in_flight=2)
+        done = []
+
+        futures = prefetcher.prefetch("s1", "sel", 5, [2, 5, 9], done.append)
+        wait(futures.values(), timeout=5)
+
+        assert sorted(done) == [2, 9]
+
+    def test_in_flight_cap_per_session(self):
+        """Test mỗi session chỉ có tối đa max_in_flight task chưa xong"""
+        prefetcher = PagePrefetcher(max_workers=2, max_in_flight=1)
+        release = threading.Event()
+
+        futures = prefetcher.prefetch("s1", "sel", 5, [2, 5, 9], lambda page: release.wait(5))
+        assert list(futures) == [9]
+        assert prefetcher.prefetch("s1", "sel", 5, [2, 5, 9], lambda page: None) == {}
+        assert list(prefetcher.prefetch("s2", "sel", 5, [2, 5, 9], lambda page: release.wait(5))) == [9]
+
+        release.set()
+        wait(futures.values(), timeout=5)
+        assert prefetcher.in_flight("s1") == 0
+
+    def test_selection_change_cancels(self):
+        """Test đổi selection hủy task cũ chưa chạy"""
+        prefetcher = PagePrefetcher(max_workers=1, max_in_flight=2)
+        release = threading.Event()
+        started = threading.Event()
+        done = []
+
+        def blocking_task(page_number):
+            started.set()
+            release.wait(5)
+            done.append(page_number)
+
+        old_futures = prefetcher.prefetch("s1", "old", 5, [2, 5, 9], blocking_task)
+        started.wait(5)
+        new_futures = prefetcher.prefetch("s1", "new", 1, [1, 3], done.append)
+        release.set()
+        wait(list(old_futures.values()) + list(new_futures.values()), timeout=5)
+
+        assert old_futures[2].cancelled()
+        assert done == [9, 3]
+
+    def test_sessions_bounded(self):
+        """Test trạng thái session bị giới hạn số lượng, session cũ nhất bị loại"""
+        prefetcher = PagePrefetcher(max_workers=1, max_in_flight=1, max_sessions=2)
+        for session_id in ("s1", "s2", "s3"):
+            wait(prefetcher.prefetch(session_id, "sel", 1, [1, 2], lambda page: None).values(), timeout=5)
+
+        assert prefetcher.active_sessions() == 2
+        assert "s1" not in prefetcher._sessions
+
+    def test_idle_session_expires(self):
+        """Test session không xem trang quá TTL bị bỏ, task chưa chạy của nó được bỏ qua"""
+        prefetcher = PagePrefetcher(max_workers=1, max_in_flight=2, session_ttl=0.05)
+        release = threading.Event()
+        started = threading.Event()
+        done = []
+
+        def blocking_task(page_number):
+            started.set()
+            release.wait(5)
+            done.append(page_number)
+
+        futures = prefetcher.prefetch("s1", "sel", 5, [2, 5, 9], blocking_task)
+        started.wait(5)
+        time.sleep(0.1)
+        assert prefetcher.in_flight("s1") == 0
+        release.set()
+        wait(futures.values(), timeout=5)
+
+        assert done == [9]
+
+class TestDocumentProcessorPrefetch:
+    """Test prefetch trang PDF thật qua DocumentProcessor"""
+
+    def test_prefetched_page_served_from_cache(self):
+        """Test trang đã prefetch không phải render lại khi người dùng chuyển tới"""
+        processor = DocumentProcessor()
+        processor.page_images = PageImageCache()
+        upload = make_pdf_upload(4, name="prefetch.pdf")
+        processor.extract_pdf_page_as_image(upload, 2, dpi=150)
+
+        prefetcher = PagePrefetcher()
+        futures = prefetcher.prefetch(
+            "s1", "sel", 2, [1, 2, 3],
+            lambda page_number: processor.prefetch_pdf_page(upload, page_number, 150)
+        )
+        wait(futures.values(), timeout=10)
+        renders = processor.page_images.stats["renders"]
+
+        processor.extract_pdf_page_as_image(upload, 3, dpi=150)
+        assert renders == 3
+        assert processor.page_images.stats["renders"] == 3
@@ -0,0 +1,59 @@
+"""
+Unit tests cho cache fitz.Document (PDFHandleCache)
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import fitz
+from src.utils.pdf_handles import PDFHandleCache
+
+def make_pdf(page_sizes):
+    """Tạo PDF nhỏ trong bộ nhớ với các trang có kích thước cho trước"""
+    document = fitz.open()
+    for width, height in page_sizes:
+        page = document.new_page(width=width, height=height)
+        page.insert_text((20, 40), f"Trang {document.page_count}")
+    data = document.tobytes()
+    document.close()
+    return data
+
+class TestPDFHandleCache:
+    """Test PDFHandleCache class"""
+
+    def setup_method(self):
+        self.loads = []
+
+    def _loader(self, data):
+        def load():
+            self.loads.append(1)
+            return data
+        return load
+
+    def test_opened_once_with_precomputed_metadata(self):
+        """Test PDF chỉ được đọc/mở một lần, số trang và kích thước tính sẵn"""
+        cache = PDFHandleCache(max_documents=2)
+        loader = self._loader(make_pdf([(200, 300), (400, 100)]))
+
+        handle = cache.get("a", loader)
+        assert cache.get("a", loader) is handle
+        assert len(self.loads) == 1
+        assert handle.page_count == 2
+        assert handle.page_size(2) == (400, 100)
+        assert handle.page_size(3) is None
+
+    def test_evicted_handle_closed(self):
+        """Test handle bị loại bỏ được đóng và mở lại khi cần"""
+        cache = PDFHandleCache(max_documents=1)
+        first = cache.get("a", self._loader(make_pdf([(100, 100)])))
+        cache.get("b", self._loader(make_pdf([(100, 100)])))
+
+        assert first.closed
+        assert "a" not in cache
+
+        with cache.open_document("a", self._loader(make_pdf([(100, 100)]))) as handle:
+            assert not handle.closed
+            assert handle.document[0].get_pixmap().width == 100
+        assert len(self.loads) == 3
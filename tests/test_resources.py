@@ -0,0 +1,49 @@
+"""
+Unit tests cho resource registry dùng chung
+"""
+import sys
+import os
+import threading
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.resources import get_resource, get_llm_client, get_mistral_client
+
+class TestResourceRegistry:
+    """Test get_resource và các client dùng chung"""
+
+    def test_factory_called_once(self):
+        """Test factory chỉ chạy một lần kể cả khi nhiều thread cùng gọi"""
+        calls = []
+
+        def factory():
+            calls.append(1)
+            return object()
+
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(get_resource("test_once", factory)))
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert len(calls) == 1
+        assert all(result is results[0] for result in results)
+
+    def test_llm_client_shared_per_url(self):
+        """Test cùng URL dùng chung một client"""
+        client_a = get_llm_client("http://localhost:1234/v1")
+        client_b = get_llm_client("http://localhost:1234/v1")
+        other = get_llm_client("http://localhost:5678/v1")
+
+        assert client_a is client_b
+        assert client_a is not other
+
+    def test_mistral_client_requires_key(self):
+        """Test không có API key thì không tạo client"""
+        assert get_mistral_client("") is None
+        assert get_mistral_client("key") is get_mistral_client("key")
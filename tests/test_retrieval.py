@@ -0,0 +1,174 @@
+"""
+Unit tests cho retrieval (BM25 index)
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+import uuid
+from types import SimpleNamespace
+
+import numpy as np
+
+from src.utils.retrieval import (
+    BM25Index, VectorIndex, RetrievalIndexRegistry, reciprocal_rank_fusion, tokenize
+)
+from src.utils.document_processor import DocumentProcessor
+from src.config.constants import EMBEDDING_BATCH_SIZE, RETRIEVAL_LATENCY_BUDGET_MS
+
+class TestTokenize:
+    """Test tokenize function"""
+
+    def test_removes_stop_words(self):
+        """Test bỏ stop words và dấu câu"""
+        tokens = tokenize("Machine learning là gì?")
+        assert tokens == ["machine", "learning"]
+
+    def test_empty_text(self):
+        """Test text rỗng"""
+        assert tokenize("") == []
+
+class TestBM25Index:
+    """Test BM25Index class"""
+
+    def setup_method(self):
+        self.index = BM25Index([
+            "Python là ngôn ngữ lập trình phổ biến.",
+            "Mạng neural gồm nhiều lớp neuron.",
+            "Gradient descent tối ưu hàm mất mát của mạng neural."
+        ])
+
+    def test_ranks_relevant_chunk_first(self):
+        """Test chunk liên quan nhất đứng đầu"""
+        results = self.index.search("gradient descent là gì?")
+        assert results[0][0] == 2
+
+    def test_multiple_matches(self):
+        """Test nhiều chunk cùng chứa từ khóa"""
+        results = self.index.search("mạng neural")
+        assert {chunk_id for chunk_id, _ in results} == {1, 2}
+        assert all(score > 0 for _, score in results)
+
+    def test_no_match(self):
+        """Test câu hỏi không có từ khóa nào trong tài liệu"""
+        assert self.index.search("blockchain") == []
+
+    def test_top_k(self):
+        """Test giới hạn số kết quả"""
+        assert len(self.index.search("mạng neural python", top_k=1)) == 1
+
+class TestRetrievalIndexRegistry:
+    """Test RetrievalIndexRegistry class"""
+
+    def test_get_put(self):
+        """Test lưu index theo nội dung tài liệu"""
+        registry = RetrievalIndexRegistry(max_documents=2)
+        text = "Nội dung tài liệu"
+        index = BM25Index([text])
+        registry.put(text, index)
+
+        assert registry.get("Nội dung " + "tài liệu") is index
+        assert registry.get("Tài liệu khác") is None
+
+class TestVectorIndex:
+    """Test VectorIndex class"""
+
+    def test_search_cosine(self):
+        """Test tìm vector gần nhất"""
+        index = VectorIndex([[1.0, 0.0], [0.0, 2.0], [1.0, 1.0]])
+        results = index.search([0.0, 1.0], top_k=2)
+
+        assert [chunk_id for chunk_id, _ in results] == [1, 2]
+        assert abs(results[0][1] - 1.0) < 1e-6
+        assert index.vectors.dtype == np.float32
+
+    def test_save_load(self, tmp_path):
+        """Test lưu và đọc lại vectors"""
+        index = VectorIndex([[3.0, 4.0]])
+        path = str(tmp_path / "vectors.npy")
+        index.save(path)
+
+        loaded = VectorIndex.load(path)
+        assert len(loaded) == 1
+        assert np.allclose(loaded.vectors, [[0.6, 0.8]])
+
+    def test_dimension_mismatch(self):
+        """Test vector truy vấn sai số chiều"""
+        index = VectorIndex([[1.0, 0.0]])
+        assert index.search([1.0, 0.0, 0.0]) == []
+
+class TestReciprocalRankFusion:
+    """Test reciprocal_rank_fusion function"""
+
+    def test_fuses_rankings(self):
+        """Test chunk đứng cao ở cả hai bảng xếp hạng được ưu tiên"""
+        lexical = [(1, 12.0), (2, 5.0), (3, 1.0)]
+        dense = [(2, 0.9), (4, 0.8), (1, 0.7)]
+        fused = reciprocal_rank_fusion([lexical, dense], k=60)
+
+        assert [chunk_id for chunk_id, _ in fused][:2] in ([1, 2], [2, 1])
+        assert {chunk_id for chunk_id, _ in fused} == {1, 2, 3, 4}
+
+    def test_single_ranking(self):
+        """Test giữ nguyên thứ tự khi chỉ có một bảng xếp hạng"""
+        fused = reciprocal_rank_fusion([[(5, 3.0), (7, 1.0)]])
+        assert [chunk_id for chunk_id, _ in fused] == [5, 7]
+
+class FakeEmbeddings:
+    def __init__(self, client):
+        self.client = client
+
+    def create(self, model, input):
+        self.client.calls.append((self.client.options, len(input)))
+        return SimpleNamespace(data=[
+            SimpleNamespace(index=i, embedding=[1.0, float(len(text) % 7)]) for i, text in enumerate(input)
+        ])
+
+class FakeOpenAI:
+    """OpenAI client giả, ghi lại options (with_options) của mỗi request embeddings"""
+
+    def __init__(self, calls=None, options=None):
+        self.calls = calls if calls is not None else []
+        self.options = options or {}
+        self.embeddings = FakeEmbeddings(self)
+
+    def with_options(self, **options):
+        return FakeOpenAI(self.calls, options)
+
+class TestDenseRetrievalBudget:
+    """Test nhánh dense của retrieve_chunks chạy trong ngân sách latency"""
+
+    def setup_method(self, method):
+        self.processor = DocumentProcessor()
+        self.processor.openai_client = FakeOpenAI()
+        self.processor._embeddings_available = True
+        self.budget = RETRIEVAL_LATENCY_BUDGET_MS / 1000
+
+    def _document(self, chunk_count):
+        marker = uuid.uuid4().hex
+        return " ".join(f"Đoạn {i} {marker} nói về gradient descent và mạng neural." * 8 for i in range(chunk_count))
+
+    def test_requests_without_retries_within_budget(self, tmp_path):
+        """Test embed tài liệu nhỏ và câu hỏi đều không retry, timeout không vượt ngân sách"""
+        self.processor.embeddings_dir = str(tmp_path)
+        self.processor.retrieve_chunks(f"gradient descent {uuid.uuid4().hex}?", self._document(2), mode='hybrid')
+
+        assert len(self.processor.openai_client.calls) == 2
+        for options, _ in self.processor.openai_client.calls:
+            assert options["max_retries"] == 0
+            assert 0 < options["timeout"] <= self.budget
+        assert self.processor.last_retrieval_stats['fallback'] is False
+
+    def test_large_document_not_embedded_at_query_time(self, tmp_path):
+        """Test tài liệu lớn chưa có embeddings thì dùng BM25, không embed cả tài liệu"""
+        self.processor.embeddings_dir = str(tmp_path)
+        document = self._document(EMBEDDING_BATCH_SIZE * 2)
+
+        index, ranked = self.processor.retrieve_chunks("gradient descent?", document, mode='hybrid')
+
+        assert len(index) > EMBEDDING_BATCH_SIZE
+        assert ranked
+        assert self.processor.openai_client.calls == []
+        assert self.processor.last_retrieval_stats['fallback'] is True
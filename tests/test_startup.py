@@ -0,0 +1,64 @@
+"""
+Unit tests cho thời gian khởi động: import trang login/home không kéo theo SDK nặng
+"""
+import sys
+import os
+import json
+import subprocess
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.config.constants import LOGIN_IMPORT_BUDGET_SECONDS, STARTUP_DEFERRED_MODULES, STYLE_CSS_PATH
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), '..')
+
+def measure_import(module_name):
+    """Import module trong process mới, trả về (số giây, các module nặng đã bị import)"""
+    code = (
+        "import json, sys, time\n"
+        "import streamlit\n"
+        "start = time.perf_counter()\n"
+        f"import {module_name}\n"
+        "elapsed = time.perf_counter() - start\n"
+        f"loaded = [name for name in {STARTUP_DEFERRED_MODULES!r} if name in sys.modules]\n"
+        "print(json.dumps({'elapsed': elapsed, 'loaded': loaded}))\n"
+    )
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=REPO_ROOT, capture_output=True, text=True, timeout=120
+    )
+    assert result.returncode == 0, result.stderr
+    measured = json.loads(result.stdout.strip().splitlines()[-1])
+    return measured['elapsed'], measured['loaded']
+
+class TestStartupImports:
+    """Test import-time của các trang"""
+
+    def test_login_page_import_budget(self):
+        """Test import login_page nằm trong ngân sách và không import SDK nặng"""
+        elapsed, loaded = measure_import("src.pages.login_page")
+        assert loaded == []
+        assert elapsed < LOGIN_IMPORT_BUDGET_SECONDS
+
+    def test_home_page_defers_heavy_modules(self):
+        """Test import home_page không kéo theo supabase, fitz, mistralai, openai..."""
+        _, loaded = measure_import("src.pages.home_page")
+        assert loaded == []
+
+class TestStaticAssets:
+    """Test CSS chỉ được đọc một lần cho cả process"""
+
+    def test_load_css_reads_once(self):
+        """Test lần load_css sau dùng nội dung đã cache"""
+        from src.pages import home_page
+        from src.utils.resources import get_resource
+
+        home_page.load_css()
+        cached = get_resource(("static_css", STYLE_CSS_PATH), lambda: "không được đọc lại")
+        assert cached == home_page.read_css()
+
+    def test_read_css_missing_file(self, tmp_path):
+        """Test fallback CSS mặc định khi không có file"""
+        from src.pages import home_page
+
+        assert home_page.read_css(str(tmp_path / "missing.css")) == home_page.DEFAULT_CSS
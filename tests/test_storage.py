@@ -0,0 +1,143 @@
+"""
+Unit tests cho SQLite storage backend (ChatPersistence chạy trên SQLite in-memory)
+"""
+import sys
+import os
+import uuid
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.cache import TTLCache
+from src.utils.chat_persistence import ChatPersistence
+from src.utils.message_queue import MessageWriteQueue
+from src.utils.storage import SQLiteBackend, get_storage_backend
+
+class TestSQLiteQuery:
+    """Test query builder tương thích Supabase"""
+
+    def setup_method(self):
+        self.backend = SQLiteBackend(":memory:")
+
+    def test_insert_select(self):
+        """Test insert nhiều dòng và select có filter/order/limit"""
+        result = self.backend.table("chat_sessions").insert([
+            {"user_id": "u1", "title": "A", "updated_at": "2024-01-01"},
+            {"user_id": "u1", "title": "B", "updated_at": "2024-01-02"},
+            {"user_id": "u2", "title": "C", "updated_at": "2024-01-03"}
+        ]).execute()
+        assert len(result.data) == 3
+        assert all(row["id"] for row in result.data)
+
+        rows = self.backend.table("chat_sessions").select("title").eq("user_id", "u1").order(
+            "updated_at", desc=True
+        ).limit(1).execute().data
+        assert rows == [{"title": "B"}]
+
+    def test_or_keyset_and_count(self):
+        """Test filter or_ dạng keyset và count query"""
+        self.backend.table("chat_sessions").insert([
+            {"id": f"s{index}", "user_id": "u1", "updated_at": f"2024-01-0{index}"} for index in range(1, 6)
+        ]).execute()
+
+        rows = self.backend.table("chat_sessions").select("id").or_(
+            'updated_at.lt."2024-01-03",and(updated_at.eq."2024-01-03",id.lt.s9)'
+        ).order("updated_at").execute().data
+        assert [row["id"] for row in rows] == ["s1", "s2", "s3"]
+
+        counted = self.backend.table("chat_sessions").select("id", count="exact", head=True).execute()
+        assert counted.count == 5
+        assert counted.data == []
+
+    def test_session_previews_rpc(self):
+        """Test RPC session_previews trả về tin nhắn user đầu tiên của mỗi session"""
+        self.backend.table("chat_sessions").insert([
+            {"id": session_id, "user_id": "u1"} for session_id in ("s1", "s2", "s3")
+        ]).execute()
+        self.backend.table("messages").insert([
+            {"session_id": "s1", "role": "assistant", "content": "Chào", "created_at": "2024-01-01T00:00:00"},
+            {"session_id": "s1", "role": "user", "content": "Đầu tiên", "created_at": "2024-01-01T00:00:01"},
+            {"session_id": "s1", "role": "user", "content": "Thứ hai", "created_at": "2024-01-01T00:00:02"},
+            {"session_id": "s2", "role": "user", "content": "x" * 150, "created_at": "2024-01-01T00:00:03"},
+            {"session_id": "s3", "role": "user", "content": "Không hỏi", "created_at": "2024-01-01T00:00:04"}
+        ]).execute()
+
+        rows = self.backend.rpc("session_previews", {"session_ids": ["s1", "s2"]}).execute().data
+        previews = {row["session_id"]: row["preview"] for row in rows}
+        assert previews == {"s1": "Đầu tiên", "s2": "x" * 100}
+
+    def test_unknown_rpc_raises(self):
+        """Test RPC không có thì báo lỗi (ChatPersistence dùng fallback)"""
+        try:
+            self.backend.rpc("not_a_function", {}).execute()
+            assert False
+        except ValueError:
+            pass
+
+    def test_backend_selection(self):
+        """Test chọn backend theo cấu hình"""
+        assert get_storage_backend("supabase", supabase_factory=lambda: "client") == "client"
+        try:
+            get_storage_backend("mongodb")
+            assert False
+        except ValueError:
+            pass
+
+class TestChatPersistenceOnSQLite:
+    """Test ChatPersistence end-to-end trên SQLite"""
+
+    def setup_method(self):
+        self.backend = SQLiteBackend(":memory:")
+        self.persistence = ChatPersistence(self.backend)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._content_cache = TTLCache(max_items=100, ttl=60)
+        self.persistence._write_queue = MessageWriteQueue(flush_interval=60)
+        self.user_id = str(uuid.uuid4())
+        self.session_id = self.persistence.create_session(self.user_id, "SQLite")
+        assert self.session_id
+
+    def test_messages_and_sessions(self):
+        """Test lưu tin nhắn qua write-behind queue, phân trang và danh sách sessions"""
+        for index in range(5):
+            self.persistence.save_message(self.user_id, self.session_id, "user", f"Câu hỏi {index}")
+        assert self.persistence._write_queue.flush(timeout=5)
+        self.persistence._cache = TTLCache(max_items=100, ttl=60)
+
+        messages, has_older = self.persistence.load_message_page(self.session_id, limit=3)
+        assert [message["content"] for message in messages] == ["Câu hỏi 2", "Câu hỏi 3", "Câu hỏi 4"]
+        assert has_older
+
+        sessions = self.persistence.get_user_sessions(self.user_id)
+        assert sessions[0]["preview"] == "Câu hỏi 0"
+        assert self.persistence.get_session_stats(self.session_id)["user_messages"] == 5
+
+    def test_dead_lettered_message_leaves_cache(self):
+        """Test tin nhắn không ghi được (session đã bị xóa) bị bỏ khỏi cache messages"""
+        self.persistence._write_queue.add_dead_letter_listener(
+            "chat_persistence_cache", self.persistence._on_message_dead_lettered
+        )
+        self.persistence.load_session_messages(self.session_id)
+        self.persistence.save_message(self.user_id, self.session_id, "user", "Mất")
+        assert [message["content"] for message in self.persistence.load_session_messages(self.session_id)] == ["Mất"]
+
+        self.backend.table("chat_sessions").delete().eq("id", self.session_id).execute()
+        assert self.persistence._write_queue.flush(timeout=5)
+
+        assert self.persistence._write_queue.stats["dead_lettered"] == 1
+        assert self.persistence.load_session_messages(self.session_id) == []
+
+    def test_documents_pages_and_cleanup(self):
+        """Test tài liệu, trang và retention job"""
+        document_id = self.persistence.save_document_to_session(
+            self.user_id, self.session_id, "a.pdf", "pdf", 10, "Toàn văn", page_count=2,
+            pages={1: "Trang 1", 2: "Trang 2"}
+        )
+        self.persistence._content_cache = TTLCache(max_items=100, ttl=60)
+
+        assert self.persistence.load_session_documents(self.session_id)[0]["id"] == document_id
+        assert self.persistence.load_document_page_content(document_id, 2) == "Trang 2"
+        assert self.persistence.load_document_content(document_id) == "Toàn văn"
+
+        assert self.persistence.cleanup_old_sessions(days_old=-1) == 1
+        assert self.persistence.last_cleanup_stats["pages"] == 2
+        assert self.backend.table("document_pages").select("id", count="exact", head=True).execute().count == 0
@@ -0,0 +1,111 @@
+"""
+Unit tests cho streaming phản hồi (ChatHandler.generate_response_stream, DocumentProcessor.answer_question_stream)
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from types import SimpleNamespace
+
+from src.utils.chat_handler import ChatHandler
+from src.utils.document_processor import DocumentProcessor
+from src.config.constants import DOCUMENT_ANSWER_PREFIX
+
+DOCUMENT = "Gradient descent tối ưu hàm mất mát bằng cách đi ngược hướng gradient. " * 5
+
+def make_chunk(content):
+    return SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=content))])
+
+class FakeStreamingLLM:
+    """Local LLM client giả: trả về stream các delta, có thể lỗi sau một số chunk"""
+
+    def __init__(self, deltas, fail_after=None):
+        self.deltas = deltas
+        self.fail_after = fail_after
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.create))
+
+    def create(self, **kwargs):
+        assert kwargs["stream"] is True
+        return self._stream()
+
+    def _stream(self):
+        for index, delta in enumerate(self.deltas):
+            if self.fail_after is not None and index == self.fail_after:
+                raise ConnectionError("connection reset by peer")
+            yield make_chunk(delta)
+        if self.fail_after is not None and self.fail_after >= len(self.deltas):
+            raise ConnectionError("connection reset by peer")
+
+def make_chat_handler(client):
+    handler = ChatHandler.__new__(ChatHandler)
+    handler.local_llm_url = "http://localhost:1234/v1"
+    handler.client = client
+    handler.api_key = "local_connected"
+    return handler
+
+def make_processor(client):
+    processor = DocumentProcessor()
+    processor.openai_client = client
+    processor._embeddings_available = False
+    return processor
+
+class TestChatResponseStream:
+    """Test ChatHandler.generate_response_stream"""
+
+    def test_yields_deltas(self):
+        """Test trả về từng delta, bỏ qua delta rỗng"""
+        handler = make_chat_handler(FakeStreamingLLM(["Xin ", None, "", "chào"]))
+        assert list(handler.generate_response_stream("hi", [])) == ["Xin ", "chào"]
+
+    def test_empty_stream_yields_fallback(self):
+        """Test stream không có token nào vẫn trả về thông báo (không lưu tin nhắn rỗng)"""
+        for deltas in ([], [None, ""]):
+            handler = make_chat_handler(FakeStreamingLLM(deltas))
+            response = "".join(handler.generate_response_stream("hi", []))
+            assert response.strip()
+            assert "Tạm thời không thể phản hồi" in response
+
+    def test_error_mid_stream(self):
+        """Test lỗi giữa stream giữ phần đã nhận và báo gián đoạn"""
+        handler = make_chat_handler(FakeStreamingLLM(["Xin ", "chào"], fail_after=1))
+        chunks = list(handler.generate_response_stream("hi", []))
+        assert chunks[0] == "Xin "
+        assert "gián đoạn" in chunks[-1]
+
+    def test_error_before_first_token(self):
+        """Test lỗi trước token đầu tiên trả về thông báo lỗi thân thiện"""
+        handler = make_chat_handler(FakeStreamingLLM(["Xin "], fail_after=0))
+        response = "".join(handler.generate_response_stream("hi", []))
+        assert "Lỗi kết nối Local LLM" in response
+
+class TestDocumentAnswerStream:
+    """Test DocumentProcessor.answer_question_stream"""
+
+    def test_yields_prefix_then_deltas(self):
+        """Test prefix chỉ xuất hiện trước token đầu tiên"""
+        processor = make_processor(FakeStreamingLLM([None, "Gradient ", "descent."]))
+        chunks = list(processor.answer_question_stream("Gradient descent là gì?", DOCUMENT))
+        assert chunks == [f"{DOCUMENT_ANSWER_PREFIX} ", "Gradient ", "descent."]
+
+    def test_empty_stream_yields_fallback(self):
+        """Test stream không có token nào fallback sang keyword answer"""
+        for deltas in ([], [None, ""]):
+            processor = make_processor(FakeStreamingLLM(deltas))
+            response = "".join(processor.answer_question_stream("Gradient descent là gì?", DOCUMENT))
+            assert response.strip()
+            assert response == processor._simple_keyword_answer("Gradient descent là gì?", DOCUMENT)
+
+    def test_error_mid_stream(self):
+        """Test lỗi giữa stream giữ phần đã nhận và báo gián đoạn"""
+        processor = make_processor(FakeStreamingLLM(["Gradient "], fail_after=1))
+        chunks = list(processor.answer_question_stream("Gradient descent là gì?", DOCUMENT))
+        assert chunks[:2] == [f"{DOCUMENT_ANSWER_PREFIX} ", "Gradient "]
+        assert "gián đoạn" in chunks[-1]
+
+    def test_error_before_first_token(self):
+        """Test lỗi trước token đầu tiên fallback sang keyword answer"""
+        processor = make_processor(FakeStreamingLLM(["Gradient "], fail_after=0))
+        response = "".join(processor.answer_question_stream("Gradient descent là gì?", DOCUMENT))
+        assert response == processor._simple_keyword_answer("Gradient descent là gì?", DOCUMENT)
@@ -0,0 +1,49 @@
+"""
+Unit tests cho ước lượng token và ngân sách context
+"""
+import sys
+import os
+
+# Add src to path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from src.utils.tokens import estimate_tokens, context_token_budget, truncate_to_tokens, chars_for_tokens
+
+class TestEstimateTokens:
+    """Test estimate_tokens function"""
+
+    def test_empty_text(self):
+        """Test text rỗng"""
+        assert estimate_tokens("") == 0
+
+    def test_vietnamese_denser_than_ascii(self):
+        """Test tiếng Việt có dấu tốn nhiều token hơn text ASCII cùng độ dài"""
+        vietnamese = "Học máy là một nhánh của trí tuệ nhân tạo"
+        ascii_text = "Hoc may la mot nhanh cua tri tue nhan tao"
+        assert len(vietnamese) == len(ascii_text)
+        assert estimate_tokens(vietnamese) > estimate_tokens(ascii_text)
+
+class TestContextBudget:
+    """Test context_token_budget và truncate_to_tokens"""
+
+    def test_budget_never_negative(self):
+        """Test ngân sách không âm"""
+        assert context_token_budget(500, 100, context_window=4000) > 0
+        assert context_token_budget(5000, 0, context_window=4000) == 0
+
+    def test_truncate_fits_budget(self):
+        """Test cắt text vừa ngân sách token"""
+        text = "Việt Nam đất nước con người. " * 500
+        truncated = truncate_to_tokens(text, 300)
+
+        assert estimate_tokens(truncated) <= 300
+        assert text.startswith(truncated)
+        assert len(truncated) > 0
+
+    def test_short_text_unchanged(self):
+        """Test text ngắn giữ nguyên"""
+        assert truncate_to_tokens("Xin chào", 100) == "Xin chào"
+
+    def test_chars_for_tokens(self):
+        """Test quy đổi token sang số ký tự"""
+        assert chars_for_tokens("a" * 400, 50) == 200